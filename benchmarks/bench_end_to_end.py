@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+
+'''Benchmark whole runs against the local stand-in server.
+
+Starts standin_server in its own process, then runs the downloader against
+it in a child process for each combination of workers and download
+segments, so the CPU time and peak memory are only the client's. The
+"crawl" mode walks the listing and video pages with HelixDownloader, the
+"metadata" and "download" modes run __main__.download like the command
+line does. Each run reports the page requests per second, the download
+throughput, the CPU time, the peak memory, and the number of videos that
+arrived complete.
+
+Latency, bandwidth and failures are injected by the server, see the
+options. Results can be saved as a baseline and compared like the parser
+benchmarks: slower pages or downloads, or more CPU or memory, than the
+baseline by more than the threshold is a regression, and the exit code is 1.
+
+	PYTHONPATH=src python benchmarks/bench_end_to_end.py --mode download --workers 1 4 --latency 0.02
+'''
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import resource
+import tempfile
+import itertools
+import multiprocessing
+
+from argparse import Namespace
+
+import requests
+
+sys.path.insert(0, os.path.dirname(__file__))
+import standin_server
+
+from helixstudios import SettingsContainer
+from helixstudios import __main__ as cli
+from helixstudios.downloader import HelixDownloader
+from helixstudios.utils import string_to_bytes
+
+
+MB = 1024 * 1024
+
+# the client's figures that are better when higher, and when lower
+HIGHER_IS_BETTER = ('pages_per_second', 'mb_per_second')
+LOWER_IS_BETTER = ('cpu_seconds', 'peak_rss_mb')
+
+
+def client_settings(url, folder, workers, download_segments):
+	'''Settings like settings.yaml, pointing at the stand-in server and
+	keeping everything in the temporary folder'''
+
+	return {
+		'session': {
+			'username': standin_server.USERNAME,
+			'password': standin_server.PASSWORD,
+			'session': os.path.join(folder, 'session.json'),
+			'session_refresh_margin': 0,
+			'timeout': 20,
+			'page_concurrency': {'initial': 2, 'min': 1, 'max': 16, 'latency_tolerance': 2.0},
+			'progress': {'interval': 3600},
+			'connection_pool': {'pool_connections': 4, 'pool_maxsize': 4 * workers * download_segments + 8},
+			'download_segments': download_segments,
+			'checksum': 'sha256',
+			'vod_workers': 8,
+			'watermark': os.path.join(folder, 'watermark.json'),
+			'listing_read_ahead': 2,
+			'links': {
+				'members': f'{url}/members/',
+				'videos': f'{url}/members/videos/'
+			}
+		},
+		'library': {
+			'download_root': os.path.join(folder, 'library'),
+			'additional_library_folders': [],
+			'save_video_page_to_library': True,
+			'video_page_filename': '.page.html',
+			'save_json_data_to_library': True,
+			'json_data_filename': '.data.json',
+			'save_checksums_to_library': True,
+			'checksums_filename': '.checksums.json'
+		},
+		'logging': {'enabled': False}
+	}
+
+
+def run_client(url, mode, workers, download_segments, video_limit, results):
+	'''One run of the downloader, in its own process'''
+
+	with tempfile.TemporaryDirectory() as folder:
+		settings = SettingsContainer(client_settings(url, folder, workers, download_segments))
+		cli.log = logging.getLogger('helixstudios')
+
+		wall, cpu = time.perf_counter(), time.process_time()
+
+		if mode == 'crawl':
+			downloader = HelixDownloader(settings)
+			try:
+				for _ in downloader.all_video_pages(video_limit=video_limit):
+					pass
+			finally:
+				downloader.session.close()
+		else:
+			args = Namespace(page_limit=None, video_limit=video_limit, retry_count=10, workers=workers,
+							 incremental=False, rebuild_index=False, force_download_video=False,
+							 metadata_only=mode == 'metadata')
+			cli.download(args, settings)
+
+		wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+
+		videos = {}
+		for root, _, files in os.walk(os.path.join(folder, 'library')):
+			for name in files:
+				if name.endswith('.mp4'):
+					videos[name] = os.path.getsize(os.path.join(root, name))
+
+	results.put({
+		'wall_seconds': wall,
+		'cpu_seconds': cpu,
+		'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+		'videos': videos
+	})
+
+
+def expected_size(config, video_name):
+	'''The size a complete download of the video should have'''
+
+	n = int(video_name.split('_')[1])
+	if standin_server.is_streaming(config, n):
+		return config['segments'] * config['segment_size']
+	return config['video_size']
+
+
+def measure(url, config, mode, workers, download_segments, video_limit, quiet):
+	'''Run the client once, and work out its figures from the server's counts'''
+
+	before = requests.get(f'{url}/__stats').json()
+
+	results = multiprocessing.Queue()
+	client = multiprocessing.Process(target=run_client,
+									 args=(url, mode, workers, download_segments, video_limit, results))
+
+	# the progress lines go to stderr, the client inherits it when it starts
+	stderr = os.dup(2)
+	with open(os.devnull, 'w') as devnull:
+		if quiet:
+			os.dup2(devnull.fileno(), 2)
+		try:
+			client.start()
+		finally:
+			os.dup2(stderr, 2)
+			os.close(stderr)
+
+	result = results.get()
+	client.join()
+
+	after = requests.get(f'{url}/__stats').json()
+	requests_served = {k: v - before['requests'].get(k, 0) for k, v in after['requests'].items()}
+	pages = requests_served.get('listing', 0) + requests_served.get('video_page', 0)
+
+	complete = sum(1 for name, size in result['videos'].items() if size == expected_size(config, name))
+	downloaded = sum(result['videos'].values())
+
+	return {
+		'mode': mode,
+		'workers': workers,
+		'download_segments': download_segments,
+		'wall_seconds': round(result['wall_seconds'], 3),
+		'pages': pages,
+		'pages_per_second': round(pages / result['wall_seconds'], 2),
+		'mb_downloaded': round(downloaded / MB, 1),
+		'mb_per_second': round(downloaded / MB / result['wall_seconds'], 2),
+		'cpu_seconds': round(result['cpu_seconds'], 3),
+		'peak_rss_mb': round(result['peak_rss_mb'], 1),
+		'videos_complete': complete,
+		'videos_started': len(result['videos']),
+		'errors_injected': after['errors_injected'] - before['errors_injected'],
+		'drops_injected': after['drops_injected'] - before['drops_injected'],
+		'requests': requests_served
+	}
+
+
+def compare(result, baseline, threshold):
+	'''The figures that got worse than the baseline by more than the threshold'''
+
+	worse = [key for key in HIGHER_IS_BETTER if baseline[key] and result[key] < baseline[key] * (1 - threshold)]
+	worse += [key for key in LOWER_IS_BETTER if baseline[key] and result[key] > baseline[key] * (1 + threshold)]
+	return worse
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Benchmark whole runs against a local stand-in server')
+	parser.add_argument('--mode', choices=['crawl', 'metadata', 'download'], default='download')
+	parser.add_argument('--workers', type=int, nargs='+', default=[1], help='videos downloaded at once')
+	parser.add_argument('--download-segments', type=int, nargs='+', default=[4],
+						help='connections per video download')
+	parser.add_argument('--video-limit', type=int, default=None, help='stop after this many videos')
+
+	parser.add_argument('--pages', type=int, default=3, help='listing pages on the server')
+	parser.add_argument('--per-page', type=int, default=10, help='videos on each listing page')
+	parser.add_argument('--video-size', default='8MB', help='size of each video file')
+	parser.add_argument('--stream-every', type=int, default=5,
+						help='every n-th video is only available as a stream, 0 for none')
+	parser.add_argument('--segments', type=int, default=40, help='segments of each stream')
+	parser.add_argument('--segment-size', default='128kB', help='size of each stream segment')
+	parser.add_argument('--no-ranges', default=False, action='store_true',
+						help='the server ignores "Range" headers')
+	parser.add_argument('--latency', type=float, default=0.0, help='seconds added before every response')
+	parser.add_argument('--bandwidth', default=None, help='bandwidth of each connection, e.g. "10MB"')
+	parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of pages answered with a 500')
+	parser.add_argument('--drop-rate', type=float, default=0.0,
+						help='fraction of files and segments cut off halfway')
+
+	parser.add_argument('--save', default=None, help='save the results as a baseline to this file')
+	parser.add_argument('--compare', default=None, help='compare the results with this baseline file')
+	parser.add_argument('--threshold', type=float, default=0.2,
+						help='worse than the baseline by this fraction is a regression')
+	parser.add_argument('--verbose', default=False, action='store_true', help="show the client's progress output")
+	args = parser.parse_args()
+
+	config = {
+		'pages': args.pages,
+		'per_page': args.per_page,
+		'video_size': string_to_bytes(args.video_size),
+		'stream_every': args.stream_every,
+		'segments': args.segments,
+		'segment_size': string_to_bytes(args.segment_size),
+		'ranges': not args.no_ranges,
+		'latency': args.latency,
+		'bandwidth': string_to_bytes(args.bandwidth) if args.bandwidth else None,
+		'error_rate': args.error_rate,
+		'drop_rate': args.drop_rate,
+	}
+
+	port_queue = multiprocessing.Queue()
+	server = multiprocessing.Process(target=standin_server.serve, args=(config, port_queue), daemon=True)
+	server.start()
+	url = f'http://127.0.0.1:{port_queue.get()}'
+
+	baseline = {}
+	if args.compare is not None:
+		with open(args.compare) as f:
+			baseline = {(r['mode'], r['workers'], r['download_segments']): r for r in json.load(f)['results']}
+
+	print(f'{"mode":<9} {"workers":>7} {"segs":>5} {"seconds":>8} {"pages/s":>8} {"MB/s":>8} '
+		  f'{"CPU s":>7} {"peak MB":>8} {"complete":>9}')
+
+	results = []
+	regressions = []
+	try:
+		for workers, download_segments in itertools.product(args.workers, args.download_segments):
+			result = measure(url, config, args.mode, workers, download_segments, args.video_limit, not args.verbose)
+			results.append(result)
+
+			line = (f'{result["mode"]:<9} {workers:>7} {download_segments:>5} {result["wall_seconds"]:8.2f} '
+					f'{result["pages_per_second"]:8.1f} {result["mb_per_second"]:8.1f} {result["cpu_seconds"]:7.2f} '
+					f'{result["peak_rss_mb"]:8.1f} {result["videos_complete"]:>4}/{result["videos_started"]:<4}')
+
+			key = (args.mode, workers, download_segments)
+			if key in baseline:
+				worse = compare(result, baseline[key], args.threshold)
+				if worse:
+					line += '  REGRESSION: ' + ', '.join(worse)
+					regressions.append(key)
+
+			print(line)
+	finally:
+		server.terminate()
+
+	if args.save is not None:
+		with open(args.save, 'w') as f:
+			json.dump({'server': config, 'results': results}, f, indent=4)
+
+	if regressions:
+		print(f'\n{len(regressions)} regressions against {args.compare}')
+		return 1
+
+
+if __name__ == '__main__':
+	sys.exit(main())
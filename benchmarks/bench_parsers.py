@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+
+'''Benchmark the page parsers, and each of the fields they extract.
+
+Runs every parser over the sample pages in tests/samples (if they've been
+downloaded with tests/download_samples.py) and over synthetic pages that
+can be scaled well past them, e.g. a listing of 500 thumbnails and a
+stream of 10,000 segments. Each case reports the median and fastest time,
+and the peak memory allocated while it ran. Parsing the page is its own
+case, so the time of a field is only the time of finding it in the tree.
+Pages are parsed like the downloader does, only the sections the parser
+needs, and "parse-whole" cases parse the whole page for comparison.
+
+The HTML pages are parsed with each of the --engines, see parse_engine.
+Cases of engines other than "html.parser" are tagged with the engine,
+e.g. "video[lxml]/parse", so the engines can be compared side by side.
+
+Results can be saved as a baseline, and later runs compared against it.
+A case whose fastest run is slower, or which uses more memory, than the
+baseline by more than the threshold is reported as a regression, and the
+exit code is 1.
+
+	PYTHONPATH=src python benchmarks/bench_parsers.py --save baseline.json
+	PYTHONPATH=src python benchmarks/bench_parsers.py --compare baseline.json
+	PYTHONPATH=src python benchmarks/bench_parsers.py --engines html.parser lxml lightweight --filter /parse
+'''
+
+import os
+import gc
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import tracemalloc
+
+from functools import partial
+from collections import namedtuple
+
+import bs4
+
+sys.path.insert(0, os.path.dirname(__file__))
+import synthetic_pages
+
+from helixstudios.parse_utils import flatten_html
+from helixstudios.parse_engine import ENGINES, DEFAULT_ENGINE, engine_available
+from helixstudios.parse_video import VideoPage
+from helixstudios.parse_video_listing import VideoListingPage
+from helixstudios.parse_model import ModelPage
+from helixstudios.parse_m3u8 import M3U8PlaylistFile
+from helixstudios.parse_m3u8 import M3U8Stream
+
+
+SAMPLES_FOLDER = os.path.join(os.path.dirname(__file__), '..', 'tests', 'samples')
+
+VIDEO_URL = synthetic_pages.LISTING_URL + synthetic_pages.video_slug(1) + '/'
+MODEL_URL = synthetic_pages.BASE_URL + 'members/models/model-1/'
+PLAYLIST_URL = synthetic_pages.BASE_URL + 'members/vod/1/playlist.m3u8'
+STREAM_URL = synthetic_pages.BASE_URL + 'members/vod/1/stream-1080p/index.m3u8'
+
+VIDEO_FIELDS = ['title', 'description', 'studio_name', 'director', 'released', 'view_count', 'like_count',
+				'banner_image_link', 'video_thumbnail_image_link', 'cast', 'tags', 'downloads',
+				'photo_link_list', 'vod_playlist_url']
+MODEL_FIELDS = ['model_name', 'description', 'stats']
+
+
+# differences smaller than these are noise, not regressions
+MIN_TIME_DIFFERENCE = 0.0002   # seconds
+MIN_PEAK_DIFFERENCE = 16 * 1024   # bytes
+
+# a case is timed by calling `run(setup())`, only the run is measured
+Case = namedtuple('Case', ['name', 'setup', 'run'])
+
+
+def _attribute(name):
+	return lambda page: getattr(page, name)
+
+
+def page_cases(name, parser, text, url, fields, methods=()):
+	'''Parsing the sections of the page, and the whole page, then each of
+	its fields on a freshly parsed page'''
+
+	yield Case(f'{name}/parse', lambda: text, lambda t: parser(t, url))
+	yield Case(f'{name}/parse-whole', lambda: text, lambda t: parser(t, url, strain=False))
+
+	for field in fields:
+		yield Case(f'{name}/{field}', lambda: parser(text, url), _attribute(field))
+
+	for method in methods:
+		yield Case(f'{name}/{method}()', lambda: parser(text, url), lambda page, m=method: getattr(page, m)())
+
+
+def _engine_name(name, engine):
+	return name if engine == DEFAULT_ENGINE else f'{name}[{engine}]'
+
+
+def listing_cases(name, text, engine=DEFAULT_ENGINE):
+	parser = partial(VideoListingPage, engine=engine)
+	name = _engine_name(name, engine)
+
+	yield from page_cases(name, parser, text, synthetic_pages.LISTING_URL, ['next_page'], ['all_videos'])
+	# the downloader reads both from every listing page
+	yield Case(f'{name}/all_videos()+next_page', lambda: parser(text, synthetic_pages.LISTING_URL),
+			   lambda page: (page.all_videos(), page.next_page))
+	yield Case(f'{name}/flatten_html', lambda: parser(text, synthetic_pages.LISTING_URL, strain=False).page.body,
+			   flatten_html)
+
+
+def video_cases(name, text, engine=DEFAULT_ENGINE):
+	parser = partial(VideoPage, engine=engine)
+	name = _engine_name(name, engine)
+
+	yield from page_cases(name, parser, text, VIDEO_URL, VIDEO_FIELDS, ['details_dictionary'])
+	yield Case(f'{name}/flatten_html', lambda: parser(text, VIDEO_URL, strain=False).page.body, flatten_html)
+
+
+def model_cases(name, text, engine=DEFAULT_ENGINE):
+	yield from page_cases(_engine_name(name, engine), partial(ModelPage, engine=engine), text, MODEL_URL,
+						  MODEL_FIELDS)
+
+
+# the m3u8 files aren't HTML, they're parsed the same whatever the engine
+def playlist_cases(name, text):
+	yield Case(f'{name}/all_streams()', lambda: M3U8PlaylistFile(text, PLAYLIST_URL),
+			   lambda playlist: playlist.all_streams())
+	yield Case(f'{name}/highest_bandwidth_stream', lambda: M3U8PlaylistFile(text, PLAYLIST_URL),
+			   lambda playlist: playlist.highest_bandwidth_stream)
+
+
+def stream_cases(name, text):
+	yield Case(f'{name}/all_chunks()', lambda: M3U8Stream(text, STREAM_URL), lambda stream: stream.all_chunks())
+
+
+# the sample pages saved by tests/download_samples.py
+SAMPLES = [
+	('sample-listing', 'video_listing.html', listing_cases),
+	('sample-video', 'video.html', video_cases),
+	('sample-model', 'model.html', model_cases),
+]
+M3U8_SAMPLES = [
+	('sample-playlist', 'vod_playlist.m3u8', playlist_cases),
+	('sample-stream', 'vod_stream.m3u8', stream_cases),
+]
+
+
+def _read_samples(samples_folder, samples):
+	for name, filename, cases in samples:
+		path = os.path.join(samples_folder, filename)
+		if os.path.isfile(path):
+			with open(path) as f:
+				yield name, f.read(), cases
+
+
+def all_cases(samples_folder=SAMPLES_FOLDER, engines=(DEFAULT_ENGINE,)):
+	'''Every benchmark case, over the samples that exist and the synthetic
+	pages, with each of the engines'''
+
+	for engine in engines:
+		for name, text, cases in _read_samples(samples_folder, SAMPLES):
+			yield from cases(name, text, engine)
+
+		yield from listing_cases('listing-50', synthetic_pages.listing_page(50), engine)
+		yield from listing_cases('listing-500', synthetic_pages.listing_page(500), engine)
+		yield from video_cases('video', synthetic_pages.video_page(), engine)
+		yield from video_cases('video-large', synthetic_pages.video_page(cast=20, tags=200, photos=500, paragraphs=40),
+							   engine)
+		yield from model_cases('model', synthetic_pages.model_page(), engine)
+
+	for name, text, cases in _read_samples(samples_folder, M3U8_SAMPLES):
+		yield from cases(name, text)
+
+	yield from playlist_cases('playlist', synthetic_pages.vod_playlist())
+	yield from stream_cases('stream-10k', synthetic_pages.vod_stream(10000))
+
+
+def measure(case, repeat):
+	'''Time the case `repeat` times, then measure its peak memory once. The
+	memory is measured on its own run, as tracing slows everything down.'''
+
+	times = []
+	for _ in range(repeat):
+		arg = case.setup()
+		gc.collect()
+
+		start = time.perf_counter()
+		case.run(arg)
+		times.append(time.perf_counter() - start)
+
+	arg = case.setup()
+	gc.collect()
+	tracemalloc.start()
+	case.run(arg)
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+
+	return {'median': statistics.median(times), 'min': min(times), 'peak': peak}
+
+
+def compare(result, baseline, threshold):
+	'''The ratios to the baseline, and whether either is a regression. The
+	fastest run is compared, it's the least disturbed by the rest of the 
+	machine.'''
+
+	time_ratio = result['min'] / baseline['min'] if baseline['min'] else 1.0
+	memory_ratio = result['peak'] / baseline['peak'] if baseline['peak'] else 1.0
+
+	slower = time_ratio > 1 + threshold and result['min'] - baseline['min'] > MIN_TIME_DIFFERENCE
+	bigger = memory_ratio > 1 + threshold and result['peak'] - baseline['peak'] > MIN_PEAK_DIFFERENCE
+	return time_ratio, memory_ratio, slower or bigger
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Benchmark the page parsers')
+	parser.add_argument('--repeat', type=int, default=5, help='the median of this many runs is reported')
+	parser.add_argument('--filter', nargs='*', default=[], help='only run the cases containing one of these')
+	parser.add_argument('--samples', default=SAMPLES_FOLDER, help='the folder of sample pages')
+	parser.add_argument('--engines', nargs='+', choices=ENGINES, default=[DEFAULT_ENGINE],
+						help='parse the HTML pages with each of these engines')
+	parser.add_argument('--save', default=None, help='save the results as a baseline to this file')
+	parser.add_argument('--compare', default=None, help='compare the results with this baseline file')
+	parser.add_argument('--threshold', type=float, default=0.2,
+						help='slower or bigger than the baseline by this fraction is a regression')
+	args = parser.parse_args()
+
+	for engine in args.engines:
+		if not engine_available(engine):
+			parser.error(f'the "{engine}" engine needs the {engine} package to be installed')
+
+	baseline = {}
+	if args.compare is not None:
+		with open(args.compare) as f:
+			baseline = json.load(f)['results']
+
+	header = f'{"case":<52} {"median ms":>10} {"min ms":>9} {"peak kB":>9}'
+	print(header + ('   time x   mem x' if baseline else ''))
+	print('-' * (len(header) + (17 if baseline else 0)))
+
+	results = {}
+	regressions = []
+	for case in all_cases(args.samples, args.engines):
+		if args.filter and not any(f in case.name for f in args.filter):
+			continue
+
+		result = results[case.name] = measure(case, args.repeat)
+		line = (f'{case.name:<52} {result["median"] * 1000:10.3f} {result["min"] * 1000:9.3f} '
+				f'{result["peak"] / 1024:9.1f}')
+
+		if case.name in baseline:
+			time_ratio, memory_ratio, regression = compare(result, baseline[case.name], args.threshold)
+			line += f'   {time_ratio:6.2f} {memory_ratio:6.2f}' + ('  REGRESSION' if regression else '')
+			if regression:
+				regressions.append(case.name)
+
+		print(line)
+
+	if args.save is not None:
+		with open(args.save, 'w') as f:
+			json.dump({
+				'python': platform.python_version(),
+				'beautifulsoup': bs4.__version__,
+				'engines': args.engines,
+				'results': results
+			}, f, indent=4)
+
+	if regressions:
+		print(f'\n{len(regressions)} regressions against {args.compare}')
+		return 1
+
+
+if __name__ == '__main__':
+	sys.exit(main())
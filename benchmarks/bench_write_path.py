@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+'''Benchmark the download write path against a local HTTP server.
+
+Compares the old write loop (32kB `iter_content` chunks appended to a
+buffered file) with the current one (reads sized to the throughput, written
+unbuffered into a preallocated file), and reports the throughput and the
+CPU time used per GB downloaded. The server runs in its own process, so
+only the downloading side is measured.
+
+	PYTHONPATH=src python benchmarks/bench_write_path.py --size 1GB
+'''
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import multiprocessing
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+from helixstudios.utils import string_to_bytes
+from helixstudios.writer import WritePolicy
+from helixstudios.writer import preallocate
+from helixstudios.writer import write_response
+
+
+GB = 1024 * 1024 * 1024
+
+
+def serve(size, port_queue):
+	'''Serve `size` bytes of data for any GET request'''
+
+	block = os.urandom(1024 * 1024)
+
+	class Handler(BaseHTTPRequestHandler):
+		protocol_version = 'HTTP/1.1'
+
+		def log_message(self, *args):
+			pass
+
+		def do_GET(self):
+			self.send_response(200)
+			self.send_header('Content-Length', str(size))
+			self.end_headers()
+
+			remaining = size
+			view = memoryview(block)
+			while remaining > 0:
+				n = min(remaining, len(block))
+				self.wfile.write(view[:n])
+				remaining -= n
+
+	server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+	port_queue.put(server.server_port)
+	server.serve_forever()
+
+
+def old_write_path(session, url, path, size):
+	resp = session.get(url, stream=True)
+	with open(path, 'ab') as f:
+		for chunk in resp.iter_content(chunk_size=32 * 1024):
+			if len(chunk) > 0:
+				f.write(chunk)
+			f.tell()
+
+
+def new_write_path(session, url, path, size):
+	resp = session.get(url, stream=True)
+	preallocate(path, size)
+	with open(path, 'r+b', buffering=0) as f:
+		write_response(resp, f, WritePolicy(), end=size - 1)
+
+
+def measure(name, write_path, url, size, folder, repeat):
+	session = requests.Session()
+	best = None
+
+	for i in range(repeat):
+		path = os.path.join(folder, f'{name}-{i}.bin')
+
+		wall, cpu = time.perf_counter(), time.process_time()
+		write_path(session, url, path, size)
+		wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+
+		assert os.path.getsize(path) == size
+		os.remove(path)
+
+		if best is None or wall < best[0]:
+			best = (wall, cpu)
+
+	wall, cpu = best
+	print(f'{name:>6}: {size / wall / 1024 / 1024:8.1f} MB/s  {cpu / (size / GB):6.2f} CPU s/GB')
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Benchmark the download write path')
+	parser.add_argument('--size', default='512MB', help='the size of the test download')
+	parser.add_argument('--repeat', type=int, default=3, help='the best of this many runs is reported')
+	parser.add_argument('--folder', default=None, help='write the test files here instead of a temp folder')
+	args = parser.parse_args()
+
+	size = string_to_bytes(args.size)
+
+	port_queue = multiprocessing.Queue()
+	server = multiprocessing.Process(target=serve, args=(size, port_queue), daemon=True)
+	server.start()
+	url = f'http://127.0.0.1:{port_queue.get()}/video.mp4'
+
+	with tempfile.TemporaryDirectory(dir=args.folder) as folder:
+		measure('old', old_write_path, url, size, folder, args.repeat)
+		measure('new', new_write_path, url, size, folder, args.repeat)
+
+	server.terminate()
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+
+'''A local stand-in for the website, to benchmark whole runs offline.
+
+It serves the members page behind basic auth, which sets the session
+cookie the other pages need, paginated video listings, video pages,
+download links that redirect to range capable mp4 files, and the HLS
+playlists and segments of streaming-only videos. Every response can be
+slowed down by a fixed latency and a per connection bandwidth, and a
+fraction of them can fail: pages with a 500, files and segments by
+dropping the connection halfway through the body.
+
+The pages come from synthetic_pages, so they have everything the parsers
+look for. Request counts are served as JSON from /__stats.
+
+	python benchmarks/standin_server.py --port 8080 --latency 0.05
+'''
+
+import os
+import re
+import sys
+import json
+import time
+import base64
+import random
+import argparse
+import threading
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, os.path.dirname(__file__))
+import synthetic_pages
+
+
+USERNAME = 'benchmark'
+PASSWORD = 'benchmark'
+SESSION_COOKIE = 'helix_session'
+
+QUALITIES = (360, 480, 720)
+
+# bandwidth limited bodies are sent in pieces of this size
+SEND_BLOCK = 64 * 1024
+
+
+DEFAULT_CONFIG = {
+	'pages': 5,                     # listing pages
+	'per_page': 20,                 # videos on each listing page
+	'video_size': 8 * 1024 * 1024,  # bytes of each mp4 file
+	'stream_every': 0,              # every n-th video is streaming only, 0 for none
+	'segments': 50,                 # segments of each stream
+	'segment_size': 256 * 1024,     # bytes of each segment
+	'ranges': True,                 # whether files honour the "Range" header
+	'latency': 0.0,                 # seconds before every response
+	'bandwidth': None,              # bytes per second of each connection, None for unlimited
+	'error_rate': 0.0,              # fraction of pages answered with a 500
+	'drop_rate': 0.0,               # fraction of files and segments cut off halfway
+	'seed': 1,
+}
+
+
+def video_count(config):
+	return config['pages'] * config['per_page']
+
+
+def is_streaming(config, n):
+	return config['stream_every'] > 0 and n % config['stream_every'] == 0
+
+
+def file_data(n, offset, length):
+	'''`length` bytes of the file of video `n` from `offset`, the same every
+	time they're asked for'''
+
+	pattern = bytes((n + i) % 251 for i in range(251))
+	start = offset % len(pattern)
+	repeats = (start + length) // len(pattern) + 1
+	return (pattern * repeats)[start:start + length]
+
+
+class StandInState:
+	'''The counters and the random failures shared by all handler threads'''
+
+	def __init__(self, config):
+		self.config = config
+		self._random = random.Random(config['seed'])
+		self._lock = threading.Lock()
+		self.stats = {'requests': {}, 'bytes_sent': 0, 'errors_injected': 0, 'drops_injected': 0, 'logins': 0}
+		self.token = base64.b16encode(os.urandom(8)).decode()
+
+	def count(self, endpoint, byte_count=0):
+		with self._lock:
+			self.stats['requests'][endpoint] = self.stats['requests'].get(endpoint, 0) + 1
+			self.stats['bytes_sent'] += byte_count
+
+	def logged_in(self):
+		with self._lock:
+			self.stats['logins'] += 1
+
+	def snapshot(self):
+		with self._lock:
+			return json.loads(json.dumps(self.stats))
+
+	def inject(self, rate, counter):
+		'''True if this response should fail'''
+
+		with self._lock:
+			if rate > 0 and self._random.random() < rate:
+				self.stats[counter] += 1
+				return True
+			return False
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+
+	ROUTES = [
+		(re.compile(r'^/members/?$'), 'members'),
+		(re.compile(r'^/members/videos/?$'), 'listing'),
+		(re.compile(r'^/members/videos/video-(?P<n>\d+)-[a-z-]+/?$'), 'video_page'),
+		(re.compile(r'^/members/download-video\.php$'), 'download'),
+		(re.compile(r'^/files/(?P<n>\d+)_(?P<quality>\d+)\.mp4$'), 'file'),
+		(re.compile(r'^/members/vod/(?P<n>\d+)/playlist\.m3u8$'), 'playlist'),
+		(re.compile(r'^/members/vod/(?P<n>\d+)/stream-\d+p/index\.m3u8$'), 'stream'),
+		(re.compile(r'^/members/vod/(?P<n>\d+)/stream-\d+p/segment-(?P<segment>\d+)\.ts$'), 'segment'),
+		(re.compile(r'^/__stats$'), 'stats'),
+	]
+
+	def log_message(self, *args):
+		pass
+
+	@property
+	def state(self):
+		return self.server.state
+
+	@property
+	def config(self):
+		return self.server.state.config
+
+	def do_GET(self):
+		url = urlparse(self.path)
+		for pattern, endpoint in self.ROUTES:
+			match = pattern.match(url.path)
+			if match:
+				break
+		else:
+			return self._send(404, b'not found', endpoint='missing')
+
+		if endpoint != 'stats' and self.config['latency']:
+			time.sleep(self.config['latency'])
+
+		# the CDN files don't need the session, the members area does
+		if endpoint not in ('members', 'file', 'stats') and not self._has_session():
+			return self._send(401, b'log in first', endpoint=endpoint)
+
+		getattr(self, f'_{endpoint}')(match, parse_qs(url.query))
+
+	def do_HEAD(self):
+		self.do_GET()
+
+	def _has_session(self):
+		return f'{SESSION_COOKIE}={self.state.token}' in self.headers.get('Cookie', '')
+
+	def _send(self, status, body, content_type='text/html', headers=None, endpoint=None, drop=False):
+		self.send_response(status)
+		self.send_header('Content-Type', content_type)
+		self.send_header('Content-Length', str(len(body)))
+		for name, value in (headers or {}).items():
+			self.send_header(name, value)
+		self.end_headers()
+
+		if self.command == 'HEAD':
+			body = b''
+		elif drop:
+			body = body[:len(body) // 2]
+
+		self._write(body)
+		self.state.count(endpoint, len(body))
+
+		if drop:
+			self.close_connection = True
+
+	def _write(self, body):
+		'''Send the body, at most at the configured bandwidth'''
+
+		bandwidth = self.config['bandwidth']
+		if not bandwidth:
+			self.wfile.write(body)
+			return
+
+		view = memoryview(body)
+		start = time.monotonic()
+		for offset in range(0, len(body), SEND_BLOCK):
+			self.wfile.write(view[offset:offset + SEND_BLOCK])
+
+			ahead = (offset + SEND_BLOCK) / bandwidth - (time.monotonic() - start)
+			if ahead > 0:
+				time.sleep(ahead)
+
+	def _page(self, text, endpoint):
+		if self.state.inject(self.config['error_rate'], 'errors_injected'):
+			return self._send(500, b'<html><title>Internal Error</title></html>', endpoint=endpoint)
+		self._send(200, text.encode(), endpoint=endpoint)
+
+	def _members(self, match, query):
+		expected = 'Basic ' + base64.b64encode(f'{USERNAME}:{PASSWORD}'.encode()).decode()
+		if self._has_session():
+			return self._send(200, b'<html><title>Members</title></html>', endpoint='members')
+
+		if self.headers.get('Authorization') != expected:
+			return self._send(401, b'log in first', endpoint='members')
+
+		self.state.logged_in()
+		self._send(200, b'<html><title>Members</title></html>', endpoint='members',
+				   headers={'Set-Cookie': f'{SESSION_COOKIE}={self.state.token}; Path=/; Max-Age=3600'})
+
+	def _listing(self, match, query):
+		page = int(query.get('p', ['1'])[0])
+		if not 1 <= page <= self.config['pages']:
+			return self._send(404, b'not found', endpoint='listing')
+
+		self._page(synthetic_pages.listing_page(self.config['per_page'], page, self.config['pages']), 'listing')
+
+	def _video_page(self, match, query):
+		n = int(match.group('n'))
+		if n >= video_count(self.config):
+			return self._send(404, b'not found', endpoint='video_page')
+
+		downloads = 0 if is_streaming(self.config, n) else len(QUALITIES)
+		self._page(synthetic_pages.video_page(n, downloads=downloads), 'video_page')
+
+	def _download(self, match, query):
+		n, quality = query.get('id', ['0'])[0], query.get('s', ['0'])[0]
+		self._send(302, b'', headers={'Location': f'/files/{n}_{quality}.mp4'}, endpoint='download')
+
+	def _file(self, match, query):
+		n, size = int(match.group('n')), self.config['video_size']
+		drop = self.command == 'GET' and self.state.inject(self.config['drop_rate'], 'drops_injected')
+
+		byte_range = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+		if byte_range is None or not self.config['ranges']:
+			return self._send(200, file_data(n, 0, size), 'video/mp4', {'Accept-Ranges': 'bytes'},
+							  endpoint='file', drop=drop)
+
+		start = int(byte_range.group(1))
+		end = min(int(byte_range.group(2)) if byte_range.group(2) else size - 1, size - 1)
+		if start >= size:
+			return self._send(416, b'', headers={'Content-Range': f'bytes */{size}'}, endpoint='file')
+
+		self._send(206, file_data(n, start, end - start + 1), 'video/mp4',
+				   {'Content-Range': f'bytes {start}-{end}/{size}', 'Accept-Ranges': 'bytes'},
+				   endpoint='file', drop=drop)
+
+	def _playlist(self, match, query):
+		self._send(200, synthetic_pages.vod_playlist(3).encode(), 'application/x-mpegURL', endpoint='playlist')
+
+	def _stream(self, match, query):
+		self._send(200, synthetic_pages.vod_stream(self.config['segments']).encode(), 'application/x-mpegURL',
+				   endpoint='stream')
+
+	def _segment(self, match, query):
+		n, segment = int(match.group('n')), int(match.group('segment'))
+		size = self.config['segment_size']
+		drop = self.state.inject(self.config['drop_rate'], 'drops_injected')
+		self._send(200, file_data(n, segment * size, size), 'video/MP2T', endpoint='segment', drop=drop)
+
+	def _stats(self, match, query):
+		body = json.dumps(self.state.snapshot()).encode()
+		self._send(200, body, 'application/json', endpoint='stats')
+
+
+def create_server(config=None, port=0):
+	'''The stand-in server, not yet serving'''
+
+	server = ThreadingHTTPServer(('127.0.0.1', port), StandInHandler)
+	server.daemon_threads = True
+	server.state = StandInState({**DEFAULT_CONFIG, **(config or {})})
+	return server
+
+
+def serve(config, port_queue):
+	'''Run the stand-in server, e.g. in its own process, and put its port on the queue'''
+
+	server = create_server(config)
+	port_queue.put(server.server_port)
+	server.serve_forever()
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Run a local stand-in for the website')
+	parser.add_argument('--port', type=int, default=8080)
+	for key, value in DEFAULT_CONFIG.items():
+		kind = float if key in ('latency', 'bandwidth', 'error_rate', 'drop_rate') else type(value)
+		parser.add_argument('--' + key.replace('_', '-'), type=kind if kind is not bool else int, default=value)
+	args = parser.parse_args()
+
+	config = {key: getattr(args, key) for key in DEFAULT_CONFIG}
+	server = create_server(config, args.port)
+	print(f'Serving {video_count(config)} videos on http://127.0.0.1:{server.server_port}/members/')
+	server.serve_forever()
+
+
+if __name__ == '__main__':
+	sys.exit(main())
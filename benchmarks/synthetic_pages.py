@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+'''Synthetic pages shaped like the website's, for the benchmarks. They carry
+every tag and class the parsers look for, inside the kind of navigation,
+script and footer markup that makes up most of a real page, and they can be
+scaled up well past the size of the sample pages.'''
+
+import random
+
+
+BASE_URL = 'https://www.helixstudios.com/'
+LISTING_URL = BASE_URL + 'members/videos/'
+
+
+def _header(title):
+	'''The head, navigation and scripts every page starts with'''
+
+	nav = '\n'.join(f'\t\t\t<li class="menu-item"><a href="/members/section-{i}/" '
+					f'class="menu-link">Section {i}</a></li>' for i in range(40))
+	script = '\n'.join(f'\t\tvar setting_{i} = {{"id": {i}, "enabled": true, "name": "setting {i}"}};'
+					   for i in range(100))
+
+	return f'''<!DOCTYPE html>
+<html lang="en">
+<head>
+	<meta charset="utf-8">
+	<title>{title}</title>
+	<link rel="stylesheet" href="/css/site.css">
+	<script type="text/javascript">
+{script}
+	</script>
+</head>
+<body class="members">
+	<header class="site-header">
+		<nav class="main-nav">
+			<ul class="menu">
+{nav}
+			</ul>
+		</nav>
+	</header>
+'''
+
+
+def _footer():
+	links = '\n'.join(f'\t\t<a href="/members/page-{i}/" class="footer-link">Footer link {i}</a>'
+					  for i in range(30))
+	return f'''
+	<footer class="site-footer">
+		<div class="footer-links">
+{links}
+		</div>
+		<p class="copyright">Copyright &copy; Helix Studios</p>
+	</footer>
+</body>
+</html>
+'''
+
+
+def video_slug(n):
+	return f'video-{n:05d}-example-scene'
+
+
+def listing_page(thumbnails=500, page=1, pages=None):
+	'''A video listing page with `thumbnails` video links, and a link to the
+	next page unless this is the last of `pages`.'''
+
+	items = []
+	for n in range((page - 1) * thumbnails, page * thumbnails):
+		slug = video_slug(n)
+		items.append(f'''
+			<div class="grid-item thumbnail-wrapper">
+				<a href="/members/videos/{slug}/" class="thumbnail-link" title="Example scene {n}">
+					<img class="pure-img lazyload thumbnail-img" src="/images/videos/{n}/thumb.jpg" alt="Example scene {n}">
+					<span class="duration">{n % 60}:{n % 59:02d}</span>
+				</a>
+				<div class="thumbnail-info">
+					<span class="title">Example scene {n}</span>
+					<span class="date">Jan {n % 28 + 1}th, 2020</span>
+				</div>
+			</div>''')
+
+	next_link = ''
+	if pages is None or page < pages:
+		next_link = f'<a href="//www.helixstudios.com/members/videos/?p={page + 1}" class="next">Next</a>'
+
+	return (_header(f'Videos - page {page}') +
+			'\t<div class="main-section video-grid">' + ''.join(items) + '\n\t</div>\n' +
+			f'\t<div class="pagination"><a href="/members/videos/?p=1" class="first">First</a>{next_link}</div>' +
+			_footer())
+
+
+def video_page(n=1, cast=4, tags=30, downloads=6, photos=60, paragraphs=5):
+	'''A video page with every section the VideoPage parser reads'''
+
+	rng = random.Random(n)
+	words = ['scene', 'studio', 'summer', 'beach', 'city', 'night', 'story', 'friends']
+	text = lambda count: ' '.join(rng.choice(words) for _ in range(count))
+
+	cast_items = ''.join(f'''
+				<a href="/members/models/model-{m}/" class="thumbnail-link" title="Model {m}">
+					<img class="pure-img lazyload thumbnail-img" src="/images/models/{m}/thumb.jpg">
+				</a>''' for m in range(cast))
+	tag_items = ''.join(f'<a href="/members/tags/tag-{t}/">Tag {t}</a>' for t in range(tags))
+	download_items = ''.join(f'<a href="/members/download-video.php?id={n}&amp;s={q}">'
+							 f'<span>{q}p</span> MP4</a>' for q in (360, 480, 720, 1080, 2160, 4320)[:downloads])
+	photo_items = ''.join(f'<a href="https://cdn.helixstudios.com/photos/{n}/{p}.jpg">'
+						  f'<img src="https://cdn.helixstudios.com/photos/{n}/{p}_t.jpg"></a>' for p in range(photos))
+	description = ''.join(f'<p>{text(60)}</p>' for _ in range(paragraphs))
+
+	return (_header(f'Example scene {n}') + f'''
+	<div class="video-header">
+		<img id="titleImage" src="https://cdn.helixstudios.com/banners/{n}.jpg">
+		<h1>Example <em>scene</em> {n}</h1>
+		<div class="info-items">
+			<span class="info-item date">Jan 31st, 2015</span>
+			<span class="studio-name">Helix Studios</span>
+			<span class="info-item director">Director Example Director</span>
+			<!-- <span class="info-item views"><i class="fa fa-eye"></i> 12.3k views</span> -->
+			<!-- <span class="like-count">1.2k</span> -->
+		</div>
+	</div>
+	<div class="video-player">
+		<video id="sparkplayer2" class="video-js vjs-default-skin" poster="https://cdn.helixstudios.com/posters/{n}.jpg">
+			<source src="/members/vod/{n}/playlist.m3u8" type="application/x-mpegURL">
+		</video>
+	</div>
+	<div class="description-content">{description}</div>
+	<div class="video-cast">{cast_items}
+	</div>
+	<div class="video-tags-wrapper">{tag_items}</div>
+	<div class="downloads-link-wrapper">{download_items}</div>
+	<div class="main-section video-gallery">{photo_items}</div>
+''' + _footer())
+
+
+def model_page(n=1, stats=8, paragraphs=3):
+	'''A model page with a name, a bio, and a stats table'''
+
+	labels = ''.join(f'<span class="label">Stat {s}:</span>' for s in range(stats))
+	values = ''.join(f'<span class="stat-item">  value\n {s} </span>' for s in range(stats))
+	description = ''.join(f'<p>Paragraph {p} of the bio of model {n}.</p>' for p in range(paragraphs))
+
+	return (_header(f'Model {n}') + f'''
+	<h1>Model {n}</h1>
+	<div class="description">{description}</div>
+	<div class="model-stats-table">{labels}</div>
+	<div class="model-stats hide show-lg">{values}</div>
+''' + _footer())
+
+
+def vod_playlist(streams=5):
+	'''The playlist of a streaming video, with one stream per resolution'''
+
+	lines = ['#EXTM3U', '#EXT-X-VERSION:3']
+	for s in range(streams):
+		height = 240 * (s + 1)
+		lines.append(f'#EXT-X-STREAM-INF:PROGRAM-ID=1,BANDWIDTH={800000 * (s + 1)},'
+					 f'RESOLUTION={height * 16 // 9}x{height},CODECS="avc1.4d401f,mp4a.40.2"')
+		lines.append(f'stream-{height}p/index.m3u8')
+	return '\n'.join(lines) + '\n'
+
+
+def vod_stream(segments=10000):
+	'''A stream of a streaming video, with `segments` TS segments'''
+
+	lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:6', '#EXT-X-MEDIA-SEQUENCE:0']
+	for s in range(segments):
+		lines.append('#EXTINF:6.006,')
+		lines.append(f'segment-{s:05d}.ts')
+	lines.append('#EXT-X-ENDLIST')
+	return '\n'.join(lines) + '\n'
@@ -10,6 +10,7 @@ from .settings import SettingsYAML
 from .settings import SettingsContainer
 
 from .session import HelixSession
+from .session import PageResponse
 
 from .parse_video_listing import VideoListingPage
 
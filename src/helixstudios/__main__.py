@@ -5,14 +5,18 @@
 import os
 import sys
 import json
+import queue
 import logging
 import argparse
+import threading
 
 from .parse_video import VideoPage
 from .settings import SettingsYAML
 from .utils import configure_logging
 from .downloader import HelixDownloader
 from .downloader import find_best_quality
+from .checksum import store_checksum
+from .progress import print_progress_line
 
 from .parse_video import video_page_url_to_video_name
 
@@ -53,6 +57,11 @@ def cmdline_args():
 	parser.add_argument('--page-limit', type=int, help='Max number of video page listings to download')
 	parser.add_argument('--video-limit', type=int, help='Max number of videos to download')
 	parser.add_argument('--retry-count', type=int, default=10, help='Maximum number of failed connection attempts before exiting')
+	parser.add_argument('--workers', type=int, default=1, help='Number of videos to download at the same time')
+	parser.add_argument('--incremental', default=False, action='store_true',
+		help='Stop crawling the video listing once it reaches videos seen by a previous complete crawl')
+	parser.add_argument('--rebuild-index', default=False, action='store_true',
+		help='Rescan all library folders to rebuild the index of downloaded videos')
 	parser.add_argument('--force-download-video', default=False, action='store_true', 
 		help="If the video file already exists on disk, don't assume the download is complete, try to resume the download anyway")
 
@@ -84,43 +93,233 @@ def download(args, settings):
 	# create the session/download manager
 	downloader = HelixDownloader(settings)
 
-	video_count = 0
-	for video_url in downloader.all_video_links(page_limit=args.page_limit, retries=args.retry_count):
-		folder, video_full_path, video_library_path = url_to_download_path(video_url, settings)
+	try:
+		download_videos(args, settings, downloader)
+	finally:
+		stats = downloader.session.connection_stats
+		log.info(f'Opened {stats["new"]} connections, {stats["reused"]} requests reused a connection')
 
-		if file_already_downloaded(video_full_path, video_library_path, settings) and not args.force_download_video:
-			continue
+		for url_class, timings in downloader.session.timings.summary().items():
+			ttfb = timings['ttfb']
+			if ttfb['count']:
+				log.info(f'{timings["requests"]} {url_class} requests, time to first byte '
+						 f'p50 {ttfb["p50"]}s p90 {ttfb["p90"]}s, {timings["retries"]} retries')
 
-		log.info(f'Starting video #{video_count}: {video_library_path}')
+		downloader.session.close()
 
-		status, page_text = downloader.session.get(video_url, retries=args.retry_count)
-		video_page = VideoPage(page_text, downloader.session.last_url)
 
-		os.makedirs(folder, exist_ok=True)
-	
-		# dump the metadata to disk
-		handle_video_page(video_page, settings, folder)
-
-		if 'Internal Error' in video_page.webpage_title:
-			log.error('   ***************************')
-			log.error('   ** INTERNAL SERVER ERROR **')
-			log.error('   **  SKIPPING THIS VIDEO  **')
-			log.error('   ***************************')
-			return
+def download_videos(args, settings, downloader):
+	'''Download every video in the listing that isn't in the library yet'''
 
-		# now manage the downloads
-		if not args.metadata_only:
-			download_successful = download_video(video_page, settings, folder, downloader, retries=args.retry_count)
-			if download_successful:
-				video_count += 1
-		else:
+	index = downloader.library_index
+	if index is not None and (args.rebuild_index or index.empty):
+		index.rebuild(library_roots(settings))
+
+	# the watermark is only stored once every video the crawl found has been handled
+	watermark = downloader.load_watermark() if args.incremental else None
+
+	if args.workers > 1:
+		download_concurrently(args, settings, downloader, watermark)
+		return
+
+	video_count = 0
+	for video_url in downloader.all_video_links(page_limit=args.page_limit, retries=args.retry_count, watermark=watermark):
+		if video_already_downloaded(video_url, args, settings, index):
+			continue
+
+		if download_video_url(video_url, args, settings, downloader, video_count):
 			video_count += 1
+		elif watermark is not None:
+			watermark.failed(video_url)
 
 		# exit if the video limit was exceeded
 		if args.video_limit is not None and video_count >= args.video_limit:
 			log.info(f'Video download limit of {args.video_limit} has been reached!')
 			return
 
+	if watermark is not None:
+		watermark.commit()
+
+
+def download_concurrently(args, settings, downloader, watermark=None):
+	'''Walk the video listing pages, and hand each video link to a pool of 
+	workers that download the video pages, metadata and videos in parallel.
+	The crawl watermark is committed once the workers have finished, without
+	the videos that weren't downloaded.'''
+
+	limit = VideoLimit(args.video_limit)
+	links = queue.Queue(maxsize=2 * args.workers)
+	errors = []
+
+	def worker():
+		while True:
+			video_url = links.get()
+			if video_url is None:
+				return
+
+			success = False
+			try:
+				if not limit.reached:
+					success = _download_video_worker(video_url, args, settings, downloader, limit)
+			except Exception as e:
+				log.error('Worker exiting with exception:', exc_info=True)
+				errors.append(e)
+				limit.stop()
+
+			# the next crawl hands out a video that wasn't downloaded again
+			if not success and watermark is not None:
+				watermark.failed(video_url)
+
+	workers = [threading.Thread(target=worker, name=f'video-worker-{i}', daemon=True) 
+			   for i in range(args.workers)]
+	for w in workers:
+		w.start()
+
+	try:
+		for video_url in downloader.all_video_links(page_limit=args.page_limit, retries=args.retry_count, watermark=watermark):
+			if limit.reached:
+				break
+
+			if video_already_downloaded(video_url, args, settings, downloader.library_index):
+				continue
+
+			links.put(video_url)
+
+	except BaseException:
+		# stop the workers from starting any more videos. Don't wait for the 
+		# downloads in progress, the workers are daemon threads.
+		limit.stop()
+		raise
+
+	# one sentinel per worker, so they all exit once the queue is drained
+	for _ in workers:
+		links.put(None)
+
+	for w in workers:
+		w.join()
+
+	if limit.reached and args.video_limit is not None:
+		log.info(f'Video download limit of {args.video_limit} has been reached!')
+
+	if errors:
+		raise errors[0]
+
+	if watermark is not None:
+		watermark.commit()
+
+
+def _download_video_worker(video_url, args, settings, downloader, limit):
+	'''Download one video from a worker thread, respecting the video limit, and 
+	making sure no two workers ever download the same video. Return True if
+	this worker downloaded the video.'''
+
+	video_number = limit.start(video_url)
+	if video_number is None:
+		log.debug(f'Not starting video, limit reached or already in progress: {video_url}')
+		return False
+
+	success = False
+	try:
+		success = download_video_url(video_url, args, settings, downloader, video_number)
+	finally:
+		limit.finish(video_url, success)
+
+	return success
+
+
+class VideoLimit:
+	'''Keeps count of the videos being downloaded by all workers, so the 
+	video limit is never exceeded. Videos in progress hold a slot until they 
+	finish, and their slot is freed again if the download fails.'''
+
+	def __init__(self, video_limit=None):
+		self._video_limit = video_limit
+		self._in_progress = set()
+		self._completed = 0
+		self._started = 0
+		self._stopped = False
+		self._condition = threading.Condition()
+
+	@property
+	def reached(self):
+		'''True once no more videos should be started'''
+		return self._stopped or (self._video_limit is not None and self._completed >= self._video_limit)
+
+	def stop(self):
+		with self._condition:
+			self._stopped = True
+			self._condition.notify_all()
+
+	def start(self, video_url):
+		'''Claim a slot to download the given video. Waits while the videos in 
+		progress could still fill the limit. Returns the number of the video,
+		or None if the video shouldn't be downloaded.'''
+
+		with self._condition:
+			if video_url in self._in_progress:
+				return None
+
+			while (self._video_limit is not None and not self.reached and 
+				   self._completed + len(self._in_progress) >= self._video_limit):
+				self._condition.wait()
+
+			if self.reached:
+				return None
+
+			self._in_progress.add(video_url)
+			self._started += 1
+			return self._started - 1
+
+	def finish(self, video_url, success):
+		'''Release the slot held by the given video'''
+
+		with self._condition:
+			self._in_progress.discard(video_url)
+			if success:
+				self._completed += 1
+			self._condition.notify_all()
+
+
+def video_already_downloaded(video_url, args, settings, index=None):
+	'''Return True if the video should be skipped, because it's already in the library'''
+
+	_, video_full_path, video_library_path = url_to_download_path(video_url, settings)
+	return file_already_downloaded(video_full_path, video_library_path, settings, index) and not args.force_download_video
+
+
+def download_video_url(video_url, args, settings, downloader, video_number=0):
+	'''Download the video page, the metadata, and the video itself for one video
+	link. Return True if the video counts towards the video limit.'''
+
+	folder, _, video_library_path = url_to_download_path(video_url, settings)
+	log.info(f'Starting video #{video_number}: {video_library_path}')
+
+	response = downloader.session.fetch(video_url, retries=args.retry_count)
+	video_page = VideoPage(response.text, response.url)
+
+	os.makedirs(folder, exist_ok=True)
+
+	# dump the metadata to disk
+	handle_video_page(video_page, settings, folder)
+
+	if 'Internal Error' in video_page.webpage_title:
+		log.error('   ***************************')
+		log.error('   ** INTERNAL SERVER ERROR **')
+		log.error('   **  SKIPPING THIS VIDEO  **')
+		log.error('   ***************************')
+		return False
+
+	# now manage the downloads
+	if not args.metadata_only:
+		success = download_video(video_page, settings, folder, downloader, retries=args.retry_count)
+		if success:
+			dump_checksum(downloader.session.last_checksum, settings, folder)
+		if success and downloader.library_index is not None:
+			downloader.library_index.record(settings.get_path('library', 'download_root'), video_library_path)
+		return success
+	else:
+		return True
+
 
 def url_to_download_path(url, settings):
 	'''Take the video page url and convert it to the download folder 
@@ -134,8 +333,22 @@ def url_to_download_path(url, settings):
 	return folder, video_full_path, video_library_path
 
 
-def file_already_downloaded(video_full_path, video_library_path, settings):
-	'''Return True if this video file has already been downloaded'''
+def library_roots(settings):
+	'''All library folders, starting with the download root'''
+
+	return ([settings.get_path('library', 'download_root')] + 
+			settings.get_path_list('library', 'additional_library_folders', default=[]))
+
+
+def file_already_downloaded(video_full_path, video_library_path, settings, index=None):
+	'''Return True if this video file has already been downloaded. With a 
+	library index, this is a lookup in the index, no files are checked.'''
+
+	if index is not None:
+		root = index.find(video_library_path)
+		if root is not None:
+			log.info(f'Video file "{video_library_path}" already exists in library folder "{root}"')
+		return root is not None
 
 	if os.path.isfile(video_full_path):
 		log.info(f'Video file "{video_library_path}" already exists in download root folder')
@@ -174,25 +387,57 @@ def dump_metadata(video_page, settings, folder):
 			log.error('Cannot write details dictionary to disk -- not JSON serialisable!')
 
 
+def dump_checksum(checksum, settings, folder):
+	'''Record the checksum of the downloaded video in the video folder'''
+
+	if checksum is None or not settings.get('library', 'save_checksums_to_library'):
+		return
+
+	store_checksum(os.path.join(folder, settings.get('library', 'checksums_filename', default='.checksums.json')),
+				   f'{os.path.basename(folder)}.mp4', checksum)
+
+
 def download_video(video_page, settings, folder, downloader, retries=10):
 	'''Download the highest quality video to the given folder in the library'''
 
+	video_path = os.path.join(folder, f'{os.path.basename(folder)}.mp4')
+
 	if not video_page.downloads:
-		log.warning('No download links found for this video, skipping!')
-		return False
+		return download_streaming_video(video_page, video_path, downloader, retries=retries)
 	
 	best = find_best_quality(video_page.downloads)
-	video_path = os.path.join(folder, f'{os.path.basename(folder)}.mp4')
 
 	sys.stderr.write(f'{os.path.basename(video_path)} - "{video_page.title}"\n')
 	sys.stderr.flush()
 
 	status = downloader.session.download(best['link'], video_path, retries=retries)
 	if status:
-		downloader.session._print_progress(100.0)
+		print_progress_line('100.0%')
 	else:
 		sys.stderr.write(f'   Download Error!                    \n')
 		sys.stderr.flush()
 
 	return status
 
+
+def download_streaming_video(video_page, video_path, downloader, retries=10):
+	'''Some videos have no download links, and are only available through the 
+	streaming player. Download all the segments of the stream instead. The 
+	segments are MPEG-TS, but the file keeps the library's video file name.'''
+
+	try:
+		playlist_url = video_page.vod_playlist_url
+	except ValueError:
+		log.warning('No download links or streaming player found for this video, skipping!')
+		return False
+
+	log.info('No download links found for this video, downloading the stream instead')
+	sys.stderr.write(f'{os.path.basename(video_path)} - "{video_page.title}" (stream)\n')
+	sys.stderr.flush()
+
+	status = downloader.session.download_vod(playlist_url, video_path, retries=retries)
+	if not status:
+		sys.stderr.write(f'   Download Error!                    \n')
+		sys.stderr.flush()
+
+	return status
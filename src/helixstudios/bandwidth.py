@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+'''A bandwidth governor shared by every transfer in the session. All
+transfers draw from one global token bucket, so bandwidth that isn't
+used by one transfer is free for the others to use.'''
+
+import time
+import datetime
+import logging
+import threading
+
+from .utils import string_to_bytes
+from .utils import bytes_to_string
+
+
+log = logging.getLogger(__name__)
+
+
+class TokenBucket:
+	'''A thread-safe token bucket. Callers take the tokens they need
+	straight away, and are told how long to wait to pay off any debt, which
+	keeps the average rate exact no matter how big each request is.'''
+
+	def __init__(self, rate=None, burst=1.0):
+		self._rate = rate
+		self._burst = burst
+		self._tokens = self._capacity
+		self._last = time.monotonic()
+		self._lock = threading.Lock()
+
+	def __repr__(self):
+		rate = 'unlimited' if self._rate is None else f'{bytes_to_string(self._rate)}/s'
+		return f'<TokenBucket({rate})>'
+
+	@property
+	def _capacity(self):
+		return 0 if self._rate is None else self._rate * self._burst
+
+	@property
+	def rate(self):
+		return self._rate
+
+	def set_rate(self, rate):
+		'''Change the fill rate of the bucket, None means unlimited.'''
+
+		with self._lock:
+			if rate != self._rate:
+				self._rate = rate
+				self._tokens = min(self._tokens, self._capacity)
+
+	def reserve(self, amount):
+		'''Take the given number of tokens, and return the number of seconds
+		the caller must wait before using them.'''
+
+		with self._lock:
+			if self._rate is None:
+				return 0.0
+
+			now = time.monotonic()
+			self._tokens = min(self._capacity, self._tokens + (now - self._last) * self._rate)
+			self._last = now
+
+			self._tokens -= amount
+			return max(0.0, -self._tokens / self._rate)
+
+
+class TimeWindow:
+	'''A bandwidth limit that only applies during a certain time of day.
+	Windows can cross midnight, e.g. from 22:00 to 06:00.'''
+
+	def __init__(self, start, end, limit):
+		self._start = _parse_time_of_day(start)
+		self._end = _parse_time_of_day(end)
+		self._limit = limit
+
+	def __repr__(self):
+		return f'<TimeWindow({self._start:%H:%M}-{self._end:%H:%M})>'
+
+	@property
+	def limit(self):
+		return self._limit
+
+	def contains(self, time_of_day):
+		if self._start <= self._end:
+			return self._start <= time_of_day < self._end
+		else:
+			return time_of_day >= self._start or time_of_day < self._end
+
+
+def _parse_time_of_day(text):
+	'''Convert a "HH:MM" string to a time object'''
+	return datetime.datetime.strptime(str(text), '%H:%M').time()
+
+
+def _parse_rate(value):
+	'''Convert a rate from the settings to bytes per second, None means unlimited'''
+	return None if value in (None, '', 0) else string_to_bytes(value)
+
+
+class Transfer:
+	'''A single transfer (a file, stream, or image) drawing bandwidth from
+	the governor, with its own optional limit.'''
+
+	def __init__(self, governor, name='', limit=None):
+		self._governor = governor
+		self._name = name
+		self._bucket = TokenBucket(limit)
+
+	def __repr__(self):
+		return f'<Transfer("{self._name}")>'
+
+	def __enter__(self):
+		self._governor._transfer_started(self)
+		return self
+
+	def __exit__(self, *exc_info):
+		self._governor._transfer_finished(self)
+
+	def consume(self, amount):
+		'''Block until the transfer may use the given number of bytes.'''
+
+		wait = max(self._governor._reserve(amount), self._bucket.reserve(amount))
+		if wait > 0:
+			time.sleep(wait)
+
+
+class BandwidthGovernor:
+	'''Shares a global bandwidth limit between all active transfers. The
+	global limit can be replaced by a different limit during some windows
+	of the day, and every transfer can have its own limit too.'''
+
+	def __init__(self, limit=None, per_transfer_limit=None, windows=None):
+		self._limit = limit
+		self._per_transfer_limit = per_transfer_limit
+		self._windows = windows or []
+		self._bucket = TokenBucket(self.current_limit())
+
+		self._active = set()
+		self._lock = threading.Lock()
+
+	def __repr__(self):
+		return f'<BandwidthGovernor({len(self._active)} active transfers)>'
+
+	@classmethod
+	def from_settings(cls, settings):
+		'''Build the governor from the "bandwidth" settings. No settings
+		means no limits.'''
+
+		if settings is None:
+			return cls()
+
+		windows = [TimeWindow(w['start'], w['end'], _parse_rate(w.get('limit')))
+				   for w in settings.get('windows', default=None) or []]
+
+		return cls(limit=_parse_rate(settings.get('limit')),
+				   per_transfer_limit=_parse_rate(settings.get('per_transfer_limit')),
+				   windows=windows)
+
+	@property
+	def active_transfers(self):
+		return len(self._active)
+
+	def current_limit(self, now=None):
+		'''The global limit in bytes per second at the given time, or None if
+		there's no limit.'''
+
+		time_of_day = (now or datetime.datetime.now()).time()
+		for window in self._windows:
+			if window.contains(time_of_day):
+				return window.limit
+
+		return self._limit
+
+	def transfer(self, name='', limit=None):
+		'''Create a new transfer, to be used as a context manager. The default
+		per-transfer limit is used if no limit is given.'''
+		return Transfer(self, name, limit or self._per_transfer_limit)
+
+	def _reserve(self, amount):
+		self._bucket.set_rate(self.current_limit())
+		return self._bucket.reserve(amount)
+
+	def _transfer_started(self, transfer):
+		with self._lock:
+			self._active.add(transfer)
+
+	def _transfer_finished(self, transfer):
+		with self._lock:
+			self._active.discard(transfer)
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+
+'''A persistent on-disk cache of page responses. Pages are revalidated
+with the server using their ETag/Last-Modified headers, so an unchanged
+page costs a "304 Not Modified" instead of the whole page.'''
+
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+
+from .utils import atomic_write
+from .utils import string_to_bytes
+from .utils import bytes_to_string
+
+
+log = logging.getLogger(__name__)
+
+
+class CacheEntry:
+	'''A single cached response, the body is only read from disk when needed.'''
+
+	def __init__(self, cache, key, metadata):
+		self._cache = cache
+		self._key = key
+		self._metadata = metadata
+
+	def __repr__(self):
+		return f'<CacheEntry("{self.url}")>'
+
+	@property
+	def key(self):
+		return self._key
+
+	@property
+	def url(self):
+		return self._metadata['url']
+
+	@property
+	def final_url(self):
+		'''The final URL of the cached response after all redirects'''
+		return self._metadata['final_url']
+
+	@property
+	def status_code(self):
+		return self._metadata['status_code']
+
+	@property
+	def fresh(self):
+		'''True if the entry is young enough to be used without asking the server'''
+
+		ttl = self._cache.ttl_for(self.url)
+		return time.time() - self._metadata['stored'] < ttl
+
+	@property
+	def text(self):
+		'''The cached page. Raises FileNotFoundError if the entry has been
+		evicted since it was looked up.'''
+
+		with open(self._cache._body_path(self._key), 'rb') as f:
+			return f.read().decode('utf-8')
+
+	def validators(self):
+		'''The request headers to ask the server if the cached response is still valid'''
+
+		headers = {}
+		if self._metadata.get('etag'):
+			headers['If-None-Match'] = self._metadata['etag']
+		if self._metadata.get('last_modified'):
+			headers['If-Modified-Since'] = self._metadata['last_modified']
+		return headers
+
+
+class ResponseCache:
+	'''Cache page responses on disk, keyed by URL. The total size of the
+	cache is capped, and the least recently used entries are evicted first.
+	Responses are revalidated with the server on every request, unless the
+	URL matches a pattern with a time-to-live, during which the cached page
+	is used without asking the server at all.'''
+
+	def __init__(self, folder, max_size=None, ttls=None):
+		self._folder = folder
+		self._max_size = max_size
+		self._ttls = [(re.compile(pattern), ttl) for pattern, ttl in (ttls or [])]
+
+		# key -> [size in bytes, last access time]
+		self._index = {}
+		self._lock = threading.Lock()
+
+		os.makedirs(self._folder, exist_ok=True)
+		self._scan()
+
+	def __repr__(self):
+		return f'<ResponseCache({len(self._index)} entries, {bytes_to_string(self.size)})>'
+
+	@classmethod
+	def from_settings(cls, settings, folder):
+		'''Build the cache from the "response_cache" settings. Returns None if
+		the cache isn't enabled.'''
+
+		if settings is None or not settings.get('enabled'):
+			return None
+
+		max_size = settings.get('max_size')
+		ttls = [(t['pattern'], t['ttl']) for t in settings.get('ttl', default=None) or []]
+
+		return cls(folder, max_size=string_to_bytes(max_size) if max_size else None, ttls=ttls)
+
+	@property
+	def size(self):
+		with self._lock:
+			return sum(size for size, _ in self._index.values())
+
+	def __len__(self):
+		return len(self._index)
+
+	def _body_path(self, key):
+		return os.path.join(self._folder, f'{key}.body')
+
+	def _metadata_path(self, key):
+		return os.path.join(self._folder, f'{key}.json')
+
+	@staticmethod
+	def key(url):
+		return hashlib.sha1(url.encode()).hexdigest()
+
+	def ttl_for(self, url):
+		'''The time-to-live of the first pattern matching the url, 0 if none match'''
+
+		for pattern, ttl in self._ttls:
+			if pattern.search(url):
+				return ttl
+		return 0
+
+	def _scan(self):
+		'''Build the index of the cache from the files on disk. The last access
+		time is kept as the modification time of each body file. Files left
+		half written by an interrupted run are removed.'''
+
+		for filename in os.listdir(self._folder):
+			key, ext = os.path.splitext(filename)
+			if ext == '.tmp':
+				try:
+					os.remove(os.path.join(self._folder, filename))
+				except OSError:
+					pass
+				continue
+
+			if ext != '.body':
+				continue
+
+			st = os.stat(os.path.join(self._folder, filename))
+			self._index[key] = [st.st_size, st.st_mtime]
+
+		log.debug(f'Loaded response cache: {self}')
+
+	def lookup(self, url):
+		'''Return the cache entry for the url, or None if it's not cached'''
+
+		key = self.key(url)
+		if key not in self._index:
+			return None
+
+		try:
+			with open(self._metadata_path(key)) as f:
+				metadata = json.load(f)
+		except (OSError, ValueError):
+			self._remove(key)
+			return None
+
+		self._touch(key)
+		return CacheEntry(self, key, metadata)
+
+	def store(self, url, resp, text=None):
+		'''Store a response in the cache. Only responses the server can
+		revalidate, or with a time-to-live, are worth keeping. The `text` of
+		a response that's been streamed has to be given.'''
+
+		etag = resp.headers.get('ETag')
+		last_modified = resp.headers.get('Last-Modified')
+		if not (etag or last_modified or self.ttl_for(url)):
+			return
+
+		key = self.key(url)
+		body = (resp.text if text is None else text).encode('utf-8')
+		metadata = {
+			'url':            url,
+			'final_url':      resp.url,
+			'status_code':    resp.status_code,
+			'etag':           etag,
+			'last_modified':  last_modified,
+			'stored':         time.time()
+		}
+
+		with self._lock:
+			atomic_write(self._body_path(key), body)
+			atomic_write(self._metadata_path(key), json.dumps(metadata).encode())
+			self._index[key] = [len(body), time.time()]
+
+		self._evict()
+
+	def revalidated(self, entry):
+		'''The server confirmed the cached response is still valid, so it's
+		fresh again for its time-to-live.'''
+
+		entry._metadata['stored'] = time.time()
+		with self._lock:
+			# an entry evicted in the meantime stays gone
+			if entry.key not in self._index:
+				return
+			atomic_write(self._metadata_path(entry.key), json.dumps(entry._metadata).encode())
+
+	def _touch(self, key):
+		now = time.time()
+		with self._lock:
+			if key in self._index:
+				self._index[key][1] = now
+				try:
+					os.utime(self._body_path(key), (now, now))
+				except OSError:
+					pass
+
+	def _remove(self, key):
+		with self._lock:
+			self._index.pop(key, None)
+			for path in (self._body_path(key), self._metadata_path(key)):
+				if os.path.isfile(path):
+					os.remove(path)
+
+	def _evict(self):
+		'''Remove the least recently used entries until the cache fits its size cap'''
+
+		if self._max_size is None:
+			return
+
+		with self._lock:
+			by_age = sorted(self._index.items(), key=lambda item: item[1][1])
+
+		size = self.size
+		for key, (entry_size, _) in by_age:
+			if size <= self._max_size:
+				break
+
+			log.debug(f'Evicting response cache entry {key}')
+			self._remove(key)
+			size -= entry_size
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+'''Checksums of downloaded videos, computed while the bytes arrive so a
+finished download never has to be read back from disk to verify it.'''
+
+import os
+import json
+import hashlib
+import logging
+import threading
+
+from .utils import atomic_write
+
+
+log = logging.getLogger(__name__)
+
+
+DEFAULT_ALGORITHM = 'sha256'
+
+# block size used when hashing data that is already on disk
+READ_SIZE = 1024 * 1024   # 1MB
+
+
+class PrefixHasher:
+	'''Hashes a file from its first byte onwards. Data must be added in
+	order, either as it's downloaded or by reading what's already on disk,
+	and `hashed` is the length of the prefix hashed so far.'''
+
+	def __init__(self, algorithm=DEFAULT_ALGORITHM):
+		self._algorithm = algorithm
+		self._hash = hashlib.new(algorithm)
+		self._hashed = 0
+		self._lock = threading.Lock()
+
+	def __repr__(self):
+		return f'<PrefixHasher({self._algorithm}, {self._hashed} bytes)>'
+
+	@property
+	def algorithm(self):
+		return self._algorithm
+
+	@property
+	def hashed(self):
+		'''The number of bytes from the start of the file hashed so far'''
+		return self._hashed
+
+	def update(self, data):
+		with self._lock:
+			self._hash.update(data)
+			self._hashed += len(data)
+
+	def hash_file(self, path, end):
+		'''Hash the file on disk from the end of the hashed prefix up to byte
+		`end` (exclusive), e.g. the part of a file written by an earlier run.'''
+
+		if end <= self._hashed:
+			return
+
+		buffer = bytearray(READ_SIZE)
+		view = memoryview(buffer)
+
+		with open(path, 'rb', buffering=0) as f:
+			f.seek(self._hashed)
+			while self._hashed < end:
+				n = f.readinto(view[:min(READ_SIZE, end - self._hashed)])
+				if not n:
+					raise EOFError(f'"{path}" ended at byte {self._hashed}, expected {end} bytes')
+				self.update(view[:n])
+
+	def checksum(self):
+		'''The checksum of everything hashed so far, as stored in the library'''
+		return {self._algorithm: self._hash.hexdigest(), 'size': self._hashed}
+
+
+class RangeHasher:
+	'''Feeds a PrefixHasher from the byte ranges of a file that are written
+	in parallel. The range at the end of the hashed prefix is hashed as its
+	data is written. Once that range is complete, whatever the next range has
+	written so far is read back from disk, straight away while it's most
+	likely still in the page cache, and from then on that range is hashed as
+	its data is written.
+
+	`ranges` are the (start, bytes on disk) of every range of the file, in
+	order. Each range's data has to be added in order with the hasher from
+	`part`, after it's been written to the file.'''
+
+	def __init__(self, hasher, path, ranges):
+		self._hasher = hasher
+		self._path = path
+		self._starts = [start for start, _ in ranges]
+		self._written_to = [start + written for start, written in ranges]
+		self._current = 0
+		self._lock = threading.Lock()
+
+		with self._lock:
+			self._catch_up()
+
+	def __repr__(self):
+		return f'<RangeHasher(range {self._current}, {self._hasher.hashed} bytes)>'
+
+	def part(self, index):
+		'''The hasher of the data written to the range `index`'''
+		return _RangePart(self, index)
+
+	def _update(self, index, data):
+		with self._lock:
+			if index == self._current and self._written_to[index] == self._hasher.hashed:
+				self._hasher.update(data)
+			self._written_to[index] += len(data)
+			self._catch_up()
+
+	def _catch_up(self):
+		'''Hash what's already on disk from the end of the hashed prefix, as
+		far as the data is contiguous'''
+
+		while True:
+			self._hasher.hash_file(self._path, self._written_to[self._current])
+
+			following = self._current + 1
+			if following == len(self._starts) or self._hasher.hashed < self._starts[following]:
+				return
+			self._current = following
+
+
+class _RangePart:
+	'''Adds the data written to one range to a RangeHasher'''
+
+	def __init__(self, range_hasher, index):
+		self._range_hasher = range_hasher
+		self._index = index
+
+	def update(self, data):
+		self._range_hasher._update(self._index, data)
+
+
+def load_checksums(path):
+	'''Load the checksums file of a video folder, empty if there isn't one'''
+
+	if not os.path.isfile(path):
+		return {}
+
+	try:
+		with open(path) as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		log.warning(f'Checksums file "{path}" could not be read, ignoring it')
+		return {}
+
+
+def store_checksum(path, filename, checksum):
+	'''Record the checksum of one file in the checksums file of its folder'''
+
+	checksums = load_checksums(path)
+	checksums[filename] = checksum
+
+	atomic_write(path, json.dumps(checksums, indent=4))
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+'''An adaptive limit on the number of page requests running at once. The
+limit grows slowly while the server keeps up, and is cut sharply when it
+shows signs of strain (AIMD: additive increase, multiplicative decrease).'''
+
+import time
+import logging
+import threading
+
+
+log = logging.getLogger(__name__)
+
+
+class LimiterRequest:
+	'''A single request holding a slot in the limiter. Mark the request as
+	failed if the response shows the server is struggling, e.g. a 5xx.'''
+
+	def __init__(self, limiter):
+		self._limiter = limiter
+		self._failed = False
+		self._start = None
+
+	def __enter__(self):
+		self._limiter._acquire()
+		self._start = time.monotonic()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		# any exception (timeout, connection error) counts as a failure
+		latency = time.monotonic() - self._start
+		self._limiter._release(latency, self._failed or exc_type is not None)
+
+	def failed(self):
+		self._failed = True
+
+
+class AdaptiveLimiter:
+	'''Limits the number of requests in flight. Each request that finishes
+	with a normal latency raises the limit by 1/limit, so the limit grows by
+	about one per round of requests. A timeout, server error or a latency
+	spike (`latency_tolerance` times the usual latency, and at least
+	`minimum_spike` seconds slower) halves the limit, at most once per usual
+	latency so one burst of failures only counts once.'''
+
+	def __init__(self, initial=2, minimum=1, maximum=16, latency_tolerance=2.0,
+				 decrease_factor=0.5, minimum_spike=0.5):
+		self._minimum = minimum
+		self._maximum = maximum
+		self._latency_tolerance = latency_tolerance
+		self._minimum_spike = minimum_spike
+		self._decrease_factor = decrease_factor
+
+		self._limit = float(max(minimum, min(initial, maximum)))
+		self._in_flight = 0
+		self._baseline_latency = None
+		self._last_decrease = 0.0
+		self._condition = threading.Condition()
+
+	def __repr__(self):
+		return f'<AdaptiveLimiter({self._in_flight}/{self.limit} in flight)>'
+
+	@classmethod
+	def from_settings(cls, settings):
+		'''Build the limiter from the "page_concurrency" settings'''
+
+		if settings is None:
+			return cls()
+
+		return cls(initial=settings.get('initial', default=2),
+				   minimum=settings.get('min', default=1),
+				   maximum=settings.get('max', default=16),
+				   latency_tolerance=settings.get('latency_tolerance', default=2.0))
+
+	@property
+	def limit(self):
+		'''The current number of requests allowed in flight'''
+		return int(self._limit)
+
+	@property
+	def in_flight(self):
+		return self._in_flight
+
+	@property
+	def baseline_latency(self):
+		'''The smoothed latency of requests while the server isn't struggling'''
+		return self._baseline_latency
+
+	def request(self):
+		'''Wait for a free slot, to be used as a context manager around the request'''
+		return LimiterRequest(self)
+
+	def _acquire(self):
+		with self._condition:
+			while self._in_flight >= self.limit:
+				self._condition.wait()
+			self._in_flight += 1
+
+	def _release(self, latency, failed):
+		with self._condition:
+			self._in_flight -= 1
+
+			spike = (self._baseline_latency is not None and
+					 latency > self._baseline_latency * self._latency_tolerance and
+					 latency - self._baseline_latency > self._minimum_spike)
+
+			if failed or spike:
+				self._decrease('request failed' if failed else f'latency spike of {latency:.2f}s')
+			else:
+				self._increase()
+				self._update_baseline(latency)
+
+			self._condition.notify_all()
+
+	def _update_baseline(self, latency):
+		if self._baseline_latency is None:
+			self._baseline_latency = latency
+		else:
+			self._baseline_latency = 0.9 * self._baseline_latency + 0.1 * latency
+
+	def _increase(self):
+		old_limit = self.limit
+		self._limit = min(self._maximum, self._limit + 1.0 / self._limit)
+
+		if self.limit != old_limit:
+			log.info(f'Page request concurrency raised to {self.limit}')
+
+	def _decrease(self, reason):
+		now = time.monotonic()
+		if now - self._last_decrease < (self._baseline_latency or 1.0):
+			return
+
+		self._last_decrease = now
+		old_limit = self.limit
+		self._limit = max(self._minimum, self._limit * self._decrease_factor)
+
+		if self.limit != old_limit:
+			log.warning(f'Page request concurrency cut to {self.limit}, {reason}')
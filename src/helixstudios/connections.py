@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+'''Connection pooling for the session: how many connections are kept per
+host, whether they're kept alive, how failed connections are retried, and
+how often a request could reuse a connection instead of opening a new one.'''
+
+import time
+import logging
+import threading
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPSConnection
+from urllib3.util.retry import Retry
+
+
+log = logging.getLogger(__name__)
+
+
+# the time this thread spent opening connections since it last asked
+_connect_times = threading.local()
+
+
+def _add_connect_time(name, seconds):
+	setattr(_connect_times, name, (getattr(_connect_times, name, None) or 0.0) + seconds)
+
+
+def take_connect_times():
+	'''The seconds the current thread spent connecting (DNS and TCP) and in
+	the TLS handshake since the last call, None if it opened no connection.
+	Requests connect on the thread that sends them, so this is the connect
+	time of the request that just got its response.'''
+
+	connect = getattr(_connect_times, 'connect', None)
+	tls = getattr(_connect_times, 'tls', None)
+	_connect_times.connect = _connect_times.tls = None
+	return connect, tls
+
+
+def _counting_pool(pool_cls, on_connect):
+	'''A connection pool class whose connections call `on_connect()` every
+	time they open a socket. urllib3 quietly reopens a connection object the
+	server has closed, so counting connection objects isn't enough. The
+	connections also time opening the socket and the TLS handshake.'''
+
+	class CountingConnection(pool_cls.ConnectionCls):
+		def _new_conn(self):
+			start = time.monotonic()
+			try:
+				return super()._new_conn()
+			finally:
+				self._socket_time = time.monotonic() - start
+
+		def connect(self):
+			self._socket_time = 0.0
+			start = time.monotonic()
+			super().connect()
+
+			_add_connect_time('connect', self._socket_time)
+			if isinstance(self, HTTPSConnection):
+				_add_connect_time('tls', max(0.0, time.monotonic() - start - self._socket_time))
+			on_connect()
+
+	return type(f'Counting{pool_cls.__name__}', (pool_cls,), {'ConnectionCls': CountingConnection})
+
+
+class PoolAdapter(HTTPAdapter):
+	'''An HTTPAdapter that counts the connections it opens, and the requests
+	sent. Every request that didn't need a new connection reused one, which
+	saves a TCP and TLS handshake.'''
+
+	def __init__(self, *args, **kwargs):
+		self._connections = 0
+		self._requests = 0
+		self._stats_lock = threading.Lock()
+
+		super().__init__(*args, **kwargs)
+
+	def __repr__(self):
+		return f'<PoolAdapter({self.connection_stats})>'
+
+	@classmethod
+	def from_settings(cls, settings):
+		'''Build the adapter from the "connection_pool" settings'''
+
+		if settings is None:
+			return cls(pool_connections=4, pool_maxsize=16)
+
+		retries = settings.get('retries')
+		if retries is not None:
+			max_retries = Retry(total=None,
+								connect=retries.get('connect', default=3),
+								read=retries.get('read', default=0),
+								status=retries.get('status', default=0),
+								status_forcelist=retries.get('status_forcelist', default=None),
+								backoff_factor=retries.get('backoff_factor', default=0.5),
+								raise_on_status=False)
+		else:
+			max_retries = 0
+
+		return cls(pool_connections=settings.get('pool_connections', default=4),
+				   pool_maxsize=settings.get('pool_maxsize', default=16),
+				   pool_block=settings.get('pool_block', default=False),
+				   max_retries=max_retries)
+
+	def init_poolmanager(self, *args, **kwargs):
+		super().init_poolmanager(*args, **kwargs)
+
+		self.poolmanager.pool_classes_by_scheme = {
+			scheme: _counting_pool(pool_cls, self._connected)
+			for scheme, pool_cls in self.poolmanager.pool_classes_by_scheme.items()
+		}
+
+	def _connected(self):
+		with self._stats_lock:
+			self._connections += 1
+
+	def send(self, request, *args, **kwargs):
+		with self._stats_lock:
+			self._requests += 1
+		return super().send(request, *args, **kwargs)
+
+	@property
+	def connection_stats(self):
+		'''The number of new connections opened, and the number of requests
+		that reused an open connection.'''
+
+		with self._stats_lock:
+			return {'new': self._connections, 'reused': max(0, self._requests - self._connections)}
+
+
+def configure_session(session, settings):
+	'''Mount a PoolAdapter for http and https on the requests session, and
+	return it. Keep-alive can be switched off with the "keep_alive" setting.'''
+
+	adapter = PoolAdapter.from_settings(settings)
+	session.mount('https://', adapter)
+	session.mount('http://', adapter)
+
+	if settings is not None and not settings.get('keep_alive', default=True):
+		session.headers['Connection'] = 'close'
+
+	return adapter
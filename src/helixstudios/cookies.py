@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+'''Persist the login cookies between runs as a small JSON file, along
+with the last time the login was known to be valid.'''
+
+import os
+import json
+import time
+import logging
+
+import requests.cookies
+
+from .utils import atomic_write
+
+
+log = logging.getLogger(__name__)
+
+
+class CookieStore:
+	'''A JSON cookie jar on disk. Cookies that have expired are dropped
+	when the jar is loaded, and the time the login was last confirmed
+	decides whether the session can be trusted without asking the server.'''
+
+	def __init__(self, path):
+		self._path = path
+		self._validated = None
+
+	def __repr__(self):
+		return f'<CookieStore("{self._path}")>'
+
+	@property
+	def validated(self):
+		'''When the stored login was last confirmed, None if nothing's loaded'''
+		return self._validated
+
+	def fresh(self, ttl):
+		'''True if the stored login was confirmed less than `ttl` seconds ago'''
+		return self._validated is not None and time.time() - self._validated < ttl
+
+	def load(self):
+		'''Load the cookies into a new cookie jar. Returns None if there is no
+		stored session, it can't be read, or all its cookies have expired.'''
+
+		if not os.path.isfile(self._path):
+			log.info('No session to restore')
+			return None
+
+		try:
+			with open(self._path) as f:
+				stored = json.load(f)
+			validated = stored['validated']
+			cookies = stored['cookies']
+		except (OSError, ValueError, KeyError, TypeError):
+			log.warning(f'Session file "{self._path}" could not be read, ignoring it')
+			return None
+
+		now = time.time()
+		jar = requests.cookies.RequestsCookieJar()
+		for cookie in cookies:
+			if cookie.get('expires') is not None and cookie['expires'] <= now:
+				continue
+			jar.set_cookie(requests.cookies.create_cookie(**cookie))
+
+		if cookies and not jar:
+			log.info('All the stored session cookies have expired')
+			return None
+
+		self._validated = validated
+		return jar
+
+	def store(self, jar, validated=None):
+		'''Write the cookies in the jar to disk. `validated` is when the login
+		was confirmed, now if it isn't given.'''
+
+		self._validated = time.time() if validated is None else validated
+
+		cookies = [{
+			'name':     c.name,
+			'value':    c.value,
+			'domain':   c.domain,
+			'path':     c.path,
+			'expires':  c.expires,
+			'secure':   c.secure
+		} for c in jar]
+
+		atomic_write(self._path, json.dumps({'validated': self._validated, 'cookies': cookies}, indent=4))
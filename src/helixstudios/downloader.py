@@ -3,13 +3,24 @@
 '''Downloader runs the main sequence of downloads.'''
 
 import re
+import time
+import queue
+import logging
+import threading
 
 from typing import Iterable
 
 from .session import HelixSession
+from .library import LibraryIndex
+from .watermark import CrawlWatermark
+from .parse_engine import set_default_engine
 
 from .parse_video import VideoPage
 from .parse_video_listing import VideoListingPage
+from .parse_video_listing import VideoLinkParser
+
+
+log = logging.getLogger(__name__)
 
 
 class HelixDownloader:
@@ -18,52 +29,236 @@ class HelixDownloader:
 
 	def __init__(self, settings, start_session=True):
 		self._settings = settings
+
+		# the pages parsed from here on use the engine in the settings
+		set_default_engine(settings.get('session', 'parser_engine', default='html.parser'))
 		
 		self._session = HelixSession(
 			settings['session'], start_session=start_session)
 
+		self._library_index = LibraryIndex.from_settings(settings)
+
 	@property
 	def session(self):
 		return self._session
 
-	def all_video_links(self, page_limit=None, video_limit=None, retries=10) -> Iterable[str]:
+	@property
+	def library_index(self):
+		'''The index of videos in the library, None if it isn't enabled'''
+		return self._library_index
+
+	@property
+	def watermark_file(self):
+		'''Get the path to the crawl watermark file.'''
+		return self._settings.get_path('session', 'watermark', 
+			default='~/.config/helixstudios/watermark.json')
+
+	def load_watermark(self):
+		'''The watermark of the last complete crawl, for an incremental crawl'''
+		return CrawlWatermark.load(self.watermark_file)
+
+	def all_video_links(self, page_limit=None, video_limit=None, retries=10, watermark=None) -> Iterable[str]:
 		'''Iterate over all videos links on all pages, starting from the beginning,
-		limiting the total number of either video-listing pages or videos'''
+		limiting the total number of either video-listing pages or videos.
+
+		With a crawl watermark (see load_watermark), the crawl stops once a 
+		number of videos in a row have been seen by a previous complete crawl.
+		The links are recorded on the watermark, and it's marked as crawled at
+		the end. Storing it is up to the caller, with `commit`, once every link
+		has been handled.'''
 
 		page_count = 0
 		video_count = 0
 
-		next_page_url = self._settings['session']['links']['videos']
-		
-		while True:
-			status_code, page_text = self.session.get(next_page_url, retries=retries)
+		stop_after = self._settings.get('session', 'incremental_stop_after', default=10)
+		known_in_a_row = 0
+
+		# the next listing pages are fetched in the background while the 
+		# videos on the current page are being handled. Streamed pages hand
+		# out their links while they arrive, they're read by the same thread.
+		read_ahead = self._settings.get('session', 'listing_read_ahead', default=2)
+		stream = self._settings.get('session', 'stream_listing_pages', default=True)
+		if read_ahead > 0 and stream:
+			pages = ReadAhead(self._streamed_listing_pages(page_limit=page_limit, retries=retries), read_ahead)
+		elif read_ahead > 0:
+			pages = ReadAhead(self._listing_pages(page_limit=page_limit, retries=retries), read_ahead)
+		else:
+			pages = self._listing_pages(page_limit=page_limit, retries=retries)
+
+		try:
+			for video_links in pages:
+				for video_link in video_links:
+					if watermark is not None:
+						known_in_a_row = known_in_a_row + 1 if video_link in watermark else 0
+						if known_in_a_row >= stop_after:
+							log.info(f'{known_in_a_row} known videos in a row, the rest of the listing has been seen before')
+							watermark.crawled()
+							return
+
+						watermark.seen(video_link)
 
-			page = VideoListingPage(page_text, self.session.last_url)
-			for video_link in page.all_videos():
-				yield video_link
+					yield video_link
 
-				video_count += 1
-				if video_limit is not None and video_count >= video_limit:
+					video_count += 1
+					if video_limit is not None and video_count >= video_limit:
+						return
+
+				page_count += 1
+				if page_limit is not None and page_count >= page_limit:
 					return
 
-			page_count += 1
-			if page_limit is not None and page_count >= page_limit:
-				return
+		finally:
+			pages.close()
+
+		# the whole listing was crawled
+		if watermark is not None:
+			watermark.crawled()
+
+	def _listing_pages(self, page_limit=None, retries=10) -> Iterable[list]:
+		'''Iterate over the video listing pages, yielding the list of 
+		video links found on each page.'''
+
+		page_count = 0
+		next_page_url = self._settings['session']['links']['videos']
 
+		while next_page_url is not None and (page_limit is None or page_count < page_limit):
+			response = self._fetch_listing_page(next_page_url, retries=retries)
+
+			page = VideoListingPage(response.text, response.url)
+			yield page.all_videos()
+
+			page_count += 1
 			next_page_url = page.next_page
 
+	def _streamed_listing_pages(self, page_limit=None, retries=10) -> Iterable[Iterable[str]]:
+		'''Like _listing_pages, but the links of each page are yielded before
+		the page is requested, as StreamedLinks that are filled in while the
+		page arrives. The page is read when the next one is asked for, so 
+		this has to run in a background thread, see ReadAhead.'''
+
+		page_count = 0
+		next_page_url = self._settings['session']['links']['videos']
+
+		while next_page_url is not None and (page_limit is None or page_count < page_limit):
+			links = StreamedLinks()
+			yield links
+
+			parser = VideoLinkParser(on_link=links.put)
+			try:
+				self._fetch_listing_page(next_page_url, retries=retries, parser=parser)
+			finally:
+				links.close()
+
+			page_count += 1
+			next_page_url = parser.next_page
+
+	def _fetch_listing_page(self, url, retries=10, parser=None):
+		'''Fetch a listing page, retrying it until it comes back with a 200. 
+		A page with a server error on it has no link to the next page, it 
+		would look like the end of the listing. Raises RuntimeError if all
+		the attempts fail.'''
+
+		for i in range(retries):
+			response = self.session.fetch(url, retries=retries, parser=parser)
+			if response.status_code == 200:
+				return response
+
+			sleep_time = min([2 ** i, 60])    # double sleep time with each failed request, max 60 secs.
+			log.error(f'HTTP code {response.status_code} for listing page: {url}, retrying in {sleep_time} seconds')
+			time.sleep(sleep_time)
+
+		log.error(f'All attempts have failed for listing page: {url}')
+		raise RuntimeError('listing page could not be fetched')
+
 	def all_video_pages(self, page_limit=None, video_limit=None, retries=10) -> Iterable[VideoPage]:
 		'''Iterate over all videos, downloading the pages for each and yield the video pages'''
 
 		for link in self.all_video_links(page_limit=page_limit, video_limit=video_limit, retries=retries):
-			status, page_text = self.session.get(link, retries=retries)
+			response = self.session.fetch(link, retries=retries)
 
-			page = VideoPage(page_text, self.session.last_url)
+			page = VideoPage(response.text, response.url)
 			yield page
 
 		
 
 
+class StreamedLinks:
+	'''The links of a listing page that's still arriving. One thread puts
+	the links in as they're found and closes it at the end of the page,
+	while iterating over it in another hands them out as soon as they're 
+	in.'''
+
+	_END = object()
+
+	def __init__(self):
+		self._queue = queue.Queue()
+
+	def put(self, link):
+		self._queue.put(link)
+
+	def close(self):
+		self._queue.put(self._END)
+
+	def __iter__(self):
+		while True:
+			link = self._queue.get()
+			if link is self._END:
+				return
+			yield link
+
+
+class ReadAhead:
+	'''Run an iterator in a background thread, keeping up to `size` items 
+	ready ahead of the consumer. Exceptions in the background thread are 
+	raised in the consumer.'''
+
+	_DONE = object()
+
+	def __init__(self, iterable, size):
+		self._queue = queue.Queue(maxsize=size)
+		self._closed = threading.Event()
+
+		self._thread = threading.Thread(target=self._run, args=(iterable,), name='read-ahead')
+		self._thread.daemon = True
+		self._thread.start()
+
+	def _run(self, iterable):
+		try:
+			for item in iterable:
+				if not self._put((item, None)):
+					return   # the consumer has stopped
+			self._put((self._DONE, None))
+
+		except BaseException as e:
+			self._put((self._DONE, e))
+
+	def _put(self, item):
+		'''Wait for space in the queue, give up if the consumer has stopped'''
+
+		while not self._closed.is_set():
+			try:
+				self._queue.put(item, timeout=0.1)
+				return True
+			except queue.Full:
+				pass
+
+		return False
+
+	def __iter__(self):
+		while True:
+			item, error = self._queue.get()
+			if error is not None:
+				raise error
+			elif item is self._DONE:
+				return
+
+			yield item
+
+	def close(self):
+		'''Stop the background thread from reading any further ahead'''
+		self._closed.set()
+
+
 def _resolution(quality_description):
 	'''Return the resolution as an int, 0 if it cannot be found.'''
 
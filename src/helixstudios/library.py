@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+'''A persistent index of the videos in the library folders, so checking
+whether a video has already been downloaded doesn't need to touch the
+(possibly slow, external or network mounted) library folders at all.'''
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+log = logging.getLogger(__name__)
+
+
+STATUS_COMPLETE = 'complete'
+STATUS_PARTIAL = 'partial'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS videos (
+	root          TEXT NOT NULL,
+	library_path  TEXT NOT NULL,
+	size          INTEGER NOT NULL,
+	mtime         REAL NOT NULL,
+	status        TEXT NOT NULL,
+	PRIMARY KEY (root, library_path)
+)
+'''
+
+
+def _scan_video_folder(root, folder_name):
+	'''Look for the video file in one video folder. Returns a row for the
+	index, or None if there's no video there.'''
+
+	library_path = os.path.join(folder_name, f'{folder_name}.mp4')
+
+	for path, status in ((library_path, STATUS_COMPLETE), (library_path + '.part', STATUS_PARTIAL)):
+		try:
+			st = os.stat(os.path.join(root, path))
+		except OSError:
+			continue
+
+		return (root, library_path, st.st_size, st.st_mtime, status)
+
+	return None
+
+
+class LibraryIndex:
+	'''An SQLite index of every video in the library roots, with its size,
+	modification time and download status. All lookups are answered from
+	memory, the database keeps the index across runs.'''
+
+	def __init__(self, path, workers=16):
+		self._path = path
+		self._workers = workers
+		self._lock = threading.Lock()
+
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		self._db = sqlite3.connect(path, check_same_thread=False)
+		self._db.execute(SCHEMA)
+		self._db.commit()
+
+		# library path -> {root: status}
+		self._videos = {}
+		for root, library_path, status in self._db.execute('SELECT root, library_path, status FROM videos'):
+			self._videos.setdefault(library_path, {})[root] = status
+
+	def __repr__(self):
+		return f'<LibraryIndex({len(self._videos)} videos)>'
+
+	def __len__(self):
+		return len(self._videos)
+
+	@classmethod
+	def from_settings(cls, settings):
+		'''Open the index given in the "library" settings, None if there's no
+		index configured.'''
+
+		if not settings.get('library', 'index'):
+			return None
+
+		return cls(settings.get_path('library', 'index'),
+				   workers=settings.get('library', 'index_scan_workers', default=16))
+
+	@property
+	def empty(self):
+		return len(self._videos) == 0
+
+	def find(self, library_path):
+		'''Return the root folder holding a completely downloaded copy of the
+		video, or None if it isn't in the library.'''
+
+		# the workers record downloads while others look them up
+		with self._lock:
+			videos = dict(self._videos.get(library_path, {}))
+
+		for root, status in videos.items():
+			if status == STATUS_COMPLETE:
+				return root
+
+		return None
+
+	def record(self, root, library_path, status=STATUS_COMPLETE):
+		'''Add or update a single video, e.g. after its download completes.'''
+
+		st = os.stat(os.path.join(root, library_path))
+		self._store([(root, library_path, st.st_size, st.st_mtime, status)])
+
+	def _store(self, rows):
+		with self._lock:
+			self._db.executemany('INSERT OR REPLACE INTO videos VALUES (?, ?, ?, ?, ?)', rows)
+			self._db.commit()
+
+			for root, library_path, _, _, status in rows:
+				self._videos.setdefault(library_path, {})[root] = status
+
+	def rebuild(self, roots):
+		'''Rescan the given library roots, replacing what the index knows
+		about each of them. Every video folder is checked in parallel, which
+		hides the latency of slow network mounts. Roots that don't exist right
+		now (e.g. an unplugged drive) keep their old entries.'''
+
+		for root in roots:
+			if not os.path.isdir(root):
+				log.warning(f'Library folder "{root}" is not available, keeping its index entries')
+				continue
+
+			start = time.monotonic()
+			folders = [e.name for e in os.scandir(root) if e.is_dir() and not e.name.startswith('.')]
+
+			with ThreadPoolExecutor(max_workers=self._workers) as pool:
+				rows = [r for r in pool.map(lambda f: _scan_video_folder(root, f), folders) if r]
+
+			with self._lock:
+				self._db.execute('DELETE FROM videos WHERE root = ?', (root,))
+				for videos in self._videos.values():
+					videos.pop(root, None)
+				self._videos = {path: videos for path, videos in self._videos.items() if videos}
+
+			self._store(rows)
+			log.info(f'Indexed {len(rows)} videos in "{root}" in {time.monotonic() - start:.1f}s')
+
+	def close(self):
+		with self._lock:
+			self._db.close()
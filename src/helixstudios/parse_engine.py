@@ -0,0 +1,381 @@
+#!/usr/bin/env python
+
+'''The engines that turn page text into a tree for the Page parsers.
+
+"html.parser" and "lxml" are Beautiful Soup trees built by Python's own
+parser or by lxml. "lightweight" is a much smaller tree built straight
+from Python's HTMLParser, with just the part of the Beautiful Soup API
+the parsers use: `find`, `find_all`, `get`, `contents` and `string`. Its
+lookups match tags and attributes the same way Beautiful Soup does.
+
+Every engine can also parse just the sections of a page a parser needs,
+given as (name, attrs) pairs: each tag matching a section is kept with
+everything inside it, and the rest of the page is skipped. Lookups of the
+sections, and of anything inside them, find the same as in the whole page.'''
+
+import bs4
+
+from html.parser import HTMLParser
+
+try:
+	from bs4.filter import ElementFilter
+except ImportError:
+	ElementFilter = None   # Beautiful Soup before 4.13 always parses the whole page
+
+
+ENGINES = ('html.parser', 'lxml', 'lightweight')
+
+DEFAULT_ENGINE = 'html.parser'
+
+# tags that never have content or an end tag
+VOID_ELEMENTS = frozenset(['area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta',
+						   'param', 'source', 'track', 'wbr'])
+
+
+_default_engine = DEFAULT_ENGINE
+
+
+def engine_available(engine):
+	'''True if the engine can be used, lxml is an optional package'''
+
+	if engine == 'lxml':
+		return bs4.builder.builder_registry.lookup('lxml') is not None
+	return engine in ENGINES
+
+
+def set_default_engine(engine):
+	'''Set the engine used by pages that aren't given one'''
+
+	global _default_engine
+
+	if engine not in ENGINES:
+		raise ValueError(f'unknown parser engine "{engine}", choose one of: {", ".join(ENGINES)}')
+	if not engine_available(engine):
+		raise ValueError(f'the "{engine}" parser engine needs the {engine} package to be installed')
+
+	_default_engine = engine
+
+
+def default_engine():
+	return _default_engine
+
+
+def parse_document(text, engine=None, sections=None):
+	'''Parse the page text into a tree with the given engine, or the default
+	one. With `sections`, a list of (name, attrs) pairs, only the tags
+	matching one of them are parsed, with their contents.'''
+
+	engine = engine or _default_engine
+
+	if engine == 'lightweight':
+		return LightDocument.parse(text, sections)
+	elif engine in ('html.parser', 'lxml'):
+		parse_only = _SectionFilter(sections) if sections and ElementFilter is not None else None
+		return bs4.BeautifulSoup(text, engine, parse_only=parse_only)
+	else:
+		raise ValueError(f'unknown parser engine "{engine}", choose one of: {", ".join(ENGINES)}')
+
+
+def is_tag(node):
+	return isinstance(node, (bs4.element.Tag, LightTag))
+
+
+def is_text(node):
+	'''True for text, including comments, as with Beautiful Soup'''
+	return isinstance(node, (bs4.element.NavigableString, LightText))
+
+
+def is_comment(node):
+	return isinstance(node, (bs4.element.Comment, LightComment))
+
+
+class LightText(str):
+	'''A piece of text in a lightweight tree'''
+
+	# texts have no tag name, as with Beautiful Soup
+	name = None
+
+
+class LightComment(LightText):
+	'''An HTML comment in a lightweight tree'''
+	pass
+
+
+def _class_matches(actual, wanted):
+	'''Like Beautiful Soup: the class matches one of the tag's classes, or
+	all of them as written'''
+
+	classes = actual.split()
+	return wanted in classes or wanted == ' '.join(classes)
+
+
+def _attrs_match(actual, wanted):
+	'''True if the attributes of a tag have all the wanted values'''
+
+	for key, value in wanted.items():
+		actual_value = actual.get(key)
+		if actual_value is None:
+			return False
+		if isinstance(actual_value, list):
+			# Beautiful Soup splits up the classes
+			actual_value = ' '.join(actual_value)
+		if key == 'class':
+			if not _class_matches(actual_value, value):
+				return False
+		elif actual_value != value:
+			return False
+
+	return True
+
+
+def attrs_match(actual, wanted):
+	'''True if the attributes of a tag, of any engine or straight from an
+	HTMLParser, have the wanted values, matched like `find` does'''
+	return _attrs_match(actual, wanted)
+
+
+def _section_index(sections):
+	'''The attributes of the sections, by tag name'''
+
+	index = {}
+	for name, attrs in sections:
+		index.setdefault(name, []).append(attrs)
+	return index
+
+
+def _in_sections(index, name, attrs):
+	'''True if a tag with the name and attributes is one of the indexed sections'''
+
+	section_attrs = index.get(name)
+	return section_attrs is not None and any(_attrs_match(attrs, wanted) for wanted in section_attrs)
+
+
+if ElementFilter is not None:
+	class _SectionFilter(ElementFilter):
+		'''Lets Beautiful Soup create only the tags of the sections, which
+		it then fills with everything inside them'''
+
+		def __init__(self, sections):
+			super().__init__()
+			self._index = _section_index(sections)
+
+		def allow_tag_creation(self, nsprefix, name, attrs):
+			# multi-valued attributes may already be lists
+			attrs = {key: ' '.join(value) if isinstance(value, list) else value
+					 for key, value in (attrs or {}).items()}
+			return _in_sections(self._index, name, attrs)
+
+		def allow_string_creation(self, string):
+			return False
+
+
+def _tag_matcher(name, attrs):
+	'''A function that tells whether a tag has the name and attributes, the
+	name being a tag name, a list of names, True, or a function of the tag'''
+
+	if name is None or name is True:
+		name_matches = None
+	elif isinstance(name, str):
+		name_matches = lambda tag: tag.name == name
+	elif callable(name):
+		name_matches = name
+	else:
+		# a list of names, as with Beautiful Soup that includes tuples
+		names = frozenset(name)
+		name_matches = lambda tag: tag.name in names
+
+	def matches(tag):
+		if name_matches is not None and not name_matches(tag):
+			return False
+		return _attrs_match(tag.attrs, attrs)
+
+	return matches
+
+
+class LightTag:
+	'''A tag in a lightweight tree. Every node of the document is also kept
+	in one list in document order, `nodes`, where the tag's descendants are
+	the slice from `start` to `end`.'''
+
+	__slots__ = ('name', 'attrs', 'contents', 'parent', 'nodes', 'start', 'end')
+
+	def __init__(self, name, attrs=None, parent=None, nodes=None):
+		self.name = name
+		self.attrs = attrs or {}
+		self.contents = []
+		self.parent = parent
+
+		self.nodes = nodes if nodes is not None else []
+		self.start = len(self.nodes)
+		self.end = None   # until the tag is closed
+
+	def __repr__(self):
+		return f'<LightTag({self.name})>'
+
+	def __getitem__(self, key):
+		return self.attrs[key] if key != 'class' else self.attrs[key].split()
+
+	def __getattr__(self, name):
+		# `tag.body` finds the first body tag, as with Beautiful Soup
+		if name.startswith('_'):
+			raise AttributeError(name)
+		return self.find(name)
+
+	def get(self, key, default=None):
+		if key not in self.attrs:
+			return default
+		return self[key]
+
+	@property
+	def string(self):
+		'''The only text inside the tag, None if there's more than one child'''
+
+		if len(self.contents) != 1:
+			return None
+
+		child = self.contents[0]
+		return child if isinstance(child, LightText) else child.string
+
+	@property
+	def descendants(self):
+		'''Every tag and text below this tag, in document order'''
+		return self.nodes[self.start:self.end]
+
+	def find_all(self, name=None, attrs=None, recursive=True, string=None, limit=None):
+		'''All tags with the name and attributes given, or with `string` (a
+		text or a function of the text) all matching texts. The name can also
+		be a list of names, True, or a function of the tag.'''
+
+		nodes = self.descendants if recursive else self.contents
+
+		if string is not None and name is None and not attrs:
+			kind, matches = LightText, string if callable(string) else string.__eq__
+		else:
+			kind, matches = LightTag, _tag_matcher(name, attrs or {})
+
+		results = []
+		for node in nodes:
+			if isinstance(node, kind) and matches(node):
+				results.append(node)
+				if limit is not None and len(results) >= limit:
+					break
+
+		return results
+
+	def find(self, name=None, attrs=None, recursive=True, string=None):
+		results = self.find_all(name, attrs, recursive=recursive, string=string, limit=1)
+		return results[0] if results else None
+
+
+class LightDocument(LightTag):
+	'''The root of a lightweight tree'''
+
+	__slots__ = ()
+
+	def __init__(self):
+		super().__init__('[document]')
+
+	@classmethod
+	def parse(cls, text, sections=None):
+		builder = _LightTreeBuilder(sections)
+		builder.feed(text)
+		builder.close()
+		return builder.document
+
+
+class _SkippedTag:
+	'''An open tag outside the sections being parsed'''
+
+	__slots__ = ('name',)
+
+	def __init__(self, name):
+		self.name = name
+
+
+class _LightTreeBuilder(HTMLParser):
+	'''Builds a lightweight tree. End tags close the most recent open tag
+	with the same name, stray end tags are ignored, just like Beautiful
+	Soup with Python's parser.
+
+	With sections, the tags outside them are only tracked while they're
+	open, so the sections end where they would in the whole tree.'''
+
+	def __init__(self, sections=None):
+		super().__init__(convert_charrefs=True)
+		self.document = LightDocument()
+		self._open = [self.document]
+		self._index = _section_index(sections) if sections is not None else None
+
+	def _outside_sections(self):
+		top = self._open[-1]
+		return self._index is not None and (top is self.document or type(top) is _SkippedTag)
+
+	def _add(self, node):
+		self._open[-1].contents.append(node)
+		self.document.nodes.append(node)
+
+	def _add_tag(self, name, attrs, parent):
+		nodes = self.document.nodes
+		nodes.append(None)   # the tag's own place, its descendants start after it
+
+		tag = LightTag(name, attrs, parent, nodes)
+		nodes[tag.start - 1] = tag
+		parent.contents.append(tag)
+		return tag
+
+	def _close(self, i):
+		'''Close the open tags from the i-th'''
+
+		for tag in self._open[i:]:
+			if type(tag) is not _SkippedTag:
+				tag.end = len(self.document.nodes)
+		del self._open[i:]
+
+	def handle_starttag(self, name, attrs):
+		attrs = {key: '' if value is None else value for key, value in attrs}
+
+		if self._outside_sections():
+			if not _in_sections(self._index, name, attrs):
+				if name not in VOID_ELEMENTS:
+					self._open.append(_SkippedTag(name))
+				return
+			parent = self.document
+		else:
+			parent = self._open[-1]
+
+		tag = self._add_tag(name, attrs, parent)
+		if name not in VOID_ELEMENTS:
+			self._open.append(tag)
+		else:
+			tag.end = tag.start
+
+	def handle_startendtag(self, name, attrs):
+		self.handle_starttag(name, attrs)
+		if name not in VOID_ELEMENTS:
+			self._close(len(self._open) - 1)
+
+	def handle_endtag(self, name):
+		for i in range(len(self._open) - 1, 0, -1):
+			if self._open[i].name == name:
+				self._close(i)
+				return
+
+	def handle_data(self, data):
+		if self._outside_sections():
+			return
+
+		contents = self._open[-1].contents
+
+		# text split up by the parser is joined again, it's the last node
+		if contents and type(contents[-1]) is LightText:
+			contents[-1] = self.document.nodes[-1] = LightText(contents[-1] + data)
+		else:
+			self._add(LightText(data))
+
+	def handle_comment(self, data):
+		if not self._outside_sections():
+			self._add(LightComment(data))
+
+	def close(self):
+		super().close()
+		self._close(1)
@@ -11,7 +11,7 @@ from functools import cached_property
 
 
 PLAYLIST_FILE_LINKS_REGEX = re.compile(r'^#EXT-X-STREAM-INF:(?P<details>[a-zA-Z0-9".,=-]*)\n(?P<url>.*)$', re.M)
-STREAM_FILE_LINKS_REGEX = re.compile(r'^#EXTINF:9,\n(?P<url>.*)$', re.M)
+STREAM_FILE_LINKS_REGEX = re.compile(r'^#EXTINF:[0-9.]+,.*\n(?P<url>.*)$', re.M)
 
 DETAILS_STRING_REGEX = re.compile(r'(?P<key>[A-Z-]+)=(?P<value>([^",]+|"[^"]+"))')
 
@@ -65,7 +65,8 @@ class M3U8PlaylistFile:
 
 	@property
 	def highest_bandwidth_stream(self):
-		return max(self.iter_streams(), key=lambda x: x.get('BANDWIDTH'))
+		'''The stream with the highest bandwidth, None if there are no streams'''
+		return max(self.iter_streams(), key=lambda x: x.get('BANDWIDTH'), default=None)
 
 
 class M3U8Stream:
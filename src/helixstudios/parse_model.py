@@ -24,6 +24,8 @@ MODEL_STATS_VALUES_ITEM = TagClass('span', 'stat-item')
 class ModelPage(Page):
 	'''A parser for the general video listing page'''
 
+	SECTIONS = (MODEL_NAME, MODEL_DESCRIPTION, MODEL_STATS_LABELS, MODEL_STATS_VALUES)
+
 	@cached_property
 	def model_name(self):
 		'''The model's name.'''
@@ -3,11 +3,9 @@
 '''Parse the video page for all video metadata and links.'''
 
 import re
-import bs4
 
 from .utils import base_url
-
-from bs4 import BeautifulSoup
+from .parse_engine import parse_document, is_tag, is_text, attrs_match
 
 from collections import namedtuple
 from functools import cached_property
@@ -20,12 +18,29 @@ TagId = namedtuple('TagId', ['tag', 'id'])
 TagIdAttr = namedtuple('TagId', ['tag', 'id', 'attr'])
 
 
+PAGE_TITLE = Tag('title')
+
+
 class Page:
-	'''A generic Beautiful Soup page parser'''
+	'''A generic page parser. The tree is built by the given parser engine,
+	or the default one, see parse_engine.
+
+	Subclasses list the search objects of everything they look up in 
+	SECTIONS, and only those sections of the page are parsed. Set `strain`
+	to False to parse the whole page. The tags of all the SECTIONS are
+	also found in one walk of the tree, the first time one is looked up,
+	and `find` and `find_all` of them then read from that.'''
 
-	def __init__(self, page_text, page_final_url):
+	# None for the whole page
+	SECTIONS = None
+
+	def __init__(self, page_text, page_final_url, engine=None, strain=True):
 		self._page_text = page_text
-		self._page = BeautifulSoup(self._page_text, 'html.parser')
+
+		sections = None
+		if strain and self.SECTIONS is not None:
+			sections = [search_rule(s) for s in (PAGE_TITLE,) + tuple(self.SECTIONS)]
+		self._page = parse_document(self._page_text, engine, sections)
 
 		self._url = page_final_url
 		self._base_url = base_url(self._url)
@@ -50,14 +65,27 @@ class Page:
 	@cached_property
 	def webpage_title(self):
 		'''The HTML title of the webpage'''
-		title = self.page.find('title')
+		title = self.find(PAGE_TITLE)
 		if title:
 			return title.string
 
+	@cached_property
+	def _found(self):
+		'''The tags of every section, found in one walk of the tree'''
+
+		if self.SECTIONS is None:
+			return {}
+		return find_in_one_pass(self.page, (PAGE_TITLE,) + tuple(self.SECTIONS))
+
 	def find(self, item, *args, **kwargs):
+		if not args and not kwargs and _search_key(item) in self._found:
+			tags = self._found[_search_key(item)]
+			return _attr_of_search(item, tags[0] if tags else None)
 		return find_dispatch(self.page.find, item, *args, **kwargs)
 
 	def find_all(self, item, *args, **kwargs):
+		if not args and not kwargs and _search_key(item) in self._found:
+			return _attr_of_search(item, list(self._found[_search_key(item)]))
 		return find_dispatch(self.page.find_all, item, *args, **kwargs)
 	
 
@@ -68,12 +96,12 @@ def _flatten_iter(tag, paragraph_delimiter='\n'):
 		for t in tag:
 			yield from _flatten_iter(t)
 
-	elif isinstance(tag, bs4.element.Tag):
+	elif is_tag(tag):
 		yield from _flatten_iter(tag.contents)
 		if tag.name == 'p':
 			yield paragraph_delimiter
 
-	elif isinstance(tag, bs4.element.NavigableString):
+	elif is_text(tag):
 		yield str(tag).strip()
 
 
@@ -106,16 +134,68 @@ def find_dispatch(find_func, search_obj, *args, **kwargs):
 		raise TypeError('search object is not a search tuple')
 
 
+def search_rule(search_obj):
+	'''The tag name and attributes a search object looks for, the same
+	ones find_dispatch searches with'''
+
+	if isinstance(search_obj, Tag):
+		return search_obj.tag, {}
+	elif isinstance(search_obj, (TagClass, TagClassAttr)):
+		return search_obj.tag, {'class': search_obj.cls}
+	elif isinstance(search_obj, (TagId, TagIdAttr)):
+		return search_obj.tag, {'id': search_obj.id}
+	else:
+		raise TypeError('search object is not a search tuple')
+
+
+def _search_key(search_obj):
+	# search tuples of different types can be equal, e.g. a TagClass and a TagId
+	return type(search_obj), search_obj
+
+
+def find_in_one_pass(root, search_objs):
+	'''All the tags matching each of the search objects, in document order, 
+	found in one walk of the tree instead of a search for each. The result 
+	is keyed by the search objects' type and value.'''
+
+	rules = {}
+	for search_obj in search_objs:
+		name, attrs = search_rule(search_obj)
+		rules.setdefault(name, []).append((_search_key(search_obj), attrs))
+
+	found = {key: [] for name_rules in rules.values() for key, _ in name_rules}
+
+	# texts have no name, so they never match
+	for node in root.descendants:
+		name_rules = rules.get(node.name)
+		if name_rules is None:
+			continue
+		for key, attrs in name_rules:
+			if not attrs or attrs_match(node.attrs, attrs):
+				found[key].append(node)
+
+	return found
+
+
+def _attr_of_search(search_obj, obj):
+	'''What find_dispatch returns for the tags found: their attribute for
+	the *Attr search objects, or the tags themselves'''
+
+	if isinstance(search_obj, (TagClassAttr, TagIdAttr)):
+		return _attr_lookup(obj, search_obj.attr)
+	return obj
+
+
 def _attr_lookup(obj, attr):
 	'''For a given object returned by the find/find_all functions,
 	return the named attribute of the tags.'''
 
 	if not obj:
 		return obj  # obj is None or empty list
-	elif isinstance(obj, bs4.element.Tag):
+	elif is_tag(obj):
 		return obj.get(attr)
 	elif isinstance(obj, list):
-		return [_attr_lookup(o) for o in obj]
+		return [_attr_lookup(o, attr) for o in obj]
 	else:
 		raise TypeError(f'unrecognised type: {type(obj)}')
 
@@ -8,9 +8,7 @@ import datetime
 
 from functools import cached_property
 
-from bs4 import Comment
-from bs4 import BeautifulSoup
-
+from .parse_engine import is_comment
 from .parse_utils import Tag, TagClass, TagId
 from .parse_utils import TagClassAttr, TagIdAttr
 from .parse_utils import Page, flatten_html
@@ -56,6 +54,10 @@ def video_page_url_to_video_name(url):
 
 class VideoPage(Page):
 	'''Parser for the individual video pages'''
+
+	SECTIONS = (VIDEO_TITLE, VIDEO_DESCRIPTION1, VIDEO_DESCRIPTION2, VIDEO_RELEASED, VIDEO_STUDIO,
+				VIDEO_DIRECTOR, VIDEO_INFO_ITEMS, LINK_BANNER_IMAGE, LINK_VIDEO_THUMBNAIL,
+				VIDEO_CAST_SECTION, TAG_SECTION, DOWNLOAD_SECTION, PHOTO_SECTION, STREAMING_PLAYER_TAG)
 	
 	def __repr__(self):
 		return f'<VideoPage("{self.video_folder_name}")>'
@@ -132,8 +134,7 @@ class VideoPage(Page):
 	def _views_and_likes_comment(self):
 		'''Find the commented out section of code that has the views and likes'''
 
-		info_items = self.find(VIDEO_INFO_ITEMS).find_all(
-							string=lambda text: isinstance(text, Comment))
+		info_items = self.find(VIDEO_INFO_ITEMS).find_all(string=is_comment)
 		return flatten_html(info_items)
 
 	def _extract_views_likes_using_regex(self, regex):
@@ -266,7 +267,7 @@ class VideoPage(Page):
 		'''Return true if the details dictionary can be flattened to JSON'''
 
 		try:
-			json.dumps(video_page.details_dictionary())
+			json.dumps(self.details_dictionary())
 		except Exception:
 			return False
 		else:
@@ -3,9 +3,12 @@
 '''Parse the video listing pages for links to videos and the navigation 
 buttons to find the next page of videos.'''
 
+from .utils import base_url
+from .parse_engine import attrs_match
 from .parse_utils import Tag, TagClass
-from .parse_utils import Page, flatten_html
+from .parse_utils import Page, flatten_html, search_rule
 
+from html.parser import HTMLParser
 from urllib.parse import urlparse
 
 
@@ -16,12 +19,24 @@ VIDEO_LINK = TagClass('a', 'thumbnail-link')
 NEXT_PAGE = TagClass('a', 'next')
 
 
+def _video_url(page_base_url, href):
+	return page_base_url.rstrip('/') + href
+
+
+def _next_page_url(page_base_url, href):
+	# link has a leading //, strip it out along with host ("netloc")
+	path = urlparse(href)._replace(netloc='').geturl()
+	return page_base_url.rstrip('/') + path
+
+
 class VideoListingPage(Page):
 	'''A parser for the general video listing page'''
 
+	SECTIONS = (VIDEO_LINK, NEXT_PAGE)
+
 	def _video_link_iter(self):
 		for l in self.find_all(VIDEO_LINK):
-			yield self._base_url.rstrip('/') + l['href']
+			yield _video_url(self._base_url, l['href'])
 
 	def all_videos(self):
 		'''Return a list of all video links on the listing page'''
@@ -34,8 +49,57 @@ class VideoListingPage(Page):
 		link = self.find(NEXT_PAGE)
 
 		if link is not None:
-			# link has a leading //, strip it out along with host ("netloc")
-			path = urlparse(link['href'])._replace(netloc='').geturl()
-			return self._base_url.rstrip('/') + path
+			return _next_page_url(self._base_url, link['href'])
+
+
+class VideoLinkParser(HTMLParser):
+	'''An incremental parser of a video listing page, that reads the page
+	while it arrives. Each video link is handed to `on_link` as soon as its
+	<a> tag has been read, the link to the next page is in `next_page`, and
+	all the links so far are in `links`. They're the same links that
+	VideoListingPage finds in the whole page.
+
+	`start` reads the page from the beginning again, e.g. when a request
+	is retried. A link that has been handed out already isn't handed out 
+	a second time, even if the page has changed since.'''
+
+	def __init__(self, on_link=None):
+		super().__init__(convert_charrefs=True)
+		self._on_link = on_link
+		self._handed_out = set()
+		self._video_link = search_rule(VIDEO_LINK)
+		self._next_page = search_rule(NEXT_PAGE)
+		self.start('')
+
+	def start(self, page_final_url):
+		'''Start reading the page at the final URL from the beginning'''
+
+		self.reset()
+		self._base_url = base_url(page_final_url)
+		self.links = []
+		self.next_page = None
+
+	def _matches(self, rule, name, attrs):
+		return name == rule[0] and attrs_match(attrs, rule[1])
+
+	def handle_starttag(self, name, attrs):
+		if name != self._video_link[0] and name != self._next_page[0]:
+			return
+
+		attrs = {key: '' if value is None else value for key, value in attrs}
+		if 'href' not in attrs:
+			return
+
+		if self._matches(self._video_link, name, attrs):
+			link = _video_url(self._base_url, attrs['href'])
+			self.links.append(link)
+
+			if link not in self._handed_out:
+				self._handed_out.add(link)
+				if self._on_link is not None:
+					self._on_link(link)
+
+		elif self.next_page is None and self._matches(self._next_page, name, attrs):
+			self.next_page = _next_page_url(self._base_url, attrs['href'])
 
 
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+
+'''Progress reporting for any number of transfers at once. Transfers
+publish each chunk of bytes to an aggregator, which keeps a smoothed
+throughput for each transfer and for all of them together. A reporter
+thread prints the progress and can write it to a JSON status file.'''
+
+import os
+import sys
+import json
+import math
+import time
+import logging
+import datetime
+import threading
+
+from .utils import atomic_write
+from .utils import bytes_to_string
+
+
+log = logging.getLogger(__name__)
+
+
+# the throughput averages over about this many seconds
+TIME_CONSTANT = 10.0   # seconds
+
+# how often progress is printed and the status file written
+REPORT_EVERY = 3.0     # seconds
+
+
+def print_progress_line(text):
+	'''Print a progress message to the terminal, over the previous one'''
+
+	sys.stderr.write(f'   {text}                    \r')
+	sys.stderr.flush()
+
+
+def format_eta(seconds):
+	'''Format the time left as h:mm:ss or m:ss'''
+
+	if seconds is None:
+		return '?'
+
+	minutes, seconds = divmod(int(seconds), 60)
+	hours, minutes = divmod(minutes, 60)
+	return f'{hours}:{minutes:02d}:{seconds:02d}' if hours else f'{minutes}:{seconds:02d}'
+
+
+class Throughput:
+	'''An exponentially weighted moving average of bytes per second. It is
+	updated with every chunk, however irregular: each chunk's weight depends
+	on the time since the last one. The average is corrected for its start
+	at zero, so the first seconds of a transfer aren't underestimated.'''
+
+	def __init__(self, time_constant=TIME_CONSTANT, now=None):
+		self._time_constant = time_constant
+		self._started = time.monotonic() if now is None else now
+		self._updated = self._started
+		self._rate = 0.0
+
+	def __repr__(self):
+		return f'<Throughput({bytes_to_string(self.rate())}/s)>'
+
+	def _decay(self, now):
+		'''Decay the average to `now`, returns the time since the last update'''
+
+		elapsed = now - self._updated
+		if elapsed > 0:
+			self._rate *= math.exp(-elapsed / self._time_constant)
+			self._updated = now
+		return elapsed
+
+	def update(self, byte_count, now=None):
+		now = time.monotonic() if now is None else now
+		elapsed = self._decay(now)
+
+		if elapsed > 0:
+			# the weight of this chunk over the time it took: (1 - e^(-dt/tau)) / dt
+			self._rate += byte_count * -math.expm1(-elapsed / self._time_constant) / elapsed
+		else:
+			# the limit of the weight as the time between chunks goes to zero
+			self._rate += byte_count / self._time_constant
+
+	def rate(self, now=None):
+		'''The average throughput in bytes per second'''
+
+		now = time.monotonic() if now is None else now
+		self._decay(now)
+
+		weight = -math.expm1(-(now - self._started) / self._time_constant)
+		return self._rate / weight if weight > 0 else 0.0
+
+
+class TransferProgress:
+	'''The progress of a single transfer. Use it as a context manager, and
+	call `add()` with every chunk of bytes transferred.'''
+
+	def __init__(self, aggregator, name, total=None, done=0):
+		self._aggregator = aggregator
+		self.name = name
+		self.total = total
+		self.done = done
+		self.started = time.monotonic()
+		self.throughput = Throughput(aggregator.time_constant, now=self.started)
+
+	def __repr__(self):
+		return f'<TransferProgress("{self.name}", {self.done}/{self.total})>'
+
+	def __enter__(self):
+		self._aggregator._started(self)
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self._aggregator._finished(self)
+
+	def add(self, byte_count):
+		self._aggregator._add(self, byte_count)
+
+	def status(self, now):
+		'''The progress of the transfer, as written to the status file'''
+
+		rate = self.throughput.rate(now)
+		left = self.total - self.done if self.total is not None else None
+
+		return {
+			'name':     self.name,
+			'done':     self.done,
+			'total':    self.total,
+			'percent':  round(100.0 * self.done / self.total, 1) if self.total else None,
+			'rate':     round(rate),
+			'eta':      round(left / rate) if left is not None and rate > 0 else None,
+			'elapsed':  round(now - self.started, 1)
+		}
+
+
+class ProgressAggregator:
+	'''Collects the progress of all transfers. Each transfer and the whole
+	session get their own throughput average, and a time left estimate for
+	transfers of a known size.'''
+
+	def __init__(self, status_file=None, interval=REPORT_EVERY, time_constant=TIME_CONSTANT, printing=True):
+		self._status_file = status_file
+		self._interval = interval
+		self.time_constant = time_constant
+		self.printing = printing
+
+		self._lock = threading.Lock()
+		self._transfers = []
+		self._throughput = Throughput(time_constant)
+		self._done = 0
+		self._completed = 0
+
+		self._closing = threading.Event()
+		self._reporter = None
+
+	def __repr__(self):
+		return f'<ProgressAggregator({len(self._transfers)} transfers)>'
+
+	@classmethod
+	def from_settings(cls, settings):
+		'''Build the aggregator from the "progress" settings'''
+
+		if settings is None:
+			return cls()
+
+		status_file = settings.get_path('status_file') if settings.get('status_file') else None
+		return cls(status_file=status_file,
+				   interval=settings.get('interval', default=REPORT_EVERY),
+				   time_constant=settings.get('time_constant', default=TIME_CONSTANT))
+
+	def transfer(self, name, total=None, done=0):
+		'''Track a new transfer of `total` bytes (None if unknown), of which
+		`done` are already there, e.g. when resuming.'''
+		return TransferProgress(self, name, total, done)
+
+	def _started(self, transfer):
+		with self._lock:
+			self._transfers.append(transfer)
+
+	def _finished(self, transfer):
+		with self._lock:
+			self._transfers.remove(transfer)
+			self._completed += 1
+
+	def _add(self, transfer, byte_count):
+		now = time.monotonic()
+		with self._lock:
+			transfer.done += byte_count
+			transfer.throughput.update(byte_count, now)
+			self._throughput.update(byte_count, now)
+			self._done += byte_count
+
+	def status(self):
+		'''The progress of all transfers, as written to the status file'''
+
+		now = time.monotonic()
+		with self._lock:
+			transfers = [t.status(now) for t in self._transfers]
+			rate = self._throughput.rate(now)
+			done, completed = self._done, self._completed
+
+		sized = [t for t in transfers if t['total'] is not None]
+		left = sum(t['total'] - t['done'] for t in sized)
+		total = sum(t['total'] for t in sized)
+
+		return {
+			'updated':    datetime.datetime.now().isoformat(timespec='seconds'),
+			'active':     len(transfers),
+			'completed':  completed,
+			'downloaded': done,
+			'rate':       round(rate),
+			'percent':    round(100.0 * (total - left) / total, 1) if total else None,
+			'eta':        round(left / rate) if sized and rate > 0 else None,
+			'transfers':  transfers
+		}
+
+	def start(self):
+		'''Start reporting the progress in the background'''
+
+		if self._reporter is None:
+			self._reporter = threading.Thread(target=self._report_loop)
+			self._reporter.daemon = True
+			self._reporter.start()
+
+	def close(self):
+		'''Stop reporting, the status file is written one last time'''
+
+		self._closing.set()
+		if self._reporter is not None:
+			self._reporter.join()
+			self._reporter = None
+
+	def _report_loop(self):
+		while not self._closing.wait(self._interval):
+			self.report()
+		self.report(printing=False)
+
+	def report(self, printing=True):
+		'''Print the progress line, and write the status file'''
+
+		status = self.status()
+
+		if printing and self.printing and status['active']:
+			rate = f'[{bytes_to_string(status["rate"])}/s]'
+			percent = f'{status["percent"]:.1f}%' if status['percent'] is not None else bytes_to_string(status['downloaded'])
+			count = f'{status["active"]} downloads  ' if status['active'] > 1 else ''
+			eta = f'  ETA {format_eta(status["eta"])}' if status['eta'] is not None else ''
+			print_progress_line(f'{count}{percent}  {rate}{eta}')
+
+		if self._status_file is not None:
+			self._write_status(status)
+
+	def _write_status(self, status):
+		try:
+			os.makedirs(os.path.dirname(self._status_file), exist_ok=True)
+			atomic_write(self._status_file, json.dumps(status, indent=4))
+		except OSError as e:
+			log.warning(f'Could not write the status file "{self._status_file}": {e}')
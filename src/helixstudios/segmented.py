@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+
+'''Split large file downloads into byte ranges that can be fetched over
+several connections at once, and keep a record of how much of each range
+is already on disk so an interrupted download can be resumed exactly.'''
+
+import os
+import re
+import json
+import logging
+import threading
+
+from requests.exceptions import RequestException
+
+from .utils import atomic_write
+
+
+# don't bother splitting a file into ranges smaller than this
+MIN_SEGMENT_SIZE = 8 * 1024 * 1024   # 8MB
+
+
+log = logging.getLogger(__name__)
+
+
+class RangeNotSupported(RuntimeError):
+	'''The server ignored the "Range" header and sent the whole file.'''
+	pass
+
+
+class IncompleteRange(RequestException):
+	'''The connection closed before the whole byte range was received.'''
+	pass
+
+
+def split_ranges(filesize, segments, min_segment_size=MIN_SEGMENT_SIZE):
+	'''Split a file of the given size into at most `segments` contiguous
+	byte ranges. Returns a list of (start, end) tuples, the end is inclusive
+	to match the HTTP "Range" header.'''
+
+	if filesize <= 0:
+		return []
+
+	segments = max(1, min(segments, filesize // min_segment_size))
+	step = -(-filesize // segments)   # ceiling division
+
+	return [(start, min(start + step, filesize) - 1)
+			for start in range(0, filesize, step)]
+
+
+def range_header(start, end=None):
+	'''The request headers to fetch the given byte range. An open ended
+	range is requested if no end is given.'''
+
+	end = '' if end is None else end
+	return {'Range': f'bytes={start}-{end}'}
+
+
+CONTENT_RANGE_REGEX = re.compile(r'^\s*bytes\s+(?:(?P<start>\d+)-(?P<end>\d+)|\*)/(?P<total>\d+|\*)\s*$')
+def parse_content_range(header):
+	'''Parse a "Content-Range" response header into a (start, end, total)
+	tuple. The start and end are None for an unsatisfied range ("*/total"),
+	and the total is None if the server doesn't know it. Returns None if 
+	the header is missing or not understood.'''
+
+	match = CONTENT_RANGE_REGEX.match(header or '')
+	if not match:
+		return None
+
+	start, end, total = match.group('start', 'end', 'total')
+	return (int(start) if start is not None else None,
+			int(end) if end is not None else None,
+			int(total) if total != '*' else None)
+
+
+def sidecar_path(part_path):
+	'''The path of the sidecar file belonging to a partial download'''
+	return part_path + '.ranges'
+
+
+class RangeSidecar:
+	'''A small JSON file that sits next to a partially downloaded file. It
+	records the byte ranges the file was split into, and how many bytes of
+	each range have been written to disk.'''
+
+	def __init__(self, path, filesize, ranges, written=None):
+		self._path = path
+		self._filesize = filesize
+		self._ranges = [tuple(r) for r in ranges]
+		self._written = list(written) if written else [0] * len(self._ranges)
+		self._lock = threading.Lock()
+
+	def __repr__(self):
+		return f'<RangeSidecar({self.bytes_written}/{self._filesize} bytes)>'
+
+	@classmethod
+	def create(cls, path, filesize, segments, min_segment_size=MIN_SEGMENT_SIZE):
+		'''Split a new download into ranges and write the sidecar to disk.'''
+
+		sidecar = cls(path, filesize, split_ranges(filesize, segments, min_segment_size))
+		sidecar.store()
+		return sidecar
+
+	@classmethod
+	def load(cls, path, filesize=None):
+		'''Load the sidecar from disk. Returns None if there is no sidecar,
+		or if it describes a file of a different size than `filesize`.'''
+
+		if not os.path.isfile(path):
+			return None
+
+		try:
+			with open(path) as f:
+				data = json.load(f)
+		except (OSError, ValueError):
+			log.warning(f'Range sidecar "{path}" could not be read, ignoring it')
+			return None
+
+		if filesize is not None and data.get('filesize') != filesize:
+			log.warning(f'Range sidecar "{path}" is for a different file size, ignoring it')
+			return None
+
+		return cls(path, data['filesize'], data['ranges'], data['written'])
+
+	@property
+	def path(self):
+		return self._path
+
+	@property
+	def filesize(self):
+		return self._filesize
+
+	@property
+	def bytes_written(self):
+		'''The total number of bytes written to disk across all ranges'''
+		return sum(self._written)
+
+	@property
+	def complete(self):
+		return self.bytes_written >= self._filesize
+
+	def pending(self):
+		'''Return a list of (index, start, end) for the remaining part of each
+		range that hasn't been written yet.'''
+
+		return [(i, start + written, end)
+				for i, ((start, end), written) in enumerate(zip(self._ranges, self._written))
+				if start + written <= end]
+
+	def ranges_written(self):
+		'''Return a list of (start, bytes written) for every range, in order'''
+
+		with self._lock:
+			return [(start, written) for (start, _), written in zip(self._ranges, self._written)]
+
+	def record(self, index, byte_count):
+		'''Record that more bytes of the given range are on disk.'''
+
+		with self._lock:
+			self._written[index] += byte_count
+
+	def store(self):
+		'''Write the sidecar to disk, replacing the old one atomically.'''
+
+		with self._lock:
+			data = {
+				'filesize': self._filesize,
+				'ranges':   self._ranges,
+				'written':  self._written
+			}
+
+			atomic_write(self._path, json.dumps(data))
+
+	def remove(self):
+		if os.path.isfile(self._path):
+			os.remove(self._path)
@@ -4,13 +4,15 @@
 a session across different runs of the application'''
 
 import os
-import sys
 import time
+import codecs
 import pprint
-import pickle
 import logging
 import threading
 
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait, FIRST_EXCEPTION
+
 import requests
 import requests.utils
 from requests.exceptions import ChunkedEncodingError
@@ -20,9 +22,46 @@ from requests.exceptions import ReadTimeout
 # parent class to all requests exceptions
 from requests.exceptions import RequestException
 
-from .utils import bytes_to_string
+from .bandwidth import BandwidthGovernor
+from .concurrency import AdaptiveLimiter
+from .cache import ResponseCache
+
+from .vod import SegmentJournal
+from .vod import download_segments
+from .vod import journal_path
+
+from .parse_m3u8 import M3U8Stream
+from .parse_m3u8 import M3U8PlaylistFile
+
+from .segmented import RangeSidecar
+from .segmented import RangeNotSupported
+from .segmented import IncompleteRange
+from .segmented import range_header
+from .segmented import sidecar_path
+from .segmented import parse_content_range
+
+from .writer import WritePolicy
+from .writer import preallocate
+from .writer import write_response
+
+from .checksum import PrefixHasher
+from .checksum import RangeHasher
+from .cookies import CookieStore
+from .connections import configure_session
+from .progress import ProgressAggregator
+from .timing import RequestTimings
+from .timing import URL_DOWNLOAD
+from .timing import URL_SEGMENT
+from .timing import URL_LOGIN
+
+# pages read while they arrive are handed on in pieces of at most this size
+PAGE_CHUNK_SIZE = 8 * 1024  # 8kB
 
-CHUNK_SIZE = 32 * 1024  # 32kB
+# how often the session refresher checks when the cookies expire
+REFRESH_CHECK_EVERY = 60   # seconds
+
+# how often each segment of a segmented download records its progress
+SIDECAR_STORE_EVERY = 4 * 1024 * 1024   # 4MB
 
 
 log = logging.getLogger(__name__)
@@ -32,6 +71,40 @@ class LoggedOut(RuntimeError):
 	pass
 
 
+class InvalidSegment(RequestException):
+	pass
+
+
+class PageResponse:
+	'''The result of a single page request: the status code, the final URL 
+	after all redirects, the page text and the response headers.'''
+
+	def __init__(self, status_code, url, text, headers=None, from_cache=False):
+		self.status_code = status_code
+		self.url = url
+		self.text = text
+		self.headers = headers if headers is not None else {}
+		self.from_cache = from_cache
+
+	def __repr__(self):
+		return f'<PageResponse({self.status_code}, "{self.url}")>'
+
+	@classmethod
+	def from_cache_entry(cls, entry):
+		'''A page from the response cache, just like a page from the server'''
+		return cls(entry.status_code, entry.final_url, entry.text, from_cache=True)
+
+
+def _parsed(page, parser):
+	'''Give the parser the whole page at once, if there is one'''
+
+	if parser is not None:
+		parser.start(page.url)
+		parser.feed(page.text)
+		parser.close()
+	return page
+
+
 class HelixSession:
 	'''Provides all necessary infrastructure to contact HelixStudio
 	and hides the session management stuff from the Downloader'''
@@ -39,18 +112,55 @@ class HelixSession:
 	def __init__(self, settings, start_session=True):
 		self._session = requests.Session()
 		self._settings = settings
-		self._last_page_downloaded = None
-		self._last_url = None
 
-		self._downloaded = None
-		self._last_downloaded = None
-		self._progress_printing_disabled = False
-		self._filesize = None
+		# the connection pools are sized for concurrent downloads, and are 
+		# kept for the whole run, also across logins
+		self._adapter = configure_session(self._session, self._settings.get('connection_pool'))
+
+		# the results of the last request are kept per thread, so the session 
+		# can be shared by several download workers
+		self._local = threading.local()
+
 		self._closing = threading.Event()
 
-		self._prog = threading.Thread(target=self._progress_printer)
-		self._prog.daemon = True
-		self._prog.start()
+		# only one thread logs in at a time. Each login bumps the generation, 
+		# so threads that saw a 4xx from before that login don't log in again,
+		# and new requests wait while a login is running. If that login 
+		# failed, the threads waiting for it fail too.
+		self._login_lock = threading.Lock()
+		self._login_generation = 0
+		self._login_failed = False
+		self._login_done = threading.Event()
+		self._login_done.set()
+		self._refresher = None
+
+		# one bandwidth limit shared by every transfer in the session
+		self._bandwidth = BandwidthGovernor.from_settings(self._settings.get('bandwidth'))
+
+		# the number of page requests in flight adapts to how the site copes
+		self._page_limiter = AdaptiveLimiter.from_settings(self._settings.get('page_concurrency'))
+
+		# read sizes and fsync policy of the download write path
+		self._write_policy = WritePolicy.from_settings(self._settings.get('write'))
+
+		# only the cookies of the session are kept between runs
+		self._cookie_store = None
+
+		# downloads are hashed as they arrive, unless the setting is empty
+		self._checksum_algorithm = self._settings.get('checksum', default='sha256')
+
+		# optional on-disk cache of pages, kept next to the session file
+		self._cache = None
+		if self._settings.get('response_cache', 'enabled'):
+			self._cache = ResponseCache.from_settings(self._settings.get('response_cache'),
+				os.path.join(os.path.dirname(self.session_file), 'cache'))
+
+		# every transfer publishes its progress here, it's reported in the background
+		self._progress = ProgressAggregator.from_settings(self._settings.get('progress'))
+		self._progress.start()
+
+		# every request is timed, by URL class, for tuning timeouts and concurrency
+		self._timings = RequestTimings.from_settings(self._settings.get('timings'))
 
 		if start_session:
 			self.start_session()
@@ -68,29 +178,64 @@ class HelixSession:
 		'''Get the path to the session file.'''
 		return self._get_path_from_settings('session')
 
+	@property
+	def cookie_store(self):
+		'''The cookies of the session stored on disk'''
+
+		if self._cookie_store is None:
+			self._cookie_store = CookieStore(self.session_file)
+		return self._cookie_store
+
+	@property
+	def connection_stats(self):
+		'''The number of new connections opened, and of requests that reused one'''
+		return self._adapter.connection_stats
+
+	@property
+	def timings(self):
+		'''The timings of all requests made by the session'''
+		return self._timings
+
+	@property
+	def progress(self):
+		'''The progress of all transfers in this session'''
+		return self._progress
+
+	@property
+	def bandwidth(self):
+		'''The bandwidth governor shared by all transfers in this session'''
+		return self._bandwidth
+
+	@property
+	def page_concurrency(self):
+		'''The number of page requests currently allowed to run at once'''
+		return self._page_limiter.limit
+
+	@property
+	def response_cache(self):
+		'''The on-disk page cache, None if it isn't enabled'''
+		return self._cache
+
 	@property
 	def cookies(self):
 		return requests.utils.dict_from_cookiejar(self._session.cookies)
 
 	def _store_session(self):
-		'''Pickle the session to disk.'''
+		'''Store the session cookies to disk, the login was just confirmed.'''
 
-		with open(self.session_file, 'wb') as f:
-			pickle.dump(self._session, f)
-		
+		self.cookie_store.store(self._session.cookies)
 		log.info('Successfully stored session to disk')
 
 	def _load_session(self):
-		'''Load session from disk'''
+		'''Load the session cookies from disk'''
 
-		if not os.path.exists(self.session_file):
-			log.error('No session to restore')
+		jar = self.cookie_store.load()
+		if jar is None:
 			return False
 
-		with open(self.session_file, 'rb') as f:
-			self._session = pickle.load(f)
-			log.info('Successfully restored session from disk')
-			return True
+		self._session.cookies.update(jar)
+		log.info('Successfully restored session from disk')
+		return True
 
 	@property
 	def auth(self):
@@ -110,17 +255,31 @@ class HelixSession:
 			log.debug('User is logged in')
 			return True
 		else:
-			log.warning(f'User is not logged in, status code: {resp.status_code}')
+			log.warning(f'User is not logged in, status code: {status_code}')
 
 	@property
 	def last_page_content(self):
 		'''The content of the last downloaded page.'''
-		return self._last_page_downloaded
+		return getattr(self._local, 'last_page_downloaded', None)
 
 	@property
 	def last_url(self):
 		'''The final URL of the last request after all redirects.'''
-		return self._last_url
+		return getattr(self._local, 'last_url', None)
+
+	@property
+	def last_checksum(self):
+		'''The checksum of the last file downloaded by this thread, e.g.
+		{"sha256": "...", "size": 123}. None if the last download didn't
+		finish, or checksums are disabled.'''
+		return getattr(self._local, 'last_checksum', None)
+
+	def _hasher(self):
+		'''A new hasher for a download, None if checksums are disabled'''
+
+		if not self._checksum_algorithm:
+			return None
+		return PrefixHasher(self._checksum_algorithm)
 
 	def _log_headers(self, headers, level=logging.DEBUG):
 		'''Dump the response headers to the log.'''
@@ -145,69 +304,240 @@ class HelixSession:
 		members_url = self._settings['links']['members']
 
 		log.info(f'Attempting login for user "{username}"')
-		
-		# reset the current session
-		self._session = requests.Session()
+
+		# the session keeps its cookies, downloads may be using them while 
+		# it logs in. The cookies of a successful login replace them, the 
+		# old ones are put back if it fails.
+		old_cookies = self._session.cookies.copy()
 
 		# login
-		resp = self._session.get(members_url, auth=self.auth,
-								 timeout=self._settings.get('timeout', default=10))
+		try:
+			resp, _ = self._timed_get(members_url, URL_LOGIN)
+		except RequestException:
+			self._session.cookies.update(old_cookies)
+			raise
 
 		if resp.status_code == 200:
 			log.info('Successful login!')
+			self._session.cookies.clear_expired_cookies()
 			self._store_session()
 			self._log_headers(resp.headers)
 		else:
 			log.error(u'Unsuccessful login, HTTP code {} was returned.'.format(resp.status_code))
 			self._log_headers(resp.headers, level=logging.ERROR)
+			self._session.cookies.update(old_cookies)
 			raise RuntimeError('login failed')
 
+	def _relogin(self, generation, reason):
+		'''Log in again, unless another thread already has since `generation`
+		was read. Only one login runs at a time, and page requests wait for 
+		it to finish. Raises RuntimeError if the login fails, also in the
+		threads that were waiting for it, or the RequestException of a login
+		request that failed in the thread that sent it.'''
+
+		with self._login_lock:
+			if generation != self._login_generation:
+				if self._login_failed:
+					log.debug('Another request just failed to log in again')
+					raise RuntimeError('login failed')
+
+				log.debug('Another request already logged in again')
+				return
+
+			log.info(f'Logging in again, {reason}')
+			self._login_done.clear()
+			self._login_failed = True
+			try:
+				self.login()
+				self._login_failed = False
+			finally:
+				self._login_generation += 1
+				self._login_done.set()
+
 	def start_session(self):
 		'''Begin the session with Helix Studios. Load session from disk, and test
-		the whether it's still logged in. If not, log in again.'''
+		the whether it's still logged in. If not, log in again. A session 
+		confirmed within the last "session_ttl" seconds is trusted without 
+		testing it, if it has expired after all the first request that gets 
+		a 4xx logs in again.'''
 
-		if self._load_session():
-			# there was a cookie file loaded, test the members landing page
-			if self.user_logged_in:
-				return
-		
-		self.login()
+		if not self._restore_session():
+			self.login()
+
+		self._start_refresher()
+
+	def _restore_session(self):
+		'''Return True if the session stored on disk can be used'''
+
+		if not self._load_session():
+			return False
+
+		if self.cookie_store.fresh(self._settings.get('session_ttl', default=0)):
+			log.info('Restored session is fresh, skipping the login check')
+			return True
+
+		# there was a cookie file loaded, test the members landing page
+		if self.user_logged_in:
+			self._store_session()
+			return True
+
+		return False
+
+	def _session_expiry(self):
+		'''When the first of the session cookies expires, None if they don't'''
+
+		expiries = [c.expires for c in list(self._session.cookies) if c.expires]
+		return min(expiries) if expiries else None
+
+	def _start_refresher(self):
+		'''Renew the session in the background before its cookies expire, 
+		setting "session_refresh_margin" to 0 turns this off.'''
+
+		margin = self._settings.get('session_refresh_margin', default=300)
+		if not margin or self._refresher is not None:
+			return
 
-	def _cleanup(self):
-		'''Cleanup the session between requests'''
+		self._refresher = threading.Thread(target=self._session_refresher, args=(margin,))
+		self._refresher.daemon = True
+		self._refresher.start()
 
-		if 'Range' in self._session.headers:
-			del(self._session.headers['Range'])
+	def _session_refresher(self, margin):
+		'''Log in again once the session cookies expire within `margin` seconds'''
 
-		self._last_page_downloaded = None
+		refreshed_expiry = None
 
-	def set_start_byte_offset(self, byte_offset):
-		'''Set the "Range" header to begin the download at the given byte offset'''
-		self._session.headers.update({'Range': f'bytes={byte_offset}-'})
+		while not self._closing.wait(REFRESH_CHECK_EVERY):
+			expiry = self._session_expiry()
+
+			# after a refresh the cookies may still expire just as soon, don't
+			# log in over and over again until they change
+			if expiry is None or expiry == refreshed_expiry or expiry - margin > time.time():
+				continue
+
+			try:
+				self._relogin(self._login_generation, 'the session cookies are about to expire')
+			except (RuntimeError, RequestException) as e:
+				log.error(f'Session refresh failed, the next request that needs it will log in again ({e})')
+
+			refreshed_expiry = self._session_expiry()
+
+	def close(self):
+		'''Stop the background threads of the session'''
+		self._closing.set()
+		self._progress.close()
+		self._timings.close()
+
+	def _timed_get(self, url, url_class=None, attempt=0, stream=False, headers=None):
+		'''GET a URL with the session's auth and timeout, and time it. Returns 
+		the response and its RequestTiming. The timing of a streamed response 
+		is finished by whoever reads the body.'''
+
+		timing = self._timings.start(url, url_class, attempt)
+		try:
+			resp = self._session.get(url, stream=stream, auth=self.auth, headers=headers,
+									 timeout=self._settings.get('timeout', default=10))
+		except RequestException as e:
+			timing.failed(e)
+			raise
+
+		timing.response(resp)
+		if not stream:
+			timing.finish(len(resp.content))
+
+		return resp, timing
 
 	def get(self, url, retries=10):
-		'''Takes a URL and returns a tuple of (code, response).'''
+		'''Takes a URL and returns a tuple of (code, response). The final URL 
+		and the page are kept for `last_url` and `last_page_content`, for 
+		this thread only.'''
+
+		self._local.last_page_downloaded = None
+
+		page = self.fetch(url, retries=retries)
+
+		self._local.last_page_downloaded = page.text
+		self._local.last_url = page.url
+		return page.status_code, page.text
+
+	def fetch(self, url, retries=10, byte_range=None, parser=None):
+		'''Request a page and return a PageResponse. Nothing about the request
+		is kept on the session, so any number of threads can fetch at once.
+		`byte_range` is an optional (start, end) tuple, end may be None to 
+		request the rest of the page. Ranged requests bypass the page cache.
+
+		`parser` is an optional incremental parser, like an HTMLParser, that 
+		reads the page while it arrives: `parser.start(final_url)` is called
+		once the response headers are in, then `parser.feed(text)` with each
+		piece of the page, and `parser.close()` at the end. It's started
+		again if the request is retried. Only a 2xx page is parsed, the
+		parser never sees an error page.'''
+
+		cached = None
+		if self._cache is not None and byte_range is None:
+			cached = self._cache.lookup(url)
+
+		if cached is not None and cached.fresh:
+			page = self._cached_page(cached)
+			if page is not None:
+				log.debug(f'Using cached page for: {url}')
+				return _parsed(page, parser)
+			cached = None
 
 		for i in range(retries):
 			try:
-				self._cleanup() 
-				resp = self._session.get(url, stream=False, auth=self.auth,
-										 timeout=self._settings.get('timeout', default=10))
+				# ask the server if the cached page is still valid
+				request_headers = cached.validators() if cached is not None else {}
+				if byte_range is not None:
+					request_headers.update(range_header(*byte_range))
+
+				# wait for any login in progress, and remember which login this 
+				# request was sent after
+				self._login_done.wait()
+				generation = self._login_generation
+
+				# the limiter only counts the request itself, the slot is free 
+				# again while this thread sleeps before a retry
+				with self._page_limiter.request() as request:
+					resp, timing = self._timed_get(url, attempt=i, headers=request_headers,
+												   stream=parser is not None)
+
+					if resp.status_code >= 500:
+						request.failed()
+
+					text = None
+					if parser is not None:
+						# only a page that's really there is parsed, not one to log in 
+						# for, to take from the cache, or with an error on it
+						page = 200 <= resp.status_code <= 299
+						text = self._read_page(resp, timing, parser if page else None)
+
+				if resp.status_code == 304 and cached is not None:
+					page = self._cached_page(cached)
+					if page is None:
+						# ask for the whole page instead
+						cached = None
+						continue
+
+					log.debug(f'Cached page is still valid for: {url}')
+					self._cache.revalidated(cached)
+					return _parsed(page, parser)
 
-				self._last_page_downloaded = resp.text
-				self._last_url = resp.url
-				
 				if 400 <= resp.status_code <= 499:
 					raise LoggedOut()
+
+				text = resp.text if text is None else text
+				if resp.status_code == 200 and self._cache is not None and byte_range is None:
+					self._cache.store(url, resp, text)
 				
-				return resp.status_code, self._last_page_downloaded	
+				return PageResponse(resp.status_code, resp.url, text, resp.headers)
 
 			except LoggedOut:
 				log.error(f'HTTP Code {resp.status_code} while requesting: {url}, re-attempting login')
 
 				try:
-					self.login()
-				except RuntimeError:
+					self._relogin(generation, f'HTTP code {resp.status_code}')
+				except (RuntimeError, RequestException):
+					# the login request itself may fail, e.g. time out
 					log.error('Login failed!')
 					log.error('Retrying page request again, and we\'ll reattempt login next time around!')
 
@@ -223,111 +553,136 @@ class HelixSession:
 			log.error(f'All GET request attempts have failed for url: {url}')
 			raise RuntimeError('all GET request attempts failed')
 
-	def head(self, url, retries=10):
-		'''Perform a HTTP HEAD request and return the status code, final url, and headers'''
-
-		for i in range(retries):
-			try:
-				self._cleanup() 
-				resp = self._session.head(url, allow_redirects=True, auth=self.auth,
-										  timeout=self._settings.get('timeout', default=10))
-				
-				return resp.status_code, resp.url, resp.headers
-
-			except RequestException as e:
-				sleep_time = min([2 ** i, 60])    # double sleep time with each failed request, max 60 secs.
-
-				log.error(f'{e.__class__.__name__} while requesting HEAD: {url}')
-				log.error(f' ---> {str(e)}')
-				log.error(f'Sleeping for {sleep_time} seconds for connection to recover...')
-				time.sleep(sleep_time)
-
-		else:
-			log.error(f'All HEAD request attempts have failed for url: {url}')
-			raise RuntimeError('all HEAD request attempts failed')
-
-	def _print_progress(self, progress, speed=''):
-		'''Print a progress message to the terminal'''
+	def _cached_page(self, entry):
+		'''The page of a cache entry, None if it was evicted since it was looked up'''
 
-		sys.stderr.write(f'   {progress:.1f}%  {speed}                    \r')
-		sys.stderr.flush()
+		try:
+			return PageResponse.from_cache_entry(entry)
+		except FileNotFoundError:
+			log.debug(f'Cached page was evicted, requesting it again: {entry.url}')
+			return None
 
-	def _progress_printer(self):
-		'''Periodically print the '''
+	def _read_page(self, resp, timing, parser=None):
+		'''Read the body of a streamed page, feeding the parser each piece 
+		of text as soon as it has arrived. Returns the whole text.'''
 
-		PRINT_PROGRESS_EVERY = 3   # seconds
+		try:
+			decoder = codecs.getincrementaldecoder(resp.encoding or 'utf-8')(errors='replace')
+		except LookupError:
+			decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
 
-		while True:
-			if self._closing.is_set():
-				break
+		if parser is not None:
+			parser.start(resp.url)
 
-			if self._progress_printing_disabled:
-				pass
+		pieces = []
+		try:
+			for chunk in resp.iter_content(PAGE_CHUNK_SIZE):
+				timing.add(len(chunk))
+				pieces.append(decoder.decode(chunk))
+				if parser is not None:
+					parser.feed(pieces[-1])
 
-			elif self._downloaded is not None:
-				if self._last_downloaded is not None:
-					# calculate the download speed
-					bytes_downloaded = self._downloaded - self._last_downloaded
-					speed_b_per_s = bytes_downloaded / PRINT_PROGRESS_EVERY
-					speed = f'[{bytes_to_string(speed_b_per_s)}/s]'
-				else:
-					speed = ''
+		except RequestException as e:
+			timing.failed(e)
+			raise
 
-				# important to record this variable before the print, so we don't 
-				# give up the GIL and introduce a timing bug
-				self._last_downloaded = self._downloaded
+		finally:
+			resp.close()
 
-				progress = (100.0 * self._downloaded) / self._filesize
-				self._print_progress(progress, speed=speed)
+		timing.finish()
+		pieces.append(decoder.decode(b'', final=True))
+		if parser is not None:
+			parser.feed(pieces[-1])
+			parser.close()
 
-			self._closing.wait(PRINT_PROGRESS_EVERY)
+		return ''.join(pieces)
 
 	def download(self, url, destination_path, download_in_place=False, retries=20):
 		'''Download a large file in chunks and write it to disk at the given destination.
 		Resume partially downloaded files where possible. Return True if the download was
-		successful, False if the file wasn't downloaded because it was already complete.'''
+		successful, False if the file wasn't downloaded because it was already complete.
+
+		There's no HEAD request first: the download starts with a ranged GET
+		from the first byte still needed, and the file size comes from its 
+		"Content-Range" header, or the "Content-Length" of a server that sends
+		the whole file. The URL the link redirects to is remembered, so a 
+		retry goes straight there.'''
+
+		self._local.last_checksum = None
+		resolved_url = url
+
+		if not download_in_place:
+			dest = destination_path + '.part'
+		else:
+			dest = destination_path
 
 		for i in range(retries):
+			resp = None
+			timing = None
 			try:
-				self._cleanup()   # remove any wayward request headers
-
-				if not download_in_place:
-					dest = destination_path + '.part'
+				hasher = self._hasher()
+
+				# work out the first byte that's still needed from the server. A 
+				# resumed segmented download asks for exactly its first pending range.
+				sidecar = RangeSidecar.load(sidecar_path(dest))
+				if sidecar is not None and sidecar.bytes_written > 0 and not self._preallocated(dest, sidecar.filesize):
+					log.warning('The partial file doesn\'t match its sidecar, starting the download again')
+					self._remove_segmented_download(dest, sidecar.filesize)
+					sidecar = None
+
+				last_byte = None
+				if sidecar is not None and sidecar.complete:
+					# the last run stopped before moving the file into place
+					log.info(f'File download was already complete')
+					if hasher is not None:
+						hasher.hash_file(dest, sidecar.filesize)
+					sidecar.remove()
+					return self._finish_download(dest, destination_path, download_in_place, hasher)
+				elif sidecar is not None:
+					_, first_byte, last_byte = sidecar.pending()[0]
+				elif os.path.isfile(dest):
+					first_byte = os.path.getsize(dest)
 				else:
-					dest = destination_path
+					first_byte = 0
+
+				# wait for any login in progress, like page requests do
+				self._login_done.wait()
+				generation = self._login_generation
 
-				# perform a head request on the link to find out how big it is
-				status_code, final_url, headers = self.head(url)
+				resp, timing = self._timed_get(resolved_url, URL_DOWNLOAD, i, stream=True,
+											   headers=range_header(first_byte, last_byte))
 
-				if status_code == 404:
+				if resp.status_code == 404:
 					log.error(f'Received 404 for URL: {url}')
 					log.error('  -> this video file will be skipped!')
 					return
 
-				self._filesize = int(headers.get('Content-Length'))
-				
-				if self._filesize == 0:
-					log.error(f'Filesize is zero for URL {url}')
-					log.error('  -> this video file will be skipped!')
-					return
+				elif resp.status_code == 416:
+					# the partial file doesn't fit the file on the server
+					content_range = parse_content_range(resp.headers.get('Content-Range'))
+					total = content_range[2] if content_range is not None else None
 
-				# check for the destination file on disk
-				if os.path.isfile(dest):
-					size_on_disk = os.path.getsize(dest)
+					if sidecar is not None:
+						log.warning('The file changed on the server, starting the download again')
+						self._remove_segmented_download(dest, sidecar.filesize)
+						continue
 
-					if self._filesize > size_on_disk:
-						log.info(f'Resuming download from byte {size_on_disk}, {self._filesize - size_on_disk} bytes left')
-						self.set_start_byte_offset(size_on_disk)
-					else:
+					elif first_byte > 0 and total == first_byte:
+						# the last run stopped before moving the file into place. A 
+						# preallocated file always has a sidecar, this one was written
+						# from the start to the end.
 						log.info(f'File download was already complete')
-						return False
-				else:
-					log.info(f'Starting fresh file download...')
-					
-				resp = self._session.get(url, stream=True, auth=self.auth,
-										 timeout=self._settings.get('timeout', default=10))
-				
-				if resp.status_code == 416:
+						if hasher is not None:
+							hasher.hash_file(dest, first_byte)
+						return self._finish_download(dest, destination_path, download_in_place, hasher)
+
+					elif first_byte > 0:
+						log.warning(f'The partial file has {first_byte} bytes, the file on the server '
+									f'{total if total is not None else "an unknown number of"} bytes, '
+									f'starting the download again')
+						os.truncate(dest, 0)
+						continue
+
 					log.error(u'HTTP Error 416 - "Range" request was not valid')
 					log.error(u'This file cannot be downloaded')
 					return
@@ -335,60 +690,429 @@ class HelixSession:
 				elif 400 <= resp.status_code <= 499:
 					raise LoggedOut()
 
-				with open(dest, 'ab') as f:
-					for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
-						if len(chunk) > 0:     # filter out keep-alive chunks
-							f.write(chunk)
-						self._downloaded = f.tell()
+				elif resp.status_code not in (200, 206):
+					raise IncompleteRange(f'HTTP code {resp.status_code} while requesting bytes {first_byte}-')
 
-				# reset both so progress isn't printed until the next file
-				self._downloaded = None
-				self._last_downloaded = None
-				
-				if not download_in_place:
-					# move the file into place
-					if os.path.isfile(destination_path):
-						log.warning('Destination file already exists, deleting now...')
-						os.remove(destination_path)
+				resolved_url = resp.url
+				filesize = self._response_filesize(resp)
+
+				if not filesize:
+					log.error(f'Filesize is {"zero" if filesize == 0 else "unknown"} for URL {url}')
+					log.error('  -> this video file will be skipped!')
+					return
+
+				if sidecar is not None and sidecar.filesize != filesize:
+					log.warning('The file changed size on the server, starting the download again')
+					self._remove_segmented_download(dest, sidecar.filesize)
+					continue
+
+				# a range that doesn't start where it was asked to can't be written in place
+				content_range = parse_content_range(resp.headers.get('Content-Range'))
+				if resp.status_code == 206 and content_range[0] != first_byte:
+					log.warning(f'Asked for the bytes from {first_byte}, the server sent '
+								f'"{resp.headers.get("Content-Range")}", starting the download again')
+					if sidecar is not None:
+						self._remove_segmented_download(dest, sidecar.filesize)
+					elif first_byte > 0:
+						os.truncate(dest, 0)
+					continue
+
+				if sidecar is not None and resp.status_code == 200:
+					log.warning('Server ignored the "Range" header, falling back to a single connection')
+					self._remove_segmented_download(dest, sidecar.filesize)
+					sidecar = None
+					first_byte = 0
+
+				# a preallocated, range based download is used for fresh downloads, or
+				# to resume a previous range based download of the same file
+				if resp.status_code == 206 and (sidecar is not None or first_byte == 0):
+					try:
+						self._download_segmented(resp, timing, dest, filesize, sidecar, hasher)
+					except RangeNotSupported:
+						log.warning('Server ignored the "Range" header, falling back to a single connection')
+						self._remove_segmented_download(dest, filesize)
+						continue
+					else:
+						return self._finish_download(dest, destination_path, download_in_place, hasher)
+
+				# the whole file was sent, appending it would corrupt the download
+				if first_byte > 0 and resp.status_code == 200:
+					log.warning('Server ignored the "Range" header, restarting the download')
+					os.truncate(dest, 0)
+					first_byte = 0
+
+				if first_byte > 0:
+					log.info(f'Resuming download from byte {first_byte}, {filesize - first_byte} bytes left')
+				else:
+					log.info(f'Starting fresh file download...')
+
+				# only the part already on disk is read back to be hashed
+				if hasher is not None:
+					hasher.hash_file(dest, first_byte)
 
-					log.debug('Moving downloaded file into place now...')
-					os.rename(dest, destination_path)
+				def written(byte_count):
+					timing.add(byte_count)
+					progress.add(byte_count)
+					transfer.consume(byte_count)
 
-				log.info(f'Download complete!')
+				name = os.path.basename(destination_path)
+				with open(dest, 'ab', buffering=0) as f, self._bandwidth.transfer(name) as transfer, \
+						self._progress.transfer(name, filesize, first_byte) as progress:
+					write_response(resp, f, self._write_policy, start=first_byte, on_chunk=written, hasher=hasher)
+				timing.finish()
 
-				return True
+				if os.path.getsize(dest) < filesize:
+					raise IncompleteRange(f'only {os.path.getsize(dest)} of {filesize} bytes were received')
+
+				return self._finish_download(dest, destination_path, download_in_place, hasher)
 
 			except LoggedOut:
-				log.error(u'HTTP Code 400-499 encountered...')
+				log.error(u'HTTP Code 400-499 encountered, re-attempting login')
+
+				# the link may redirect somewhere else by now
+				resolved_url = url
+
+				try:
+					self._relogin(generation, 'HTTP code 400-499 while downloading')
+				except (RuntimeError, RequestException):
+					sleep_time = min([2 ** i, 60])
+					log.error(f'Login failed! Sleeping for {sleep_time} seconds before the download is retried')
+					time.sleep(sleep_time)
 
 			except RequestException as e:
 				sleep_time = min([2 ** i, 60])    # double sleep time with each failed request, max 60 secs.
 
+				resolved_url = url
+				if timing is not None:
+					timing.failed(e)
+
 				log.error(f'{e.__class__.__name__} while downloading: {url}')
 				log.error(f' ---> {str(e)}')
 				log.error(f'Sleeping for {sleep_time} seconds for connection to recover...')
 				time.sleep(sleep_time)
 
+			finally:
+				if resp is not None:
+					resp.close()
+
+				# a response whose body wasn't read, e.g. a 404
+				if timing is not None:
+					timing.finish()
+
+	def _response_filesize(self, resp):
+		'''The size of the whole file, from the "Content-Range" of a partial 
+		response or the "Content-Length" of a complete one. None if unknown.'''
+
+		if resp.status_code == 206:
+			content_range = parse_content_range(resp.headers.get('Content-Range'))
+			return content_range[2] if content_range is not None else None
+
+		content_length = resp.headers.get('Content-Length')
+		return int(content_length) if content_length is not None else None
+
+	def _finish_download(self, dest, destination_path, download_in_place, hasher=None):
+		'''Move a completed download into its final place, and keep its checksum.'''
+
+		if hasher is not None:
+			self._local.last_checksum = hasher.checksum()
+
+		if not download_in_place:
+			# move the file into place
+			if os.path.isfile(destination_path):
+				log.warning('Destination file already exists, deleting now...')
+				os.remove(destination_path)
+
+			log.debug('Moving downloaded file into place now...')
+			os.rename(dest, destination_path)
+
+		log.info(f'Download complete!')
+
+		return True
+
+	def _preallocated(self, dest, filesize):
+		'''True if the partial file of a segmented download is at its full size'''
+		return os.path.isfile(dest) and os.path.getsize(dest) == filesize
+
+	def _remove_segmented_download(self, dest, filesize):
+		'''Delete the partial file and the sidecar of a segmented download'''
+
+		if os.path.isfile(dest):
+			os.remove(dest)
+
+		sidecar = RangeSidecar.load(sidecar_path(dest), filesize)
+		if sidecar is not None:
+			sidecar.remove()
+
+	def _download_segmented(self, resp, timing, dest, filesize, sidecar=None, hasher=None):
+		'''Download the file in byte ranges over several connections at once, 
+		writing each range into its place in a preallocated file. The sidecar
+		records the progress of each range, so a later call can resume exactly.
+		`resp` is the open ended ranged response from the first byte that's 
+		still needed, with its timing. It's used for the first range, the 
+		other ranges are requested from its final URL.
+
+		The hasher needs the file in order, see RangeHasher: each range is 
+		hashed as it arrives once all the ranges before it are complete, only
+		what it wrote before that is read back from disk.'''
+
+		if sidecar is None:
+			log.info(f'Starting fresh segmented file download...')
+
+			# the sidecar goes on disk before the file, so a preallocated file
+			# is never left behind without a record of what's been written
+			sidecar = RangeSidecar.create(sidecar_path(dest), filesize,
+				self._settings.get('download_segments', default=1))
+
+		else:
+			log.info(f'Resuming segmented download, {filesize - sidecar.bytes_written} bytes left')
+
+		# preallocate the whole file, so every range can be written in place.
+		# The last run may have stopped before it got that far.
+		if not self._preallocated(dest, filesize):
+			preallocate(dest, filesize)
+
+		pending = sidecar.pending()
+		log.debug(f'Downloading {len(pending)} byte ranges in parallel')
+
+		# everything before the first unfinished range is already on disk
+		range_hasher = None
+		if hasher is not None:
+			range_hasher = RangeHasher(hasher, dest, sidecar.ranges_written())
+
+		abort = threading.Event()
+		name = os.path.basename(dest)
+
+		# all the ranges share one transfer, so a per-transfer limit covers the whole file
+		with self._bandwidth.transfer(name) as transfer, \
+				self._progress.transfer(name, filesize, sidecar.bytes_written) as progress, \
+				ThreadPoolExecutor(max_workers=len(pending)) as pool:
+			futures = [pool.submit(self._download_range, resp.url, dest, sidecar, index, start, end, abort,
+								   transfer, progress, range_hasher.part(index) if range_hasher is not None else None,
+								   resp if n == 0 else None, timing if n == 0 else None)
+					   for n, (index, start, end) in enumerate(pending)]
+
+			done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+
+			# stop the other ranges as soon as one of them fails
+			if any(f.exception() is not None for f in done):
+				abort.set()
+
+		sidecar.store()
+		for f in futures:
+			if f.exception() is not None:
+				raise f.exception()
+
+		if not sidecar.complete:
+			raise IncompleteRange(f'only {sidecar.bytes_written} of {filesize} bytes were received')
+
+		sidecar.remove()
+
+	def _download_range(self, url, dest, sidecar, index, start, end, abort, transfer, progress, hasher=None,
+						resp=None, timing=None):
+		'''Download one byte range of the file, and write it in place. The 
+		response may already be open, with its timing, if it was the first 
+		request made.'''
+
+		if resp is None:
+			self._login_done.wait()
+			resp, timing = self._timed_get(url, URL_DOWNLOAD, stream=True, headers=range_header(start, end))
+
+		try:
+			self._write_range(resp, dest, sidecar, index, start, end, abort, transfer, progress, hasher, timing)
+		except RequestException as e:
+			timing.failed(e)
+			raise
+		finally:
+			timing.finish()
+
+	def _write_range(self, resp, dest, sidecar, index, start, end, abort, transfer, progress, hasher, timing):
+		'''Write the body of a ranged response in place'''
+
+		if resp.status_code == 200:
+			resp.close()
+			raise RangeNotSupported()
+
+		elif 400 <= resp.status_code <= 499:
+			resp.close()
+			raise LoggedOut()
+
+		elif resp.status_code != 206:
+			resp.close()
+			raise IncompleteRange(f'HTTP code {resp.status_code} while requesting bytes {start}-{end}')
+
+		content_range = parse_content_range(resp.headers.get('Content-Range'))
+		if content_range is None or content_range[0] != start:
+			resp.close()
+			raise IncompleteRange(f'asked for bytes {start}-{end}, got "{resp.headers.get("Content-Range")}"')
+
+		unstored = 0
+
+		def written(byte_count):
+			nonlocal unstored
+
+			sidecar.record(index, byte_count)
+			timing.add(byte_count)
+			progress.add(byte_count)
+			transfer.consume(byte_count)
+
+			unstored += byte_count
+			if unstored >= SIDECAR_STORE_EVERY:
+				sidecar.store()
+				unstored = 0
+
+		# unbuffered, so everything the sidecar records has been handed to the OS
+		with open(dest, 'r+b', buffering=0) as f:
+			write_response(resp, f, self._write_policy, start=start, end=end, abort=abort,
+						   on_chunk=written, hasher=hasher)
+
+		resp.close()
+
 	def _vod_ts_files_for_playlist(self, playlist_url):
-		'''Given a playlist URL, generate the download URLs for all the TS files'''
+		'''Given a playlist URL, generate the download URLs for all the TS files.
+		Raises ValueError if the playlist or stream file can't be used.'''
 
 		status_code, page = self.get(playlist_url)
 		if status_code != 200:
 			raise ValueError('unable to download playlist file')
 
-		
+		stream = M3U8PlaylistFile(page, self.last_url).highest_bandwidth_stream
+		if stream is None:
+			raise ValueError('no streams in the playlist file')
+		log.debug(f'Highest bandwidth stream: {stream}')
+
+		status_code, page = self.get(stream['url'])
+		if status_code != 200:
+			raise ValueError('unable to download stream file')
+
+		return M3U8Stream(page, self.last_url).all_chunks()
+
+	def _get_segment(self, url, transfer, progress, retries=10):
+		'''Download a single TS segment of a streaming video, and return its 
+		bytes. Each segment is retried on its own.'''
+
+		for i in range(retries):
+			timing = None
+			try:
+				self._login_done.wait()
+				generation = self._login_generation
+
+				resp, timing = self._timed_get(url, URL_SEGMENT, i, stream=True)
+
+				if 400 <= resp.status_code <= 499:
+					resp.close()
+					timing.finish()
+					raise LoggedOut()
+
+				if resp.status_code != 200:
+					resp.close()
+					raise InvalidSegment(f'HTTP code {resp.status_code} for segment')
+
+				chunks = []
+				for chunk in resp.iter_content(chunk_size=self._write_policy.min_chunk):
+					chunks.append(chunk)
+					timing.add(len(chunk))
+					transfer.consume(len(chunk))
+
+				timing.finish()
+
+				# only complete segments count, a retried segment would be counted twice
+				data = b''.join(chunks)
+				progress.add(len(data))
+				return data
+
+			except LoggedOut:
+				log.error(f'HTTP Code {resp.status_code} while requesting segment: {url}, re-attempting login')
+
+				try:
+					self._relogin(generation, f'HTTP code {resp.status_code} for a segment')
+				except (RuntimeError, RequestException):
+					sleep_time = min([2 ** i, 60])
+					log.error(f'Login failed! Sleeping for {sleep_time} seconds before the segment is retried')
+					time.sleep(sleep_time)
+
+			except RequestException as e:
+				if timing is not None:
+					timing.failed(e)
+				sleep_time = min([2 ** i, 60])    # double sleep time with each failed request, max 60 secs.
+
+				log.error(f'{e.__class__.__name__} while requesting segment: {url}')
+				log.error(f' ---> {str(e)}')
+				log.error(f'Sleeping for {sleep_time} seconds for connection to recover...')
+				time.sleep(sleep_time)
+
+		else:
+			log.error(f'All segment request attempts have failed for url: {url}')
+			raise RuntimeError('all segment request attempts failed')
 
 	def download_vod(self, url, destination_path, download_in_place=False, retries=20):
 		'''Given a URL to a streaming video M3U8 file, download all the TS files 
-		for the highest resolution version of the video.'''
+		for the highest resolution version of the video, and join them into one 
+		file at the destination. Return True if the download was successful.'''
+
+		if not download_in_place:
+			dest = destination_path + '.part'
+		else:
+			dest = destination_path
 
-		# during VOD downloads, disable the progress dialog because it's too
-		# complicated to manage the dance with the download function
-		self._progress_printing_disabled = False
+		self._local.last_checksum = None
 
-		# streaming videos will never be resumed, delete anything that exists there
-		if os.path.isfile(destination_path):
-			os.remote(destination_path)
+		try:
+			segment_urls = self._vod_ts_files_for_playlist(url)
+		except (ValueError, RuntimeError) as e:
+			log.error(f'Unable to read the stream for URL: {url}')
+			log.error(f' ---> {str(e)}')
+			return False
 
+		if not segment_urls:
+			log.error(f'No segments found in the stream for URL: {url}')
+			return False
 
+		# resume from the first segment missing in the journal. Without a 
+		# journal, there's no way to know what's in the file, so start again.
+		journal = SegmentJournal.load(journal_path(dest), segment_urls)
+		first_index = 0
+		if journal is not None and os.path.isfile(dest):
+			first_index = journal.resume_index(os.path.getsize(dest))
+		else:
+			journal = SegmentJournal.create(journal_path(dest), segment_urls)
+
+		# only the segments already on disk are read back to be hashed
+		hasher = self._hasher()
+		if hasher is not None and first_index > 0:
+			hasher.hash_file(dest, journal.offset(first_index))
+
+		if first_index == len(segment_urls):
+			# the last run stopped before moving the file into place
+			log.info(f'Stream download was already complete')
+			os.truncate(dest, journal.offset(first_index))
+			journal.remove()
+			return self._finish_download(dest, destination_path, download_in_place, hasher)
+
+		elif first_index > 0:
+			log.info(f'Resuming stream download from segment {first_index} of {len(segment_urls)}')
+		else:
+			log.info(f'Starting fresh stream download...')
+
+		workers = self._settings.get('vod_workers', default=8)
+		log.info(f'Downloading {len(segment_urls) - first_index} stream segments with {workers} workers...')
+
+		try:
+			# drop anything after the last complete segment
+			# the size of a stream isn't known until all its segments are downloaded
+			name = os.path.basename(destination_path)
+			with open(dest, 'r+b' if first_index > 0 else 'wb') as f, self._bandwidth.transfer(name) as transfer, \
+					self._progress.transfer(name, None, journal.offset(first_index)) as progress:
+				f.truncate(journal.offset(first_index))
+				f.seek(journal.offset(first_index))
+
+				download_segments(lambda u: self._get_segment(u, transfer, progress, retries=retries), segment_urls, f,
+								  workers=workers, window=self._settings.get('vod_buffer_segments', default=32),
+								  first_index=first_index, journal=journal, hasher=hasher)
+		except RuntimeError:
+			log.error(f'Stream download failed for URL: {url}')
+			return False
+		finally:
+			journal.close()
 
+		journal.remove()
+		return self._finish_download(dest, destination_path, download_in_place, hasher)
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+
+'''Timings of every HTTP request, split into connecting, waiting for the
+first byte and transferring the body, and collected into histograms for
+each class of URL. Used to tune the timeouts and concurrency settings.'''
+
+import os
+import re
+import json
+import time
+import logging
+import threading
+
+from .connections import take_connect_times
+
+
+log = logging.getLogger(__name__)
+
+
+URL_LISTING = 'listing'
+URL_VIDEO_PAGE = 'video_page'
+URL_PLAYLIST = 'playlist'
+URL_DOWNLOAD = 'download'
+URL_SEGMENT = 'segment'
+URL_LOGIN = 'login'
+URL_OTHER = 'other'
+
+URL_CLASSES = (
+	(re.compile(r'/members/videos/?(\?.*)?$'), URL_LISTING),
+	(re.compile(r'/members/videos/[^/?]+/?(\?.*)?$'), URL_VIDEO_PAGE),
+	(re.compile(r'\.m3u8(\?.*)?$'), URL_PLAYLIST),
+	(re.compile(r'\.ts(\?.*)?$'), URL_SEGMENT),
+	(re.compile(r'download-video\.php'), URL_DOWNLOAD),
+)
+
+# upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 60, float('inf'))
+
+
+def classify_url(url):
+	'''The class of a URL for the timing histograms'''
+
+	for pattern, url_class in URL_CLASSES:
+		if pattern.search(url):
+			return url_class
+	return URL_OTHER
+
+
+class Histogram:
+	'''A histogram of durations in fixed buckets, from a few milliseconds to
+	a minute, with the count, total, minimum and maximum.'''
+
+	def __init__(self):
+		self.counts = [0] * len(BUCKETS)
+		self.count = 0
+		self.total = 0.0
+		self.minimum = None
+		self.maximum = None
+
+	def __repr__(self):
+		return f'<Histogram({self.count} values)>'
+
+	def add(self, seconds):
+		for i, bound in enumerate(BUCKETS):
+			if seconds <= bound:
+				self.counts[i] += 1
+				break
+
+		self.count += 1
+		self.total += seconds
+		self.minimum = seconds if self.minimum is None else min(self.minimum, seconds)
+		self.maximum = seconds if self.maximum is None else max(self.maximum, seconds)
+
+	def percentile(self, p):
+		'''The upper bound of the bucket holding the p-th percentile'''
+
+		if not self.count:
+			return None
+
+		rank = p / 100.0 * self.count
+		seen = 0
+		for bound, count in zip(BUCKETS, self.counts):
+			seen += count
+			if seen >= rank:
+				return min(bound, self.maximum)
+		return self.maximum
+
+	def summary(self):
+		if not self.count:
+			return {'count': 0}
+
+		return {
+			'count':  self.count,
+			'mean':   round(self.total / self.count, 4),
+			'min':    round(self.minimum, 4),
+			'max':    round(self.maximum, 4),
+			'p50':    round(self.percentile(50), 4),
+			'p90':    round(self.percentile(90), 4),
+			'p99':    round(self.percentile(99), 4),
+			'buckets': {('inf' if b == float('inf') else str(b)): c for b, c in zip(BUCKETS, self.counts) if c}
+		}
+
+
+class UrlClassTimings:
+	'''All the timings of one class of URLs'''
+
+	PHASES = ('connect', 'tls', 'ttfb', 'transfer', 'total')
+
+	def __init__(self):
+		self.histograms = {phase: Histogram() for phase in self.PHASES}
+		self.statuses = {}
+		self.errors = {}
+		self.bytes = 0
+		self.retries = 0
+
+	def add(self, record):
+		for phase in self.PHASES:
+			if record.get(phase) is not None:
+				self.histograms[phase].add(record[phase])
+
+		status = str(record['status'])
+		self.statuses[status] = self.statuses.get(status, 0) + 1
+		if record.get('error'):
+			self.errors[record['error']] = self.errors.get(record['error'], 0) + 1
+		self.bytes += record.get('bytes') or 0
+		self.retries += 1 if record.get('attempt') else 0
+
+	def summary(self):
+		return {
+			'requests':  sum(self.statuses.values()),
+			'status':    self.statuses,
+			'errors':    self.errors,
+			'bytes':     self.bytes,
+			'retries':   self.retries,
+			**{phase: h.summary() for phase, h in self.histograms.items()}
+		}
+
+
+class RequestTiming:
+	'''Times one request. Start it just before the request is sent, call
+	`response()` once the headers are in, `add()` with each chunk of the 
+	body, and `finish()` once the body has been read, or `failed()` if the
+	request raised.'''
+
+	def __init__(self, timings, url_class, url, attempt=0):
+		self._timings = timings
+		self._url_class = url_class
+		self._url = url
+		self._attempt = attempt
+		self._status = None
+		self._error = None
+		self._ttfb = None
+		self._connect = None
+		self._tls = None
+		self._bytes = 0
+		self._recorded = False
+
+		take_connect_times()   # forget connections opened by earlier requests
+		self._start = time.monotonic()
+		self._headers = None
+
+	def response(self, resp):
+		'''The response headers arrived. Without streaming, requests has 
+		already read the body as well, but its `elapsed` still ends at the 
+		headers.'''
+
+		self._status = resp.status_code
+		self._connect, self._tls = take_connect_times()
+
+		elapsed = getattr(resp, 'elapsed', None)
+		elapsed = elapsed.total_seconds() if elapsed is not None else time.monotonic() - self._start
+		self._headers = self._start + elapsed
+		self._ttfb = max(0.0, elapsed - (self._connect or 0.0) - (self._tls or 0.0))
+
+	def add(self, byte_count):
+		'''A chunk of the body was read'''
+		self._bytes += byte_count
+
+	def finish(self, byte_count=None):
+		'''The body was read, `byte_count` bytes of it if given, otherwise
+		all the chunks added. Only the first finish or failure is recorded.'''
+
+		if self._recorded:
+			return
+		self._recorded = True
+
+		now = time.monotonic()
+		headers = self._headers if self._headers is not None else now
+		self._timings._record({
+			'class':     self._url_class,
+			'url':       self._url,
+			'status':    self._status,
+			'error':     self._error,
+			'attempt':   self._attempt,
+			'connect':   self._connect,
+			'tls':       self._tls,
+			'ttfb':      self._ttfb,
+			'transfer':  now - headers,
+			'total':     now - self._start,
+			'bytes':     byte_count if byte_count is not None else self._bytes
+		})
+
+	def failed(self, error):
+		'''The request raised before it finished'''
+
+		if self._recorded:
+			return
+
+		if self._headers is None:
+			self._connect, self._tls = take_connect_times()
+
+		self._error = error.__class__.__name__
+		self.finish()
+
+
+class RequestTimings:
+	'''Collects the timings of all requests of the session into histograms
+	per URL class. Each request can also be streamed to a JSON lines file
+	as it finishes.'''
+
+	def __init__(self, summary_file=None, stream_file=None):
+		self._summary_file = summary_file
+		self._stream_file = stream_file
+		self._stream = None
+		self._classes = {}
+		self._lock = threading.Lock()
+
+		if stream_file is not None:
+			os.makedirs(os.path.dirname(stream_file), exist_ok=True)
+			self._stream = open(stream_file, 'a', buffering=1)
+
+	def __repr__(self):
+		return f'<RequestTimings({", ".join(self._classes)})>'
+
+	@classmethod
+	def from_settings(cls, settings):
+		'''Build the timings from the "timings" settings'''
+
+		if settings is None:
+			return cls()
+
+		return cls(summary_file=settings.get_path('summary_file') if settings.get('summary_file') else None,
+				   stream_file=settings.get_path('stream_file') if settings.get('stream_file') else None)
+
+	def start(self, url, url_class=None, attempt=0):
+		'''Start timing a request, the class is worked out from the URL if
+		it isn't given.'''
+		return RequestTiming(self, url_class or classify_url(url), url, attempt)
+
+	def _record(self, record):
+		with self._lock:
+			self._classes.setdefault(record['class'], UrlClassTimings()).add(record)
+
+			if self._stream is not None:
+				self._stream.write(json.dumps({'time': round(time.time(), 3), **record}) + '\n')
+
+	def summary(self):
+		'''The histograms of each URL class'''
+
+		with self._lock:
+			return {url_class: timings.summary() for url_class, timings in sorted(self._classes.items())}
+
+	def close(self):
+		'''Write the summary file, and close the stream file'''
+
+		if self._summary_file is not None:
+			os.makedirs(os.path.dirname(self._summary_file), exist_ok=True)
+			with open(self._summary_file, 'w') as f:
+				json.dump(self.summary(), f, indent=4)
+			log.info(f'Request timings written to "{self._summary_file}"')
+
+		with self._lock:
+			if self._stream is not None:
+				self._stream.close()
+				self._stream = None
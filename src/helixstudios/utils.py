@@ -3,6 +3,7 @@
 '''random utilities that are useful across the application'''
 
 import os
+import re
 import math
 import logging
 
@@ -62,6 +63,39 @@ def bytes_to_string(size_bytes):
    return f'{size_bytes / p:.2f} {SIZE_NAMES[i]}'
 
 
+SIZE_REGEX = re.compile(r'^\s*(?P<num>[0-9.]+)\s*(?P<unit>[a-z]*)\s*$', re.IGNORECASE)
+def string_to_bytes(size_string):
+	'''The reverse of bytes_to_string, convert a size like "10MB" or "1.5 GB"
+	to a number of bytes. Plain numbers are already in bytes.'''
+
+	if isinstance(size_string, (int, float)):
+		return int(size_string)
+
+	size = SIZE_REGEX.match(size_string)
+	if not size:
+		raise ValueError(f'size not recognised: {size_string}')
+
+	unit = size.group('unit').upper() or 'B'
+	if not unit.endswith('B'):
+		unit += 'B'
+
+	if unit not in SIZE_NAMES:
+		raise ValueError(f'unit "{size.group("unit")}" not recognised for: {size_string}')
+
+	return int(float(size.group('num')) * math.pow(1024, SIZE_NAMES.index(unit)))
+
+
+def atomic_write(path, data):
+	'''Write text or bytes to a file through a ".tmp" file next to it, which
+	replaces the file once it's complete. Readers see the old file or the 
+	new one, never a file that's half written.'''
+
+	tmp_path = path + '.tmp'
+	with open(tmp_path, 'wb' if isinstance(data, bytes) else 'w') as f:
+		f.write(data)
+	os.replace(tmp_path, path)
+
+
 def base_url(url):
 	'''Return the base URL for any link, just the protocol
 	and hostname section.'''
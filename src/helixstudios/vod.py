@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+
+'''Download the segments of a streaming video in parallel, and write
+them to disk in order. A journal records every segment written, so an
+interrupted download can be resumed.'''
+
+import os
+import struct
+import hashlib
+import logging
+
+from urllib.parse import urlparse
+
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait, FIRST_COMPLETED
+
+
+log = logging.getLogger(__name__)
+
+
+JOURNAL_MAGIC = b'HXJ1'
+
+# magic, number of segments, fingerprint of the segment list
+JOURNAL_HEADER = struct.Struct('>4sI16s')
+
+# byte offset of the end of each segment in the output file
+JOURNAL_OFFSET = struct.Struct('>Q')
+
+
+def journal_path(part_path):
+	'''The path of the journal file belonging to a partial stream download'''
+	return part_path + '.journal'
+
+
+def segment_list_fingerprint(urls):
+	'''A fingerprint of the list of segments. The query strings are ignored,
+	they hold access tokens that change every time the playlist is fetched.'''
+
+	md5 = hashlib.md5()
+	for url in urls:
+		md5.update(urlparse(url).path.encode() + b'\n')
+	return md5.digest()
+
+
+class SegmentJournal:
+	'''A compact on-disk record of a stream download. It holds a bitmap of 
+	the segments that have been written to the output file, and the byte 
+	offset in the file where each segment ends. Every update is a small write
+	at a fixed position in the journal, so the journal is never rewritten.'''
+
+	def __init__(self, path, segment_count, fingerprint, bitmap=None, offsets=None):
+		self._path = path
+		self._segment_count = segment_count
+		self._fingerprint = fingerprint
+		self._bitmap = bitmap or bytearray((segment_count + 7) // 8)
+		self._offsets = offsets or [0] * segment_count
+		self._file = None
+
+	def __repr__(self):
+		return f'<SegmentJournal({self.finished_count}/{self._segment_count} segments)>'
+
+	@property
+	def _bitmap_position(self):
+		return JOURNAL_HEADER.size
+
+	@property
+	def _offsets_position(self):
+		return JOURNAL_HEADER.size + len(self._bitmap)
+
+	@classmethod
+	def create(cls, path, urls):
+		'''Start a new, empty journal for the given list of segments'''
+
+		journal = cls(path, len(urls), segment_list_fingerprint(urls))
+		with open(path, 'wb') as f:
+			f.write(JOURNAL_HEADER.pack(JOURNAL_MAGIC, journal._segment_count, journal._fingerprint))
+			f.write(journal._bitmap)
+			f.write(b'\0' * JOURNAL_OFFSET.size * journal._segment_count)
+		return journal
+
+	@classmethod
+	def load(cls, path, urls):
+		'''Load the journal from disk. Returns None if there is no journal, or
+		if it was written for a different list of segments.'''
+
+		if not os.path.isfile(path):
+			return None
+
+		with open(path, 'rb') as f:
+			data = f.read()
+
+		try:
+			magic, segment_count, fingerprint = JOURNAL_HEADER.unpack_from(data)
+		except struct.error:
+			magic = None
+
+		if magic != JOURNAL_MAGIC:
+			log.warning(f'Segment journal "{path}" is not valid, ignoring it')
+			return None
+
+		if segment_count != len(urls) or fingerprint != segment_list_fingerprint(urls):
+			log.warning(f'Segment journal "{path}" is for a different stream, ignoring it')
+			return None
+
+		bitmap_end = JOURNAL_HEADER.size + (segment_count + 7) // 8
+		bitmap = bytearray(data[JOURNAL_HEADER.size:bitmap_end])
+		offsets = [o for o, in JOURNAL_OFFSET.iter_unpack(data[bitmap_end:])]
+
+		if len(bitmap) * 8 < segment_count or len(offsets) != segment_count:
+			log.warning(f'Segment journal "{path}" is truncated, ignoring it')
+			return None
+
+		return cls(path, segment_count, fingerprint, bitmap, offsets)
+
+	@property
+	def path(self):
+		return self._path
+
+	@property
+	def finished_count(self):
+		return sum(self.is_finished(i) for i in range(self._segment_count))
+
+	def is_finished(self, index):
+		return bool(self._bitmap[index // 8] & (1 << (index % 8)))
+
+	def offset(self, index):
+		'''The byte offset in the output file where the given segment starts'''
+		return 0 if index == 0 else self._offsets[index - 1]
+
+	def resume_index(self, filesize):
+		'''The index of the first segment that is missing from an output file 
+		of the given size. All segments before it are safely on disk.'''
+
+		for index in range(self._segment_count):
+			if not self.is_finished(index) or self._offsets[index] > filesize:
+				return index
+
+		return self._segment_count
+
+	def record(self, index, end_offset):
+		'''Record that a segment has been written, ending at the given byte
+		offset in the output file. The offset is written before the bitmap, 
+		so a set bit always has a valid offset.'''
+
+		if self._file is None:
+			self._file = open(self._path, 'r+b', buffering=0)
+
+		self._offsets[index] = end_offset
+		self._file.seek(self._offsets_position + index * JOURNAL_OFFSET.size)
+		self._file.write(JOURNAL_OFFSET.pack(end_offset))
+
+		self._bitmap[index // 8] |= 1 << (index % 8)
+		self._file.seek(self._bitmap_position + index // 8)
+		self._file.write(self._bitmap[index // 8:index // 8 + 1])
+
+	def close(self):
+		if self._file is not None:
+			self._file.close()
+			self._file = None
+
+	def remove(self):
+		self.close()
+		if os.path.isfile(self._path):
+			os.remove(self._path)
+
+
+class SegmentReorderBuffer:
+	'''Segments finish downloading out of order. The buffer holds on to
+	each segment until all the segments before it have been written, then
+	writes it to the output file.'''
+
+	def __init__(self, fileobj, first_index=0, journal=None, hasher=None):
+		self._file = fileobj
+		self._next_index = first_index
+		self._journal = journal
+		self._hasher = hasher
+		self._pending = {}
+
+	def __len__(self):
+		return len(self._pending)
+
+	@property
+	def next_index(self):
+		'''The index of the next segment to be written to the file'''
+		return self._next_index
+
+	def add(self, index, data):
+		'''Add a downloaded segment, and write all segments that are now in
+		order to the file. Returns the number of segments written.'''
+
+		self._pending[index] = data
+
+		written = 0
+		while self._next_index in self._pending:
+			data = self._pending.pop(self._next_index)
+			self._file.write(data)
+
+			if self._hasher is not None:
+				self._hasher.update(data)
+
+			if self._journal is not None:
+				# the segment must reach the OS before the journal says it's done
+				self._file.flush()
+				self._journal.record(self._next_index, self._file.tell())
+
+			self._next_index += 1
+			written += 1
+
+		return written
+
+
+def download_segments(fetch, urls, fileobj, workers=8, window=32, first_index=0, journal=None, hasher=None):
+	'''Download all segment urls with a pool of workers, using `fetch(url)`
+	to get the bytes of each segment, and write them to the file in order.
+	The download starts at `first_index`, and each segment written is 
+	recorded in the journal and added to the hasher if they're given.
+
+	A segment is only requested once it's within `window` segments of the
+	next segment to be written, so at most `window` segments are ever held
+	in memory, no matter how slow any single segment is.'''
+
+	buffer = SegmentReorderBuffer(fileobj, first_index=first_index, journal=journal, hasher=hasher)
+	window = max(window, workers)
+
+	with ThreadPoolExecutor(max_workers=workers) as pool:
+		running = {}
+		next_to_submit = first_index
+
+		while buffer.next_index < len(urls):
+			# keep the pool busy, without running too far ahead of the writer
+			while (next_to_submit < len(urls) and len(running) < workers and
+				   next_to_submit < buffer.next_index + window):
+				running[pool.submit(fetch, urls[next_to_submit])] = next_to_submit
+				next_to_submit += 1
+
+			done, _ = wait(running, return_when=FIRST_COMPLETED)
+			for future in done:
+				index = running.pop(future)
+				try:
+					data = future.result()
+				except BaseException:
+					# don't start any more segments, the download has failed
+					for f in running:
+						f.cancel()
+					raise
+
+				buffer.add(index, data)
+
+			log.debug(f'{buffer.next_index}/{len(urls)} segments written, {len(buffer)} buffered')
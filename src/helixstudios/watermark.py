@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+'''A high-water mark for incremental crawls of the video listing. The
+newest video links seen are saved, so the next crawl can stop as soon as
+it reaches videos it has already seen.'''
+
+import os
+import json
+import logging
+import threading
+
+from .utils import atomic_write
+
+
+# how many of the newest video links are remembered
+MAX_KNOWN_VIDEOS = 500
+
+
+log = logging.getLogger(__name__)
+
+
+class CrawlWatermark:
+	'''The newest video links seen by the last complete crawl, newest first.
+	A crawl records each link it hands out with `seen`, and is marked
+	`crawled` once it reaches the end of the listing or the videos seen
+	before. The caller commits the watermark after every link has been
+	handled, marking the links it failed to handle with `failed`.'''
+
+	def __init__(self, path, known=None, max_known=MAX_KNOWN_VIDEOS):
+		self._path = path
+		self._known = list(known or [])
+		self._known_set = set(self._known)
+		self._max_known = max_known
+		self._seen = []
+		self._failed = set()
+		self._failed_lock = threading.Lock()
+		self._complete = False
+
+	def __repr__(self):
+		return f'<CrawlWatermark({len(self._known)} known videos)>'
+
+	def __contains__(self, video_link):
+		return video_link in self._known_set
+
+	@classmethod
+	def load(cls, path, max_known=MAX_KNOWN_VIDEOS):
+		'''Load the watermark from disk, an empty watermark is returned if
+		there isn't one yet.'''
+
+		if not os.path.isfile(path):
+			log.info('No crawl watermark found, the whole listing will be crawled')
+			return cls(path, max_known=max_known)
+
+		try:
+			with open(path) as f:
+				known = json.load(f)['known']
+		except (OSError, ValueError, KeyError):
+			log.warning(f'Crawl watermark "{path}" could not be read, ignoring it')
+			known = []
+
+		return cls(path, known, max_known=max_known)
+
+	@property
+	def newest(self):
+		'''The newest video link seen, None if nothing has been seen'''
+		return self._known[0] if self._known else None
+
+	@property
+	def complete(self):
+		'''True once the current crawl has reached everything new'''
+		return self._complete
+
+	def seen(self, video_link):
+		'''Record a video link seen by the current crawl, in listing order.'''
+		self._seen.append(video_link)
+
+	def failed(self, video_link):
+		'''Record a video link seen by the current crawl that couldn't be 
+		handled. It's left out of the watermark, so the next crawl hands it 
+		out again. Can be called from any thread.'''
+
+		with self._failed_lock:
+			self._failed.add(video_link)
+
+	def crawled(self):
+		'''Mark the current crawl as complete'''
+		self._complete = True
+
+	def commit(self):
+		'''Store the watermark if the crawl was complete. Only call this once
+		every link seen has been handled, e.g. downloaded, otherwise a run that
+		stops part way would skip the videos it never got to next time.'''
+
+		if not self._complete:
+			log.info('The crawl was not complete, the crawl watermark is not updated')
+			return
+
+		self.store()
+
+	def store(self):
+		'''Move the links seen by this crawl to the top of the watermark, and
+		write it to disk. Only call this when the crawl is complete, otherwise
+		new videos the crawl never reached would be missed next time.'''
+
+		with self._failed_lock:
+			failed = set(self._failed)
+
+		new = [l for l in dict.fromkeys(self._seen) if l not in self._known_set and l not in failed]
+		self._known = (new + self._known)[:self._max_known]
+		self._known_set = set(self._known)
+		self._seen = []
+		self._failed = set()
+
+		os.makedirs(os.path.dirname(self._path), exist_ok=True)
+		atomic_write(self._path, json.dumps({'known': self._known}, indent=4))
+
+		log.info(f'Stored crawl watermark with {len(new)} new videos')
+		if failed:
+			log.info(f'{len(failed)} videos that failed are left out of the watermark, they\'ll be tried again next time')
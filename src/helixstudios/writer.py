@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+
+'''The write path for large downloads: preallocated files, reads sized to
+the observed throughput, and a configurable fsync policy.'''
+
+import os
+import time
+import logging
+
+from urllib3.exceptions import ProtocolError
+from urllib3.exceptions import ReadTimeoutError
+from urllib3.exceptions import DecodeError
+from urllib3.exceptions import SSLError
+
+from requests.exceptions import ChunkedEncodingError
+from requests.exceptions import ConnectionError
+from requests.exceptions import ContentDecodingError
+
+from .utils import string_to_bytes
+
+
+log = logging.getLogger(__name__)
+
+
+MIN_CHUNK_SIZE = 64 * 1024          # 64kB
+MAX_CHUNK_SIZE = 8 * 1024 * 1024    # 8MB
+
+# each read should take about this long at the current throughput
+CHUNK_DURATION = 0.1   # seconds
+
+FSYNC_NEVER = 'never'
+FSYNC_END = 'end'
+FSYNC_INTERVAL = 'interval'
+FSYNC_POLICIES = (FSYNC_NEVER, FSYNC_END, FSYNC_INTERVAL)
+
+
+def preallocate(path, size):
+	'''Create the file at its full size. Where the platform supports it the
+	disk space is allocated too, which avoids fragmentation and fails early
+	if the disk is full. Otherwise the file is just extended.'''
+
+	with open(path, 'wb') as f:
+		if hasattr(os, 'posix_fallocate'):
+			try:
+				os.posix_fallocate(f.fileno(), 0, size)
+				return
+			except OSError as e:
+				log.debug(f'posix_fallocate not supported here ({e}), extending the file instead')
+
+		f.truncate(size)
+
+
+class AdaptiveChunkSize:
+	'''Chooses how many bytes to read at a time, so each read takes roughly
+	`duration` seconds at the throughput seen so far. Fast connections get
+	big reads and few Python-level calls, slow ones stay responsive.'''
+
+	def __init__(self, minimum=MIN_CHUNK_SIZE, maximum=MAX_CHUNK_SIZE, duration=CHUNK_DURATION):
+		self._minimum = minimum
+		self._maximum = maximum
+		self._duration = duration
+		self._throughput = None
+		self._size = minimum
+
+	def __repr__(self):
+		return f'<AdaptiveChunkSize({self._size})>'
+
+	@property
+	def size(self):
+		return self._size
+
+	def update(self, byte_count, seconds):
+		'''Update the throughput estimate with one read, and resize the next read'''
+
+		if seconds <= 0:
+			throughput = self._maximum / self._duration
+		else:
+			throughput = byte_count / seconds
+
+		if self._throughput is None:
+			self._throughput = throughput
+		else:
+			self._throughput = 0.7 * self._throughput + 0.3 * throughput
+
+		# round down to a power of 2
+		target = max(self._minimum, min(self._maximum, int(self._throughput * self._duration)))
+		self._size = 1 << (target.bit_length() - 1)
+
+
+class WritePolicy:
+	'''The write settings for downloads: read sizes and when to fsync.'''
+
+	def __init__(self, min_chunk=MIN_CHUNK_SIZE, max_chunk=MAX_CHUNK_SIZE,
+				 fsync=FSYNC_NEVER, fsync_interval=256 * 1024 * 1024):
+		if fsync not in FSYNC_POLICIES:
+			raise ValueError(f'fsync policy "{fsync}" must be one of: {" ".join(FSYNC_POLICIES)}')
+
+		self.min_chunk = min_chunk
+		self.max_chunk = max_chunk
+		self.fsync = fsync
+		self.fsync_interval = fsync_interval
+
+	def __repr__(self):
+		return f'<WritePolicy(fsync={self.fsync})>'
+
+	@classmethod
+	def from_settings(cls, settings):
+		'''Build the policy from the "write" settings'''
+
+		if settings is None:
+			return cls()
+
+		return cls(min_chunk=string_to_bytes(settings.get('min_chunk', default=MIN_CHUNK_SIZE)),
+				   max_chunk=string_to_bytes(settings.get('max_chunk', default=MAX_CHUNK_SIZE)),
+				   fsync=settings.get('fsync', default=FSYNC_NEVER),
+				   fsync_interval=string_to_bytes(settings.get('fsync_interval', default='256MB')))
+
+
+def read_chunks(resp, chunk_size):
+	'''Read the body of a streamed response, asking the adaptive chunk size
+	how much to read each time. Errors are raised as the same requests
+	exceptions that `iter_content` raises.'''
+
+	while True:
+		start = time.monotonic()
+		try:
+			chunk = resp.raw.read(chunk_size.size, decode_content=True)
+		except ProtocolError as e:
+			raise ChunkedEncodingError(e)
+		except DecodeError as e:
+			raise ContentDecodingError(e)
+		except (ReadTimeoutError, SSLError) as e:
+			raise ConnectionError(e)
+
+		if not chunk:
+			return
+
+		chunk_size.update(len(chunk), time.monotonic() - start)
+		yield chunk
+
+
+def _write_all(f, data):
+	'''Write all of the data. A write to an unbuffered file may only take
+	part of it.'''
+
+	view = memoryview(data)
+	while view:
+		n = f.write(view)
+		if not n:
+			raise OSError(f'writing to "{f.name}" failed after {len(data) - len(view)} of {len(data)} bytes')
+		view = view[n:]
+
+
+def write_response(resp, f, policy, start=0, end=None, abort=None, on_chunk=None, hasher=None):
+	'''Write the body of a streamed response into an open file from byte
+	`start`, stopping after byte `end` if given. `on_chunk(byte_count)` is
+	called after every write, and every chunk written is also added to the
+	hasher if one is given. Returns the position after the last byte
+	written.'''
+
+	position = start
+	synced = start
+	chunk_size = AdaptiveChunkSize(policy.min_chunk, policy.max_chunk)
+
+	f.seek(start)
+	for chunk in read_chunks(resp, chunk_size):
+		if abort is not None and abort.is_set():
+			break
+
+		if end is not None and position + len(chunk) > end + 1:
+			chunk = memoryview(chunk)[:end + 1 - position]
+
+		_write_all(f, chunk)
+		position += len(chunk)
+
+		if hasher is not None:
+			hasher.update(chunk)
+
+		if on_chunk is not None:
+			on_chunk(len(chunk))
+
+		if policy.fsync == FSYNC_INTERVAL and position - synced >= policy.fsync_interval:
+			f.flush()
+			os.fsync(f.fileno())
+			synced = position
+
+		if end is not None and position > end:
+			break
+
+	if policy.fsync in (FSYNC_END, FSYNC_INTERVAL):
+		f.flush()
+		os.fsync(f.fileno())
+
+	return position
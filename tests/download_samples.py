@@ -19,7 +19,7 @@ SETTINGS = {
 	'username': 'my_username',
 	'password': 'my_password',
 
-	'session': '~/.config/helixstudios/session.bin',
+	'session': '~/.config/helixstudios/session.json',
 
 	'links': {
 		'members': 'https://www.helixstudios.com/members/',
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+'''Test the bandwidth governor shared between transfers.'''
+
+import time
+import datetime
+import unittest
+
+from helixstudios import SettingsContainer
+from helixstudios.bandwidth import TokenBucket
+from helixstudios.bandwidth import TimeWindow
+from helixstudios.bandwidth import BandwidthGovernor
+
+
+SAMPLE_SETTINGS = {
+	'limit': '10MB',
+	'per_transfer_limit': None,
+	'windows': [
+		{'start': '09:00', 'end': '18:00', 'limit': '2MB'},
+		{'start': '23:00', 'end': '01:00', 'limit': None},
+	]
+}
+
+
+class TokenBucketTestCase(unittest.TestCase):
+	'''A test case for the token bucket'''
+
+	def test_unlimited(self):
+		'''An unlimited bucket never makes the caller wait'''
+		self.assertEqual(TokenBucket().reserve(10 ** 12), 0.0)
+
+	def test_debt(self):
+		'''Taking more than the bucket holds means waiting for the debt'''
+
+		bucket = TokenBucket(1000, burst=1.0)
+		self.assertEqual(bucket.reserve(1000), 0.0)
+		self.assertAlmostEqual(bucket.reserve(500), 0.5, places=1)
+		self.assertAlmostEqual(bucket.reserve(500), 1.0, places=1)
+
+
+class BandwidthGovernorTestCase(unittest.TestCase):
+	'''A test case for the bandwidth governor'''
+
+	def setUp(self):
+		self.governor = BandwidthGovernor.from_settings(SettingsContainer(SAMPLE_SETTINGS))
+
+	def test_time_windows(self):
+		'''The window limits replace the global limit'''
+
+		day = datetime.datetime(2026, 1, 1)
+		self.assertEqual(self.governor.current_limit(day.replace(hour=10)), 2 * 1024 * 1024)
+		self.assertEqual(self.governor.current_limit(day.replace(hour=20)), 10 * 1024 * 1024)
+
+		# windows can cross midnight
+		self.assertIsNone(self.governor.current_limit(day.replace(hour=0, minute=30)))
+		self.assertIsNone(self.governor.current_limit(day.replace(hour=23, minute=30)))
+
+	def test_time_window(self):
+		'''A window includes its start time and excludes its end time'''
+
+		window = TimeWindow('09:00', '18:00', 100)
+		self.assertTrue(window.contains(datetime.time(9, 0)))
+		self.assertFalse(window.contains(datetime.time(18, 0)))
+
+	def test_per_transfer_limit(self):
+		'''A transfer with its own limit is held to it, even with no global limit'''
+
+		governor = BandwidthGovernor()
+		with governor.transfer('video.mp4', limit=100000) as transfer:
+			self.assertEqual(governor.active_transfers, 1)
+
+			start = time.monotonic()
+			transfer.consume(100000)
+			transfer.consume(20000)
+			self.assertGreater(time.monotonic() - start, 0.15)
+
+		self.assertEqual(governor.active_transfers, 0)
+
+	def test_no_settings(self):
+		'''Without settings there are no limits at all'''
+
+		governor = BandwidthGovernor.from_settings(None)
+		self.assertIsNone(governor.current_limit())
+
+
+if __name__ == '__main__':
+	unittest.main()
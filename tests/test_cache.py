@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+'''Test the on-disk page response cache.'''
+
+import os
+import time
+import tempfile
+import unittest
+
+from helixstudios.cache import ResponseCache
+
+
+class FakeResponse:
+	'''Just enough of a requests response for the cache'''
+
+	def __init__(self, url, text, headers=None, status_code=200):
+		self.url = url
+		self.text = text
+		self.headers = headers or {}
+		self.status_code = status_code
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+	'''A test case for the response cache'''
+
+	def setUp(self):
+		self.folder = tempfile.mkdtemp()
+
+	def test_store_and_revalidate(self):
+		'''Responses with an ETag are stored, and revalidated with it'''
+
+		cache = ResponseCache(self.folder)
+		cache.store('https://a/1', FakeResponse('https://a/1/', 'page one', {'ETag': '"abc"'}))
+
+		entry = cache.lookup('https://a/1')
+		self.assertEqual(entry.text, 'page one')
+		self.assertEqual(entry.final_url, 'https://a/1/')
+		self.assertEqual(entry.validators(), {'If-None-Match': '"abc"'})
+
+		# without a ttl, the page must always be checked with the server
+		self.assertFalse(entry.fresh)
+
+	def test_uncacheable(self):
+		'''Responses with no validators and no ttl aren't worth storing'''
+
+		cache = ResponseCache(self.folder)
+		cache.store('https://a/1', FakeResponse('https://a/1', 'page one'))
+		self.assertIsNone(cache.lookup('https://a/1'))
+
+	def test_ttl(self):
+		'''Pages matching a ttl pattern are fresh for that long'''
+
+		cache = ResponseCache(self.folder, ttls=[('/videos/', 60)])
+		cache.store('https://a/videos/1', FakeResponse('https://a/videos/1', 'video'))
+		self.assertTrue(cache.lookup('https://a/videos/1').fresh)
+
+	def test_persistence(self):
+		'''The cache survives across sessions'''
+
+		cache = ResponseCache(self.folder)
+		cache.store('https://a/1', FakeResponse('https://a/1', 'page one', {'Last-Modified': 'yesterday'}))
+
+		cache = ResponseCache(self.folder)
+		self.assertEqual(len(cache), 1)
+		self.assertEqual(cache.lookup('https://a/1').validators(), {'If-Modified-Since': 'yesterday'})
+
+	def test_interrupted_store(self):
+		'''Files left half written by an interrupted run are cleaned up'''
+
+		for name in ('abc.body.tmp', 'abc.json.tmp'):
+			with open(os.path.join(self.folder, name), 'w') as f:
+				f.write('half')
+
+		cache = ResponseCache(self.folder)
+		self.assertEqual(len(cache), 0)
+		self.assertEqual(os.listdir(self.folder), [])
+
+	def test_evicted_entry(self):
+		'''An entry evicted after it was looked up is gone for good'''
+
+		cache = ResponseCache(self.folder)
+		cache.store('https://a/1', FakeResponse('https://a/1', 'page one', {'ETag': '"abc"'}))
+		entry = cache.lookup('https://a/1')
+
+		cache._remove(entry.key)
+		with self.assertRaises(FileNotFoundError):
+			entry.text
+
+		cache.revalidated(entry)
+		self.assertEqual(os.listdir(self.folder), [])
+
+	def test_lru_eviction(self):
+		'''The least recently used pages are evicted to fit the size cap'''
+
+		cache = ResponseCache(self.folder, max_size=250)
+		headers = {'ETag': '"x"'}
+
+		cache.store('https://a/1', FakeResponse('https://a/1', 'a' * 100, headers))
+		time.sleep(0.01)
+		cache.store('https://a/2', FakeResponse('https://a/2', 'b' * 100, headers))
+		time.sleep(0.01)
+
+		# using page 1 makes page 2 the least recently used
+		cache.lookup('https://a/1')
+		cache.store('https://a/3', FakeResponse('https://a/3', 'c' * 100, headers))
+
+		self.assertIsNotNone(cache.lookup('https://a/1'))
+		self.assertIsNone(cache.lookup('https://a/2'))
+		self.assertIsNotNone(cache.lookup('https://a/3'))
+		self.assertLessEqual(cache.size, 250)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+'''Test the checksums computed while videos are downloaded.'''
+
+import os
+import hashlib
+import unittest
+import tempfile
+
+from helixstudios.checksum import PrefixHasher
+from helixstudios.checksum import RangeHasher
+from helixstudios.checksum import load_checksums, store_checksum
+
+
+class PrefixHasherTestCase(unittest.TestCase):
+	'''A test case for hashing a file from disk and from the network'''
+
+	def setUp(self):
+		self._folder = tempfile.TemporaryDirectory()
+		self.path = os.path.join(self._folder.name, 'video.mp4')
+		self.data = os.urandom(3 * 1024 * 1024 + 17)
+
+		with open(self.path, 'wb') as f:
+			f.write(self.data)
+
+	def tearDown(self):
+		self._folder.cleanup()
+
+	def test_resumed_hash(self):
+		'''Hashing the prefix from disk then the rest as it arrives should
+		give the checksum of the whole file'''
+
+		hasher = PrefixHasher()
+		hasher.hash_file(self.path, 1000)
+		self.assertEqual(hasher.hashed, 1000)
+
+		hasher.update(self.data[1000:2000])
+		hasher.hash_file(self.path, len(self.data))
+
+		self.assertEqual(hasher.checksum(), {
+			'sha256': hashlib.sha256(self.data).hexdigest(),
+			'size': len(self.data)
+		})
+
+	def test_hash_file_is_idempotent(self):
+		'''Hashing up to a point that is already hashed does nothing'''
+
+		hasher = PrefixHasher('md5')
+		hasher.hash_file(self.path, 5000)
+		hasher.hash_file(self.path, 10)
+		self.assertEqual(hasher.checksum()['md5'], hashlib.md5(self.data[:5000]).hexdigest())
+
+	def test_short_file(self):
+		with self.assertRaises(EOFError):
+			PrefixHasher().hash_file(self.path, len(self.data) + 1)
+
+	def test_ranges_in_parallel(self):
+		'''Ranges written out of order are hashed in order, and only what a
+		range wrote before it joined the hashed prefix is read back'''
+
+		read_back = []
+		class CountingHasher(PrefixHasher):
+			def hash_file(self, path, end):
+				read_back.append(max(0, end - self.hashed))
+				super().hash_file(path, end)
+
+		a, b, c = 1000, 2000, 3000
+		hasher = CountingHasher()
+		range_hasher = RangeHasher(hasher, self.path, [(0, 0), (a, 0), (b, 0), (c, 0)])
+		parts = [range_hasher.part(i) for i in range(4)]
+
+		def write(index, start, end):
+			parts[index].update(self.data[start:end])
+
+		write(0, 0, 500)
+		write(1, a, b)          # all of range 1 arrives before range 0
+		write(3, c, c + 100)
+		write(0, 500, a)        # range 1 is read back here
+		write(2, b, c)          # and the start of range 3
+		write(3, c + 100, len(self.data))
+
+		self.assertEqual(hasher.checksum()['sha256'], hashlib.sha256(self.data).hexdigest())
+		self.assertEqual(sum(read_back), (b - a) + 100)
+
+	def test_resumed_ranges(self):
+		'''The parts of the ranges already on disk are hashed from there'''
+
+		hasher = PrefixHasher()
+		range_hasher = RangeHasher(hasher, self.path, [(0, 1000), (2000, 100)])
+		self.assertEqual(hasher.hashed, 1000)
+
+		range_hasher.part(0).update(self.data[1000:2000])
+		self.assertEqual(hasher.hashed, 2100)
+
+		range_hasher.part(1).update(self.data[2100:])
+		self.assertEqual(hasher.checksum()['sha256'], hashlib.sha256(self.data).hexdigest())
+
+	def test_store_checksum(self):
+		'''Checksums of several files are kept in the one file'''
+
+		path = os.path.join(self._folder.name, '.checksums.json')
+		self.assertEqual(load_checksums(path), {})
+
+		store_checksum(path, 'a.mp4', {'sha256': 'aaa', 'size': 1})
+		store_checksum(path, 'b.mp4', {'sha256': 'bbb', 'size': 2})
+
+		self.assertEqual(load_checksums(path), {
+			'a.mp4': {'sha256': 'aaa', 'size': 1},
+			'b.mp4': {'sha256': 'bbb', 'size': 2}
+		})
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+'''Test the adaptive limit on concurrent page requests.'''
+
+import time
+import threading
+import unittest
+
+from helixstudios.concurrency import AdaptiveLimiter
+
+
+class AdaptiveLimiterTestCase(unittest.TestCase):
+	'''A test case for the AIMD page request limiter'''
+
+	def test_additive_increase(self):
+		'''The limit grows while requests succeed with a steady latency'''
+
+		limiter = AdaptiveLimiter(initial=2, maximum=4)
+		for _ in range(20):
+			with limiter.request():
+				pass
+
+		self.assertEqual(limiter.limit, 4)
+		self.assertEqual(limiter.in_flight, 0)
+
+	def test_multiplicative_decrease(self):
+		'''A failed request halves the limit'''
+
+		limiter = AdaptiveLimiter(initial=8)
+		with limiter.request() as request:
+			request.failed()
+
+		self.assertEqual(limiter.limit, 4)
+
+	def test_exception_is_failure(self):
+		'''An exception during the request, e.g. a timeout, cuts the limit'''
+
+		limiter = AdaptiveLimiter(initial=8, minimum=3)
+		with self.assertRaises(TimeoutError):
+			with limiter.request():
+				raise TimeoutError()
+
+		self.assertEqual(limiter.limit, 4)
+		self.assertEqual(limiter.in_flight, 0)
+
+	def test_one_decrease_per_burst(self):
+		'''A burst of failures at the same time only cuts the limit once'''
+
+		limiter = AdaptiveLimiter(initial=8)
+		for _ in range(3):
+			with limiter.request() as request:
+				request.failed()
+
+		self.assertEqual(limiter.limit, 4)
+
+	def test_limit_respected(self):
+		'''No more requests than the limit are ever in flight'''
+
+		limiter = AdaptiveLimiter(initial=3, maximum=3)
+		lock = threading.Lock()
+		peak = [0]
+
+		def request():
+			with limiter.request():
+				with lock:
+					peak[0] = max(peak[0], limiter.in_flight)
+				time.sleep(0.01)
+
+		threads = [threading.Thread(target=request) for _ in range(12)]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+
+		self.assertEqual(peak[0], 3)
+
+
+if __name__ == '__main__':
+	unittest.main()
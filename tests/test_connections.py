@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+'''Test the connection pool adapter and its connection counts.'''
+
+import threading
+import unittest
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+from helixstudios import SettingsContainer
+from helixstudios.connections import configure_session
+
+
+class Handler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+
+	def log_message(self, *args):
+		pass
+
+	def do_GET(self):
+		body = b'<html></html>'
+		self.send_response(200)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+
+class PoolAdapterTestCase(unittest.TestCase):
+	'''A test case for counting new and reused connections'''
+
+	def setUp(self):
+		self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+		threading.Thread(target=self.server.serve_forever, daemon=True).start()
+		self.url = f'http://127.0.0.1:{self.server.server_port}/'
+
+	def tearDown(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+	def test_reused_connections(self):
+		'''Sequential requests should reuse one kept-alive connection'''
+
+		session = requests.Session()
+		adapter = configure_session(session, SettingsContainer({'pool_maxsize': 4}))
+
+		for _ in range(5):
+			session.get(self.url)
+
+		self.assertEqual(adapter.connection_stats, {'new': 1, 'reused': 4})
+
+		# the counts survive the pools being closed
+		adapter.poolmanager.clear()
+		self.assertEqual(adapter.connection_stats, {'new': 1, 'reused': 4})
+
+	def test_keep_alive_off(self):
+		'''Without keep-alive every request needs a new connection'''
+
+		session = requests.Session()
+		adapter = configure_session(session, SettingsContainer({'keep_alive': False}))
+
+		for _ in range(3):
+			session.get(self.url)
+
+		self.assertEqual(adapter.connection_stats, {'new': 3, 'reused': 0})
+
+
+if __name__ == '__main__':
+	unittest.main()
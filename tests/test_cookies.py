@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+'''Test the JSON cookie store used to persist the session.'''
+
+import os
+import time
+import unittest
+import tempfile
+
+import requests.cookies
+
+from helixstudios.cookies import CookieStore
+
+
+class CookieStoreTestCase(unittest.TestCase):
+	'''A test case for storing and restoring session cookies'''
+
+	def setUp(self):
+		self._folder = tempfile.TemporaryDirectory()
+		self.path = os.path.join(self._folder.name, 'session.json')
+
+	def tearDown(self):
+		self._folder.cleanup()
+
+	def jar(self, **expires):
+		jar = requests.cookies.RequestsCookieJar()
+		for name, expiry in expires.items():
+			jar.set(name, f'{name}-value', domain='www.helixstudios.com', path='/', expires=expiry)
+		return jar
+
+	def test_round_trip(self):
+		'''Cookies should be restored with their values and domains'''
+
+		CookieStore(self.path).store(self.jar(session=None, remember=int(time.time()) + 3600))
+
+		jar = CookieStore(self.path).load()
+		self.assertEqual(jar.get('session', domain='www.helixstudios.com'), 'session-value')
+		self.assertEqual(jar.get('remember'), 'remember-value')
+
+	def test_expired_cookies_dropped(self):
+		'''Expired cookies are dropped, and a jar of only expired cookies isn't a session'''
+
+		now = int(time.time())
+		CookieStore(self.path).store(self.jar(old=now - 10, new=now + 3600))
+		self.assertEqual(list(CookieStore(self.path).load().keys()), ['new'])
+
+		CookieStore(self.path).store(self.jar(old=now - 10))
+		self.assertIsNone(CookieStore(self.path).load())
+
+	def test_freshness(self):
+		'''The session is fresh for the ttl after it was last confirmed'''
+
+		CookieStore(self.path).store(self.jar(session=None), validated=time.time() - 100)
+
+		store = CookieStore(self.path)
+		self.assertFalse(store.fresh(1000))
+
+		store.load()
+		self.assertTrue(store.fresh(1000))
+		self.assertFalse(store.fresh(50))
+
+	def test_unreadable(self):
+		'''A missing or old pickled session file means there's no session'''
+
+		self.assertIsNone(CookieStore(self.path).load())
+
+		with open(self.path, 'wb') as f:
+			f.write(b'\x80\x04\x95 not json')
+		self.assertIsNone(CookieStore(self.path).load())
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -2,10 +2,19 @@
 
 '''Test the functions in the downloader.'''
 
+import os
+import time
 import datetime
+import tempfile
 import unittest
+from unittest import mock
 
 from helixstudios import find_best_quality
+from helixstudios import SettingsContainer
+from helixstudios.downloader import HelixDownloader
+from helixstudios.downloader import ReadAhead
+from helixstudios.session import PageResponse
+from helixstudios.watermark import CrawlWatermark
 
 
 SAMPLE_DOWNLOAD_LINKS = [
@@ -42,5 +51,220 @@ class VideoPageTestCase(unittest.TestCase):
 		self.assertEqual(best_quality['item'], 'HD 1080p')
 
 
+LISTING_URL = 'https://www.helixstudios.com/members/videos/'
+
+
+def listing_page(videos, next_page=None):
+	'''Build a minimal video listing page'''
+
+	links = ''.join(f'<a class="thumbnail-link" href="/members/videos/{v}/"></a>' for v in videos)
+	next_link = f'<a class="next" href="//www.helixstudios.com/members/videos/?p={next_page}">' if next_page else ''
+	return f'<html><body>{links}{next_link}</body></html>'
+
+
+class FakeSession:
+	'''Serve the listing pages from memory, counting the requests'''
+
+	def __init__(self, pages):
+		self.pages = pages
+		self.requests = 0
+		self.last_url = None
+
+		# status codes to answer a URL with before its page, like a 500
+		self.errors = {}
+
+	def get(self, url, retries=10):
+		response = self.fetch(url, retries)
+		return response.status_code, response.text
+
+	def fetch(self, url, retries=10, parser=None):
+		self.requests += 1
+		self.last_url = url
+
+		errors = self.errors.get(url)
+		if errors:
+			return PageResponse(errors.pop(0), url, '<html><title>Internal Error</title></html>')
+
+		text = self.pages[url]
+		if parser is not None:
+			# the page arrives in pieces
+			parser.start(url)
+			for i in range(0, len(text), 10):
+				parser.feed(text[i:i + 10])
+			parser.close()
+
+		return PageResponse(200, url, text)
+
+
+class IncrementalCrawlTestCase(unittest.TestCase):
+	'''A test case for the incremental crawl of the video listing'''
+
+	def setUp(self):
+		self.watermark_path = os.path.join(tempfile.mkdtemp(), 'watermark.json')
+		settings = SettingsContainer({
+			'session': {
+				'watermark': self.watermark_path,
+				'incremental_stop_after': 3,
+				'listing_read_ahead': 0,    # count the requests exactly
+				'links': {'videos': LISTING_URL}
+			}
+		})
+
+		self.downloader = HelixDownloader(settings, start_session=False)
+		self.downloader._session = self.session = FakeSession({
+			LISTING_URL:            listing_page(['v9', 'v8', 'v7', 'v6'], next_page=2),
+			LISTING_URL + '?p=2':   listing_page(['v5', 'v4', 'v3', 'v2'], next_page=3),
+			LISTING_URL + '?p=3':   listing_page(['v1']),
+		})
+
+	def crawl(self, **kwargs):
+		watermark = self.downloader.load_watermark()
+		links = [l.rstrip('/').split('/')[-1] for l in 
+				 self.downloader.all_video_links(watermark=watermark, **kwargs)]
+		watermark.commit()
+		return links
+
+	def test_stops_at_known_videos(self):
+		'''The second crawl stops once it reaches the videos already seen'''
+
+		self.assertEqual(self.crawl(), ['v9', 'v8', 'v7', 'v6', 'v5', 'v4', 'v3', 'v2', 'v1'])
+		self.assertEqual(self.session.requests, 3)
+
+		# two new videos are published
+		self.session.pages[LISTING_URL] = listing_page(['v11', 'v10', 'v9', 'v8'], next_page=2)
+		self.session.requests = 0
+
+		self.assertEqual(self.crawl(), ['v11', 'v10', 'v9', 'v8'])
+		self.assertEqual(self.session.requests, 2)
+
+		watermark = CrawlWatermark.load(self.watermark_path)
+		self.assertTrue(watermark.newest.endswith('/v11/'))
+
+	def test_interrupted_crawl_not_stored(self):
+		'''A crawl cut short by a limit doesn't update the watermark'''
+
+		self.assertEqual(self.crawl(video_limit=2), ['v9', 'v8'])
+		self.assertFalse(os.path.isfile(self.watermark_path))
+
+	def test_stored_by_the_caller(self):
+		'''The crawl itself never stores the watermark, the caller commits it once the videos are handled'''
+
+		watermark = self.downloader.load_watermark()
+		links = list(self.downloader.all_video_links(watermark=watermark))
+
+		self.assertEqual(len(links), 9)
+		self.assertTrue(watermark.complete)
+		self.assertFalse(os.path.isfile(self.watermark_path))
+
+	@mock.patch('helixstudios.downloader.time.sleep')
+	def test_server_error_retried(self, sleep):
+		'''A listing page with a server error on it is fetched again, it's not the end of the listing'''
+
+		self.session.errors[LISTING_URL + '?p=2'] = [500, 503]
+
+		self.assertEqual(self.crawl(), ['v9', 'v8', 'v7', 'v6', 'v5', 'v4', 'v3', 'v2', 'v1'])
+		self.assertEqual(self.session.requests, 5)
+		self.assertEqual(sleep.call_count, 2)
+
+	@mock.patch('helixstudios.downloader.time.sleep')
+	def test_server_error_not_crawled(self, sleep):
+		'''A listing page that keeps failing ends the crawl with an error, and it isn't complete'''
+
+		self.session.errors[LISTING_URL + '?p=2'] = [500] * 3
+
+		watermark = self.downloader.load_watermark()
+		links = []
+		with self.assertRaises(RuntimeError):
+			for link in self.downloader.all_video_links(retries=3, watermark=watermark):
+				links.append(link)
+
+		self.assertEqual(len(links), 4)
+		self.assertFalse(watermark.complete)
+
+
+class StreamedCrawlTestCase(unittest.TestCase):
+	'''A test case for crawling the video listing while its pages arrive'''
+
+	def setUp(self):
+		settings = SettingsContainer({
+			'session': {
+				'listing_read_ahead': 2,
+				'stream_listing_pages': True,
+				'links': {'videos': LISTING_URL}
+			}
+		})
+
+		self.downloader = HelixDownloader(settings, start_session=False)
+		self.downloader._session = self.session = FakeSession({
+			LISTING_URL:            listing_page(['v9', 'v8', 'v7', 'v6'], next_page=2),
+			LISTING_URL + '?p=2':   listing_page(['v5', 'v4', 'v3', 'v2'], next_page=3),
+			LISTING_URL + '?p=3':   listing_page(['v1']),
+		})
+
+	def crawl(self, **kwargs):
+		return [l.rstrip('/').split('/')[-1] for l in self.downloader.all_video_links(**kwargs)]
+
+	def test_all_links(self):
+		'''Every link of every page is handed out, in order'''
+
+		self.assertEqual(self.crawl(), ['v9', 'v8', 'v7', 'v6', 'v5', 'v4', 'v3', 'v2', 'v1'])
+		self.assertEqual(self.crawl(page_limit=2), ['v9', 'v8', 'v7', 'v6', 'v5', 'v4', 'v3', 'v2'])
+
+	def test_failed_page(self):
+		'''A page that can't be fetched ends the crawl with its error, after the links of the pages before'''
+
+		del self.session.pages[LISTING_URL + '?p=2']
+
+		links = []
+		with self.assertRaises(KeyError):
+			for link in self.downloader.all_video_links():
+				links.append(link)
+		self.assertEqual(len(links), 4)
+
+	@mock.patch('helixstudios.downloader.time.sleep')
+	def test_server_error_retried(self, sleep):
+		'''A listing page with a server error on it is fetched again, none of its links are lost'''
+
+		self.session.errors[LISTING_URL + '?p=2'] = [500]
+
+		self.assertEqual(self.crawl(), ['v9', 'v8', 'v7', 'v6', 'v5', 'v4', 'v3', 'v2', 'v1'])
+
+
+class ReadAheadTestCase(unittest.TestCase):
+	'''A test case for the background read-ahead of listing pages'''
+
+	def test_items_in_order(self):
+		'''All items arrive in order'''
+		self.assertEqual(list(ReadAhead(iter(range(50)), 3)), list(range(50)))
+
+	def test_reads_ahead(self):
+		'''The producer runs ahead of the consumer, but only by the buffer size'''
+
+		produced = []
+		def pages():
+			for i in range(10):
+				produced.append(i)
+				yield i
+
+		read_ahead = ReadAhead(pages(), 2)
+		iterator = iter(read_ahead)
+		self.assertEqual(next(iterator), 0)
+
+		time.sleep(0.2)
+		# one item consumed, two buffered, and one waiting to be buffered
+		self.assertEqual(len(produced), 4)
+		read_ahead.close()
+
+	def test_exception(self):
+		'''Exceptions in the producer are raised in the consumer'''
+
+		def pages():
+			yield 1
+			raise RuntimeError('all GET request attempts failed')
+
+		with self.assertRaises(RuntimeError):
+			list(ReadAhead(pages(), 2))
+
+
 if __name__ == '__main__':
 	unittest.main()
\ No newline at end of file
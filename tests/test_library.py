@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+'''Test the index of videos in the library folders.'''
+
+import os
+import tempfile
+import unittest
+
+from helixstudios.library import LibraryIndex
+
+
+def make_video(root, name, suffix='.mp4'):
+	'''Create a video folder with an empty video file in it'''
+
+	os.makedirs(os.path.join(root, name), exist_ok=True)
+	with open(os.path.join(root, name, name + suffix), 'wb') as f:
+		f.write(b'video')
+
+
+class LibraryIndexTestCase(unittest.TestCase):
+	'''A test case for the library index'''
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.index_path = os.path.join(self.tmp, 'config', 'library.sqlite')
+		self.root = os.path.join(self.tmp, 'library')
+		self.external = os.path.join(self.tmp, 'external')
+
+		make_video(self.root, 'scene_1')
+		make_video(self.root, 'scene_2', suffix='.mp4.part')
+		make_video(self.external, 'scene_3')
+
+	def test_rebuild(self):
+		'''A scan finds the completed videos in every root'''
+
+		index = LibraryIndex(self.index_path, workers=4)
+		self.assertTrue(index.empty)
+		index.rebuild([self.root, self.external])
+
+		self.assertEqual(index.find('scene_1/scene_1.mp4'), self.root)
+		self.assertEqual(index.find('scene_3/scene_3.mp4'), self.external)
+
+		# partial downloads are indexed, but aren't complete
+		self.assertEqual(len(index), 3)
+		self.assertIsNone(index.find('scene_2/scene_2.mp4'))
+		self.assertIsNone(index.find('scene_4/scene_4.mp4'))
+
+	def test_persistence_and_record(self):
+		'''Recorded downloads survive across runs'''
+
+		index = LibraryIndex(self.index_path)
+		make_video(self.root, 'scene_5')
+		index.record(self.root, 'scene_5/scene_5.mp4')
+		index.close()
+
+		index = LibraryIndex(self.index_path)
+		self.assertEqual(index.find('scene_5/scene_5.mp4'), self.root)
+
+	def test_unavailable_root(self):
+		'''A root that isn't mounted keeps its old entries'''
+
+		index = LibraryIndex(self.index_path)
+		index.rebuild([self.external])
+
+		os.rename(self.external, self.external + '_unplugged')
+		index.rebuild([self.external])
+		self.assertEqual(index.find('scene_3/scene_3.mp4'), self.external)
+
+	def test_rebuild_removes_deleted(self):
+		'''Videos deleted from a root are removed by the next scan'''
+
+		index = LibraryIndex(self.index_path)
+		index.rebuild([self.root])
+
+		os.remove(os.path.join(self.root, 'scene_1', 'scene_1.mp4'))
+		index.rebuild([self.root])
+		self.assertIsNone(index.find('scene_1/scene_1.mp4'))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+'''Test the helpers used by the command line download pipeline.'''
+
+import os
+import time
+import logging
+import tempfile
+import unittest
+
+from argparse import Namespace
+
+from helixstudios import __main__ as cli
+from helixstudios.__main__ import VideoLimit
+from helixstudios.__main__ import download_videos
+from helixstudios.__main__ import download_concurrently
+from helixstudios.watermark import CrawlWatermark
+
+
+class VideoLimitTestCase(unittest.TestCase):
+	'''A test case for the video limit shared between download workers'''
+
+	def test_limit(self):
+		'''Make sure no more videos are started once the limit is reached'''
+
+		limit = VideoLimit(2)
+		self.assertEqual(limit.start('a'), 0)
+		limit.finish('a', True)
+		self.assertEqual(limit.start('b'), 1)
+		limit.finish('b', True)
+
+		self.assertTrue(limit.reached)
+		self.assertIsNone(limit.start('c'))
+
+	def test_failed_video_frees_slot(self):
+		'''A failed download shouldn't count towards the limit'''
+
+		limit = VideoLimit(1)
+		self.assertIsNotNone(limit.start('a'))
+		limit.finish('a', False)
+
+		self.assertFalse(limit.reached)
+		self.assertIsNotNone(limit.start('b'))
+
+	def test_duplicate_video(self):
+		'''The same video must never be downloaded by two workers at once'''
+
+		limit = VideoLimit()
+		self.assertIsNotNone(limit.start('a'))
+		self.assertIsNone(limit.start('a'))
+
+		limit.finish('a', True)
+		self.assertIsNotNone(limit.start('a'))
+
+	def test_stop(self):
+		'''Stopping prevents any new videos from starting'''
+
+		limit = VideoLimit()
+		limit.stop()
+		self.assertTrue(limit.reached)
+		self.assertIsNone(limit.start('a'))
+
+
+class FakeDownloader:
+	'''Hands out a fixed list of links, recording them on the watermark'''
+
+	library_index = None
+
+	def __init__(self, links, watermark=None):
+		self.links = links
+		self.watermark = watermark
+
+	def load_watermark(self):
+		return self.watermark
+
+	def all_video_links(self, page_limit=None, retries=10, watermark=None):
+		for link in self.links:
+			watermark.seen(link)
+			yield link
+		watermark.crawled()
+
+
+class ConcurrentWatermarkTestCase(unittest.TestCase):
+	'''A test case for storing the crawl watermark of concurrent downloads'''
+
+	def setUp(self):
+		self.path = os.path.join(tempfile.mkdtemp(), 'watermark.json')
+		self.watermark = CrawlWatermark.load(self.path)
+		self.args = Namespace(workers=3, video_limit=None, page_limit=None, retry_count=1, force_download_video=False)
+		self.downloader = FakeDownloader([f'https://www.helixstudios.com/members/videos/v{n}/' for n in range(6)],
+										 self.watermark)
+
+		# the videos aren't really downloaded
+		self.stored_during_download = []
+		self.failing = None
+		self.not_downloaded = set()
+
+		def download_video_url(video_url, args, settings, downloader, video_number):
+			time.sleep(0.05)
+			self.stored_during_download.append(os.path.isfile(self.path))
+			if video_url == self.failing:
+				raise RuntimeError('download failed')
+			return video_url not in self.not_downloaded
+
+		for name, fake in (('download_video_url', download_video_url),
+						   ('video_already_downloaded', lambda *args: False),
+						   ('log', logging.getLogger('helixstudios'))):
+			self.addCleanup(setattr, cli, name, getattr(cli, name))
+			setattr(cli, name, fake)
+
+	def test_stored_after_downloads(self):
+		'''The watermark is only stored once every video has been downloaded'''
+
+		download_concurrently(self.args, None, self.downloader, self.watermark)
+
+		self.assertEqual(self.stored_during_download, [False] * 6)
+		self.assertEqual(CrawlWatermark.load(self.path).newest, self.downloader.links[0])
+
+	def test_failed_download(self):
+		'''A run that fails doesn't store the watermark'''
+
+		self.failing = self.downloader.links[-1]
+		with self.assertRaises(RuntimeError):
+			download_concurrently(self.args, None, self.downloader, self.watermark)
+
+		self.assertFalse(os.path.isfile(self.path))
+
+	def assertOnlyDownloadedStored(self):
+		watermark = CrawlWatermark.load(self.path)
+		for link in self.downloader.links:
+			if link in self.not_downloaded:
+				self.assertNotIn(link, watermark)
+			else:
+				self.assertIn(link, watermark)
+
+	def test_video_not_downloaded(self):
+		'''A video that isn't downloaded is left out of the watermark, the next crawl hands it out again'''
+
+		self.not_downloaded = {self.downloader.links[0], self.downloader.links[3]}
+		download_concurrently(self.args, None, self.downloader, self.watermark)
+
+		self.assertOnlyDownloadedStored()
+
+	def test_video_not_downloaded_serial(self):
+		'''Also when the videos are downloaded one at a time'''
+
+		self.args.workers = 1
+		self.args.incremental = True
+		self.args.rebuild_index = False
+
+		self.not_downloaded = {self.downloader.links[2]}
+		download_videos(self.args, None, self.downloader)
+
+		self.assertOnlyDownloadedStored()
+
+
+if __name__ == '__main__':
+	unittest.main()
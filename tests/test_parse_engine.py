@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+'''Test that every parser engine finds the same things in a page.'''
+
+import unittest
+
+from helixstudios import VideoPage
+from helixstudios.parse_utils import Page, flatten_html
+from helixstudios.parse_utils import Tag, TagClass, TagClassAttr, TagId, TagIdAttr
+from helixstudios.parse_utils import search_rule, find_dispatch, find_in_one_pass
+from helixstudios.parse_engine import ENGINES
+from helixstudios.parse_engine import engine_available
+from helixstudios.parse_engine import set_default_engine
+from helixstudios.parse_engine import default_engine
+from helixstudios.parse_engine import is_comment
+from helixstudios.parse_engine import parse_document
+
+
+PAGE_URL = 'https://www.helixstudios.com/members/videos/video-00001-example-scene/'
+
+PAGE = '''<!DOCTYPE html>
+<html>
+<head><title>Example &amp; scene</title></head>
+<body>
+	<div class="video-header">
+		<img id="titleImage" src="/banners/1.jpg">
+		<h1>Example <em>scene</em> 1</h1>
+		<div class="info-items">
+			<span class="info-item date">Jan 31st, 2015</span>
+			<span class="info-item director">Director Someone</span>
+			<!-- <span class="info-item views">12.3k views</span> -->
+		</div>
+	</div>
+	<div class="description-content"><p>First paragraph.</p><p>Second paragraph.</p></div>
+	<div class="video-cast">
+		<a href="/members/models/a/" class="thumbnail-link" title="A"><img class="pure-img lazyload thumbnail-img" src="/a.jpg"></a>
+		<a href="/members/models/b/" class="thumbnail-link" title="B"><img class="pure-img lazyload thumbnail-img" src="/b.jpg"></a>
+	</div>
+	<div class="downloads-link-wrapper"><a href="/d?s=360"><span>360p</span></a><a href="/d?s=720"><span>720p</span></a></div>
+	</span>
+	<p class="broken">unclosed <b>bold
+	<div class="after">after the broken markup</div>
+</body>
+</html>'''
+
+
+def available_engines():
+	return [engine for engine in ENGINES if engine_available(engine)]
+
+
+class ParserEngineTestCase(unittest.TestCase):
+
+	def pages(self):
+		return {engine: Page(PAGE, PAGE_URL, engine=engine) for engine in available_engines()}
+
+	def assertSameOnEveryEngine(self, lookup):
+		results = {engine: lookup(page) for engine, page in self.pages().items()}
+		for engine, result in results.items():
+			self.assertEqual(result, results['html.parser'], engine)
+		return results['html.parser']
+
+	def test_tag(self):
+		title = self.assertSameOnEveryEngine(lambda page: page.find(Tag('title')).string)
+		self.assertEqual(title, 'Example & scene')
+
+	def test_tag_id_attr(self):
+		src = self.assertSameOnEveryEngine(lambda page: page.find(TagIdAttr('img', 'titleImage', 'src')))
+		self.assertEqual(src, '/banners/1.jpg')
+		self.assertSameOnEveryEngine(lambda page: page.find(TagId('img', 'missing')))
+
+	def test_one_of_several_classes(self):
+		date = self.assertSameOnEveryEngine(lambda page: page.find(TagClass('span', 'date')).string)
+		self.assertEqual(date, 'Jan 31st, 2015')
+
+		# all the classes as written match too, but not in another order
+		self.assertSameOnEveryEngine(lambda page: page.find(TagClass('span', 'info-item director')).string)
+		self.assertSameOnEveryEngine(lambda page: page.find(TagClass('span', 'director info-item')))
+
+	def test_find_all_attr(self):
+		links = self.assertSameOnEveryEngine(lambda page: page.find_all(TagClassAttr('a', 'thumbnail-link', 'href')))
+		self.assertEqual(links, ['/members/models/a/', '/members/models/b/'])
+
+	def test_tuple_of_names(self):
+		'''A tuple passed as the name matches any of its names'''
+
+		def lookup(page):
+			cast = page.find(TagClass('div', 'video-cast'))
+			return [a['href'] for a in cast.find_all(TagClass('a', 'thumbnail-link'))]
+
+		self.assertEqual(self.assertSameOnEveryEngine(lookup), ['/members/models/a/', '/members/models/b/'])
+
+	def test_comments(self):
+		def lookup(page):
+			info = page.find(TagClass('div', 'info-items'))
+			return [str(comment).strip() for comment in info.find_all(string=is_comment)]
+
+		comments = self.assertSameOnEveryEngine(lookup)
+		self.assertEqual(comments, ['<span class="info-item views">12.3k views</span>'])
+
+	def test_flatten_html(self):
+		text = self.assertSameOnEveryEngine(
+			lambda page: flatten_html(page.find(TagClass('div', 'description-content'))))
+		self.assertEqual(text, 'First paragraph.\nSecond paragraph.\n')
+
+	def test_broken_markup(self):
+		'''Stray end tags are ignored, unclosed tags are closed by their parent'''
+
+		after = self.assertSameOnEveryEngine(lambda page: page.find(TagClass('div', 'after')).string)
+		self.assertEqual(after, 'after the broken markup')
+		self.assertSameOnEveryEngine(lambda page: flatten_html(page.page.body))
+
+	def test_video_page(self):
+		details = {engine: VideoPage(PAGE, PAGE_URL, engine=engine).details_dictionary()
+				   for engine in available_engines()}
+		for engine, result in details.items():
+			self.assertEqual(result, details['html.parser'], engine)
+
+	def test_strained_video_page(self):
+		'''Only the sections are parsed, and everything is found the same'''
+
+		for engine in available_engines():
+			whole = VideoPage(PAGE, PAGE_URL, engine=engine, strain=False)
+			strained = VideoPage(PAGE, PAGE_URL, engine=engine)
+
+			self.assertEqual(strained.details_dictionary(), whole.details_dictionary(), engine)
+			self.assertEqual(strained.webpage_title, 'Example & scene')
+			self.assertIsNone(strained.find(TagClass('div', 'after')))
+			self.assertIsNotNone(whole.find(TagClass('div', 'after')))
+
+	def test_section_closed_by_its_parent(self):
+		'''A section left open ends with the tag around it, as in the whole page'''
+
+		text = '<div class="outer"><p class="keep">kept<b>bold</div><p class="keep">second</p>'
+		sections = [search_rule(TagClass('p', 'keep'))]
+
+		whole = [flatten_html(p) for p in Page(text, PAGE_URL, engine='lightweight').find_all(TagClass('p', 'keep'))]
+		strained = parse_document(text, 'lightweight', sections).find_all('p')
+		self.assertEqual([flatten_html(p) for p in strained], whole)
+		self.assertEqual(whole, ['keptbold\n', 'second\n'])
+
+	def test_one_pass(self):
+		'''The lookups read from one walk of the tree find what a search of each finds'''
+
+		for engine in available_engines():
+			page = VideoPage(PAGE, PAGE_URL, engine=engine)
+			for search_obj in VideoPage.SECTIONS:
+				self.assertEqual(page.find(search_obj), find_dispatch(page.page.find, search_obj))
+				self.assertEqual(page.find_all(search_obj), list(find_dispatch(page.page.find_all, search_obj)))
+
+	def test_one_pass_equal_search_objects(self):
+		'''Search objects of different types are kept apart, even when their values are equal'''
+
+		text = '<a class="next">class</a><a id="next">id</a>'
+		for engine in available_engines():
+			found = find_in_one_pass(parse_document(text, engine), [TagClass('a', 'next'), TagId('a', 'next')])
+			self.assertEqual([[a.string for a in tags] for tags in found.values()], [['class'], ['id']])
+
+	def test_default_engine(self):
+		self.addCleanup(set_default_engine, default_engine())
+
+		set_default_engine('lightweight')
+		self.assertEqual(Page(PAGE, PAGE_URL).find(Tag('h1')).name, 'h1')
+
+		with self.assertRaises(ValueError):
+			set_default_engine('html5lib')
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -49,6 +49,24 @@ class M3U8StreamTestCase(unittest.TestCase):
 		self.assertGreater(len(links), 50)
 
 		self.assertTrue(all([l.startswith('https://media.helixstudios.com/scenes/') for l in links]))
+
+
+class M3U8StreamDurationTestCase(unittest.TestCase):
+	'''A test case for streams with segments of different lengths'''
+
+	def test_all_durations(self):
+		'''The last segment is usually shorter, make sure it isn't skipped'''
+
+		text = ('#EXTM3U\n#EXT-X-TARGETDURATION:9\n'
+				'#EXTINF:9,\nseg-0.ts\n#EXTINF:9,\nseg-1.ts\n#EXTINF:4.52,\nseg-2.ts\n'
+				'#EXT-X-ENDLIST\n')
+		stream = M3U8Stream(text, 'https://www.helixstudios.com/m3u8/child-1234-0.m3u8')
+
+		self.assertEqual(stream.all_chunks(), [
+			'https://www.helixstudios.com/m3u8/seg-0.ts',
+			'https://www.helixstudios.com/m3u8/seg-1.ts',
+			'https://www.helixstudios.com/m3u8/seg-2.ts',
+		])
 		
 
 if __name__ == '__main__':
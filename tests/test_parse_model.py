@@ -8,6 +8,7 @@ import unittest
 
 
 from helixstudios import ModelPage
+from helixstudios.parse_engine import engine_available
 
 from download_samples import sample_path, VIDEO_LISTING_URL
 
@@ -15,11 +16,14 @@ from download_samples import sample_path, VIDEO_LISTING_URL
 class ModelPageTestCase(unittest.TestCase):
 	'''A test case for checking the VideoListingPage class'''
 
+	# the parser engine, None for the default
+	engine = None
+
 	def setUp(self):
 		with open(sample_path('model.html')) as f:
 			text = f.read()
 
-		self.mp = ModelPage(text, VIDEO_LISTING_URL)
+		self.mp = ModelPage(text, VIDEO_LISTING_URL, engine=self.engine)
 
 	def test_name(self):
 		'''Ensure the model name is correctly extracted'''
@@ -34,5 +38,14 @@ class ModelPageTestCase(unittest.TestCase):
 		pprint.pprint(self.mp.stats)
 
 
+@unittest.skipUnless(engine_available('lxml'), 'lxml is not installed')
+class ModelPageLxmlTestCase(ModelPageTestCase):
+	engine = 'lxml'
+
+
+class ModelPageLightweightTestCase(ModelPageTestCase):
+	engine = 'lightweight'
+
+
 if __name__ == '__main__':
-	unittest.main()
\ No newline at end of file
+	unittest.main()
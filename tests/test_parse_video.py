@@ -10,6 +10,7 @@ import unittest
 
 from helixstudios import VideoPage
 from helixstudios import date_text_to_date_object
+from helixstudios.parse_engine import engine_available
 
 from download_samples import sample_path, VIDEO_LISTING_URL
 
@@ -17,11 +18,14 @@ from download_samples import sample_path, VIDEO_LISTING_URL
 class VideoPageTestCase(unittest.TestCase):
 	'''A test case for checking the VideoListingPage class'''
 
+	# the parser engine, None for the default
+	engine = None
+
 	def setUp(self):
 		with open(sample_path('video.html')) as f:
 			text = f.read()
 
-		self.vp = VideoPage(text, VIDEO_LISTING_URL)
+		self.vp = VideoPage(text, VIDEO_LISTING_URL, engine=self.engine)
 
 	def test_date_text_to_date_object(self):
 		'''Conversion of date text to date object'''
@@ -148,10 +152,14 @@ class VideoPageTestCase(unittest.TestCase):
 		json.dumps(self.vp.details_dictionary())
 
 
-
-if __name__ == '__main__':
-	unittest.main()
+@unittest.skipUnless(engine_available('lxml'), 'lxml is not installed')
+class VideoPageLxmlTestCase(VideoPageTestCase):
+	engine = 'lxml'
 
 
+class VideoPageLightweightTestCase(VideoPageTestCase):
+	engine = 'lightweight'
 
 
+if __name__ == '__main__':
+	unittest.main()
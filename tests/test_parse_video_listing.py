@@ -6,6 +6,8 @@ the parser extracts all the needed information.'''
 import unittest
 
 from helixstudios import VideoListingPage
+from helixstudios.parse_video_listing import VideoLinkParser
+from helixstudios.parse_engine import engine_available
 
 from download_samples import sample_path, VIDEO_LISTING_URL
 
@@ -13,11 +15,14 @@ from download_samples import sample_path, VIDEO_LISTING_URL
 class VideoListingPageTestCase(unittest.TestCase):
 	'''A test case for checking the VideoListingPage class'''
 
+	# the parser engine, None for the default
+	engine = None
+
 	def setUp(self):
 		with open(sample_path('video_listing.html')) as f:
 			text = f.read()
 
-		self.vlp = VideoListingPage(text, VIDEO_LISTING_URL)
+		self.vlp = VideoListingPage(text, VIDEO_LISTING_URL, engine=self.engine)
 
 	def test_link_parsing(self):
 		'''Ensure the parser picks out all video links'''
@@ -36,5 +41,72 @@ class VideoListingPageTestCase(unittest.TestCase):
 		print(self.vlp.webpage_title)
 
 
+class VideoLinkParserTestCase(unittest.TestCase):
+	'''A test case for reading the video links while the page arrives'''
+
+	PAGE = ('<html><body><a class="first" href="/members/videos/">First</a>' +
+			''.join(f'<div class="thumbnail"><a class="thumbnail-link" href="/members/videos/v{n}/">'
+					f'<img src="/v{n}.jpg"></a></div>' for n in range(10)) +
+			'<a class="next" href="//www.helixstudios.com/members/videos/?p=2">Next</a></body></html>')
+
+	def test_same_links_in_pieces(self):
+		'''The links found in small pieces of the page are the ones found in the whole page'''
+
+		handed_out = []
+		parser = VideoLinkParser(on_link=handed_out.append)
+		parser.start(VIDEO_LISTING_URL)
+		for i in range(0, len(self.PAGE), 7):
+			parser.feed(self.PAGE[i:i + 7])
+		parser.close()
+
+		page = VideoListingPage(self.PAGE, VIDEO_LISTING_URL)
+		self.assertEqual(handed_out, page.all_videos())
+		self.assertEqual(parser.links, page.all_videos())
+		self.assertEqual(parser.next_page, page.next_page)
+
+	def test_restart(self):
+		'''Reading the page again doesn't hand out the same links twice'''
+
+		handed_out = []
+		parser = VideoLinkParser(on_link=handed_out.append)
+		parser.start(VIDEO_LISTING_URL)
+		parser.feed(self.PAGE[:len(self.PAGE) // 2])
+
+		parser.start(VIDEO_LISTING_URL)
+		parser.feed(self.PAGE)
+		parser.close()
+
+		self.assertEqual(handed_out, parser.links)
+		self.assertEqual(len(handed_out), 10)
+
+	def test_restart_changed_page(self):
+		'''A page that changed before it was read again hands out each link once, new ones included'''
+
+		handed_out = []
+		parser = VideoLinkParser(on_link=handed_out.append)
+		parser.start(VIDEO_LISTING_URL)
+		parser.feed(self.PAGE[:len(self.PAGE) // 2])
+
+		# a new video was published at the top of the listing
+		new_video = '<a class="thumbnail-link" href="/members/videos/v10/"></a>'
+		changed = self.PAGE.replace('<div class="thumbnail">', new_video + '<div class="thumbnail">', 1)
+
+		parser.start(VIDEO_LISTING_URL)
+		parser.feed(changed)
+		parser.close()
+
+		self.assertEqual(sorted(handed_out), sorted(parser.links))
+		self.assertEqual(len(handed_out), 11)
+
+
+@unittest.skipUnless(engine_available('lxml'), 'lxml is not installed')
+class VideoListingPageLxmlTestCase(VideoListingPageTestCase):
+	engine = 'lxml'
+
+
+class VideoListingPageLightweightTestCase(VideoListingPageTestCase):
+	engine = 'lightweight'
+
+
 if __name__ == '__main__':
-	unittest.main()
\ No newline at end of file
+	unittest.main()
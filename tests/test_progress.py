@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+'''Test the progress aggregator and its throughput averages.'''
+
+import os
+import json
+import unittest
+import tempfile
+
+from helixstudios.progress import Throughput
+from helixstudios.progress import ProgressAggregator
+from helixstudios.progress import format_eta
+
+
+MB = 1024 * 1024
+
+
+class ThroughputTestCase(unittest.TestCase):
+	'''A test case for the moving average of the throughput'''
+
+	def test_steady_rate(self):
+		'''A steady rate is reported straight away, however the chunks arrive'''
+
+		throughput = Throughput(time_constant=10.0, now=0.0)
+		for i in range(1, 11):
+			throughput.update(MB, now=i * 0.1)
+
+		# 10MB/s after just one second, without waiting for the average to warm up
+		self.assertAlmostEqual(throughput.rate(now=1.0) / MB, 10.0, delta=0.5)
+
+		# many chunks at once count the same as one big chunk
+		bursty = Throughput(time_constant=10.0, now=0.0)
+		for _ in range(10):
+			bursty.update(MB, now=1.0)
+		self.assertAlmostEqual(bursty.rate(now=1.0), throughput.rate(now=1.0), delta=MB)
+
+	def test_stalled(self):
+		'''The rate falls away once no more bytes arrive'''
+
+		throughput = Throughput(time_constant=2.0, now=0.0)
+		for i in range(1, 101):
+			throughput.update(MB, now=i * 0.1)
+
+		self.assertAlmostEqual(throughput.rate(now=10.0) / MB, 10.0, delta=0.5)
+		self.assertLess(throughput.rate(now=20.0), 0.1 * MB)
+
+
+class ProgressAggregatorTestCase(unittest.TestCase):
+	'''A test case for collecting the progress of several transfers'''
+
+	def setUp(self):
+		self._folder = tempfile.TemporaryDirectory()
+		self.status_file = os.path.join(self._folder.name, 'status.json')
+
+	def tearDown(self):
+		self._folder.cleanup()
+
+	def test_status(self):
+		'''The status covers each transfer, and all of them together'''
+
+		progress = ProgressAggregator(status_file=self.status_file, printing=False)
+
+		with progress.transfer('a.mp4', total=100, done=20) as a, progress.transfer('stream.mp4') as b:
+			a.add(30)
+			b.add(10)
+
+			progress.report()
+			with open(self.status_file) as f:
+				status = json.load(f)
+
+		self.assertEqual(status['active'], 2)
+		self.assertEqual(status['downloaded'], 40)
+		self.assertEqual(status['percent'], 50.0)
+		self.assertEqual([t['name'] for t in status['transfers']], ['a.mp4', 'stream.mp4'])
+		self.assertEqual(status['transfers'][0]['done'], 50)
+		self.assertIsNone(status['transfers'][1]['percent'])
+
+		status = progress.status()
+		self.assertEqual(status['active'], 0)
+		self.assertEqual(status['completed'], 2)
+
+	def test_format_eta(self):
+		self.assertEqual(format_eta(75), '1:15')
+		self.assertEqual(format_eta(3725), '1:02:05')
+		self.assertEqual(format_eta(None), '?')
+
+
+if __name__ == '__main__':
+	unittest.main()
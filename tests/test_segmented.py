@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+'''Test the byte range splitting and the sidecar used by segmented downloads.'''
+
+import os
+import unittest
+import tempfile
+
+from helixstudios.segmented import RangeSidecar
+from helixstudios.segmented import split_ranges, range_header, parse_content_range
+
+
+MB = 1024 * 1024
+
+
+class SplitRangesTestCase(unittest.TestCase):
+	'''A test case for splitting a file into byte ranges'''
+
+	def test_ranges_cover_file(self):
+		'''Make sure the ranges are contiguous and cover the whole file'''
+
+		ranges = split_ranges(100 * MB + 7, 4)
+		self.assertEqual(len(ranges), 4)
+		self.assertEqual(ranges[0][0], 0)
+		self.assertEqual(ranges[-1][1], 100 * MB + 6)
+
+		for (_, end), (start, _) in zip(ranges, ranges[1:]):
+			self.assertEqual(end + 1, start)
+
+	def test_small_file(self):
+		'''Small files shouldn't be split into tiny ranges'''
+
+		self.assertEqual(split_ranges(1000, 8), [(0, 999)])
+		self.assertEqual(split_ranges(0, 8), [])
+
+	def test_range_header(self):
+		'''Make sure the range header is formatted correctly'''
+
+		self.assertEqual(range_header(10, 20), {'Range': 'bytes=10-20'})
+		self.assertEqual(range_header(10), {'Range': 'bytes=10-'})
+
+	def test_parse_content_range(self):
+		'''The file size comes from the "Content-Range" response header'''
+
+		self.assertEqual(parse_content_range('bytes 0-99/1234'), (0, 99, 1234))
+		self.assertEqual(parse_content_range('bytes */1234'), (None, None, 1234))
+		self.assertEqual(parse_content_range('bytes 0-99/*'), (0, 99, None))
+		self.assertIsNone(parse_content_range(None))
+		self.assertIsNone(parse_content_range('items 0-1/2'))
+
+
+class RangeSidecarTestCase(unittest.TestCase):
+	'''A test case for the range sidecar file'''
+
+	def setUp(self):
+		self.path = os.path.join(tempfile.mkdtemp(), 'video.mp4.part.ranges')
+
+	def test_resume(self):
+		'''Make sure recorded progress survives a reload from disk'''
+
+		sidecar = RangeSidecar.create(self.path, 64 * MB, 4)
+		sidecar.record(1, 1000)
+		sidecar.store()
+
+		loaded = RangeSidecar.load(self.path, 64 * MB)
+		self.assertEqual(loaded.bytes_written, 1000)
+		self.assertFalse(loaded.complete)
+
+		pending = loaded.pending()
+		self.assertEqual(len(pending), 4)
+		self.assertEqual(pending[1], (1, 16 * MB + 1000, 32 * MB - 1))
+
+	def test_complete(self):
+		'''Completed ranges are no longer pending'''
+
+		sidecar = RangeSidecar.create(self.path, 32 * MB, 2)
+		sidecar.record(0, 16 * MB)
+		self.assertEqual([p[0] for p in sidecar.pending()], [1])
+
+		sidecar.record(1, 16 * MB)
+		self.assertTrue(sidecar.complete)
+		self.assertEqual(sidecar.pending(), [])
+
+	def test_different_filesize(self):
+		'''A sidecar for a different file size must not be used'''
+
+		RangeSidecar.create(self.path, 32 * MB, 2)
+		self.assertIsNone(RangeSidecar.load(self.path, 33 * MB))
+		self.assertIsNone(RangeSidecar.load(self.path + '.missing', 32 * MB))
+
+		# without a file size, the sidecar says how big the file is
+		self.assertEqual(RangeSidecar.load(self.path).filesize, 32 * MB)
+
+
+if __name__ == '__main__':
+	unittest.main()
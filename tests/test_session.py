@@ -0,0 +1,578 @@
+#!/usr/bin/env python3
+
+'''Test the session when it's shared by several threads.'''
+
+import os
+import re
+import time
+import hashlib
+import tempfile
+import threading
+import unittest
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests.cookies
+import requests.exceptions
+
+from helixstudios import SettingsContainer
+from helixstudios import VideoListingPage
+from helixstudios.cache import ResponseCache
+from helixstudios import session as session_module
+from helixstudios.session import HelixSession
+from helixstudios.session import LoggedOut
+from helixstudios.session import PAGE_CHUNK_SIZE
+from helixstudios.parse_video_listing import VideoLinkParser
+from helixstudios.segmented import RangeSidecar
+from helixstudios.segmented import sidecar_path
+from helixstudios.vod import SegmentJournal
+from helixstudios.vod import journal_path
+
+
+MEMBERS_URL = 'https://www.helixstudios.com/members/'
+PAGE_URL = 'https://www.helixstudios.com/members/videos/'
+
+
+class FakeResponse:
+	def __init__(self, url, status_code):
+		self.url = url
+		self.status_code = status_code
+		self.text = f'<html>{status_code}</html>'
+		self.content = self.text.encode()
+		self.headers = {}
+		self.closed = False
+
+	def close(self):
+		self.closed = True
+
+
+class FakeRequestsSession:
+	'''Stands in for requests.Session, pages need the login cookie'''
+
+	def __init__(self):
+		self.cookies = requests.cookies.RequestsCookieJar()
+		self.headers = {}
+		self.logins = 0
+		self.refuse_login = False
+		self.login_times_out = False
+		self._lock = threading.Lock()
+
+	def get(self, url, **kwargs):
+		self.last_headers = kwargs.get('headers')
+
+		if url == MEMBERS_URL and kwargs.get('auth'):
+			time.sleep(0.05)
+			with self._lock:
+				self.logins += 1
+			if self.login_times_out:
+				raise requests.exceptions.ReadTimeout('login timed out')
+			if self.refuse_login:
+				return FakeResponse(url, 401)
+			self.cookies.set('session', str(self.logins), expires=int(time.time()) + 3600)
+			return FakeResponse(url, 200)
+
+		logged_in = 'session' in self.cookies
+		time.sleep(0.01)
+		return FakeResponse(url.replace('/redirect/', '/final/'), 200 if logged_in else 401)
+
+
+class SingleFlightLoginTestCase(unittest.TestCase):
+	'''A test case for logging in again with concurrent requests'''
+
+	def setUp(self):
+		self._folder = tempfile.TemporaryDirectory()
+		self.settings = SettingsContainer({
+			'session': os.path.join(self._folder.name, 'session.json'),
+			'session_refresh_margin': 0,
+			'links': {'members': MEMBERS_URL}
+		})
+
+		self.session = HelixSession(self.settings, start_session=False)
+		self.fake = FakeRequestsSession()
+		self.session._session = self.fake
+
+	def tearDown(self):
+		self.session.close()
+		self._folder.cleanup()
+
+	def test_one_login_for_concurrent_requests(self):
+		'''Requests that all fail at once should only log in once'''
+
+		results = []
+		threads = [threading.Thread(target=lambda: results.append(self.session.get(PAGE_URL, retries=3)[0]))
+				   for _ in range(8)]
+
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+
+		self.assertEqual(results, [200] * 8)
+		self.assertEqual(self.fake.logins, 1)
+
+	def test_one_failed_login_for_concurrent_requests(self):
+		'''Requests waiting for a login that fails don't each log in again'''
+
+		self.fake.refuse_login = True
+
+		failures = []
+		def request():
+			try:
+				self.session.get(PAGE_URL, retries=1)
+			except RuntimeError:
+				failures.append(True)
+
+		threads = [threading.Thread(target=request) for _ in range(8)]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+
+		self.assertEqual(len(failures), 8)
+		self.assertEqual(self.fake.logins, 1)
+
+	def test_login_timeout(self):
+		'''A login request that times out is a failed login, it doesn't escape the request'''
+
+		self.fake.login_times_out = True
+
+		failures = []
+		def request():
+			try:
+				self.session.get(PAGE_URL, retries=1)
+			except RuntimeError:
+				failures.append(True)
+
+		threads = [threading.Thread(target=request) for _ in range(8)]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+
+		self.assertEqual(len(failures), 8)
+		self.assertEqual(self.fake.logins, 1)
+
+	def test_refresher_survives_login_timeout(self):
+		'''The background refresh keeps going after a login request that timed out'''
+
+		self.addCleanup(setattr, session_module, 'REFRESH_CHECK_EVERY', session_module.REFRESH_CHECK_EVERY)
+		session_module.REFRESH_CHECK_EVERY = 0.01
+
+		self.fake.login_times_out = True
+		self.fake.cookies.set('session', '0', expires=int(time.time()) + 10)
+
+		refresher = threading.Thread(target=self.session._session_refresher, args=(300,), daemon=True)
+		refresher.start()
+
+		def wait_for_logins(count):
+			deadline = time.time() + 5
+			while self.fake.logins < count and time.time() < deadline:
+				time.sleep(0.01)
+
+		wait_for_logins(1)
+		self.assertTrue(refresher.is_alive())
+
+		# the cookies change, and the next refresh works
+		self.fake.login_times_out = False
+		self.fake.cookies.set('session', '0', expires=int(time.time()) + 20)
+		wait_for_logins(2)
+		self.assertEqual(self.fake.logins, 2)
+
+	def test_cookies_kept_until_login(self):
+		'''The cookies are only replaced by a login that succeeds'''
+
+		self.fake.cookies.set('session', 'old')
+
+		for failure in ('refuse_login', 'login_times_out'):
+			setattr(self.fake, failure, True)
+			with self.assertRaises((RuntimeError, requests.exceptions.RequestException)):
+				self.session.login()
+			self.assertEqual(self.session.cookies['session'], 'old')
+			setattr(self.fake, failure, False)
+
+		self.session.login()
+		self.assertEqual(self.session.cookies['session'], str(self.fake.logins))
+
+	def test_session_expiry(self):
+		'''The session expires with its first cookie'''
+
+		self.assertIsNone(self.session._session_expiry())
+
+		self.fake.cookies.set('a', '1', expires=2000)
+		self.fake.cookies.set('b', '2', expires=1000)
+		self.assertEqual(self.session._session_expiry(), 1000)
+
+
+class StatelessRequestTestCase(unittest.TestCase):
+	'''A test case for requests that keep no state on the session'''
+
+	def setUp(self):
+		self._folder = tempfile.TemporaryDirectory()
+		self.session = HelixSession(SettingsContainer({
+			'session': os.path.join(self._folder.name, 'session.json'),
+			'links': {'members': MEMBERS_URL}
+		}), start_session=False)
+
+		self.fake = FakeRequestsSession()
+		self.fake.cookies.set('session', 'valid')
+		self.session._session = self.fake
+
+	def tearDown(self):
+		self.session.close()
+		self._folder.cleanup()
+
+	def test_fetch(self):
+		'''The response carries the final URL, and the range is only sent with the one request'''
+
+		response = self.session.fetch('https://www.helixstudios.com/redirect/1', byte_range=(10, None))
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response.url, 'https://www.helixstudios.com/final/1')
+		self.assertEqual(self.fake.last_headers, {'Range': 'bytes=10-'})
+		self.assertEqual(self.fake.headers, {})
+
+		self.session.fetch(PAGE_URL)
+		self.assertEqual(self.fake.last_headers, {})
+
+	def test_evicted_from_cache(self):
+		'''A cached page evicted after it was looked up is requested again'''
+
+		self.session._cache = ResponseCache(os.path.join(self._folder.name, 'cache'), ttls=[('/members/', 60)])
+		self.session.fetch(PAGE_URL)
+
+		cache = self.session.response_cache
+		entry = cache.lookup(PAGE_URL)
+		cache._remove(entry.key)
+		cache.lookup = lambda url: entry
+
+		response = self.session.fetch(PAGE_URL)
+		self.assertEqual(response.text, '<html>200</html>')
+		self.assertFalse(response.from_cache)
+
+	def test_last_url_per_thread(self):
+		'''Each thread sees the final URL of its own last request'''
+
+		urls = {}
+		def worker(n):
+			for _ in range(5):
+				self.session.get(f'https://www.helixstudios.com/redirect/{n}')
+				urls.setdefault(n, set()).add(self.session.last_url)
+
+		threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+
+		self.assertEqual(urls, {n: {f'https://www.helixstudios.com/final/{n}'} for n in range(4)})
+
+
+class SlowListingHandler(BaseHTTPRequestHandler):
+	'''Sends the first pieces of a listing page, then waits for the test to
+	see a video link in them before sending the rest'''
+
+	protocol_version = 'HTTP/1.1'
+
+	PAGE = ('<html><head><title>Videos</title><style>' + ' ' * int(1.5 * PAGE_CHUNK_SIZE) + '</style></head><body>' +
+			''.join(f'<a class="thumbnail-link" href="/members/videos/v{n}/">{n}</a>' for n in range(200)) +
+			'<a class="next" href="//www.helixstudios.com/members/videos/?p=2">Next</a></body></html>')
+
+	def log_message(self, *args):
+		pass
+
+	def do_GET(self):
+		body = self.PAGE.encode()
+		split = body.index(b'<a', 2 * PAGE_CHUNK_SIZE)
+
+		self.send_response(200)
+		self.send_header('Content-Type', 'text/html; charset=utf-8')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+
+		self.wfile.write(body[:split])
+		self.wfile.flush()
+		self.server.released = self.server.first_link_seen.wait(5)
+		self.wfile.write(body[split:])
+
+
+class StreamedFetchTestCase(unittest.TestCase):
+	'''A test case for parsing pages while they arrive'''
+
+	def setUp(self):
+		self._folder = tempfile.TemporaryDirectory()
+		self.session = HelixSession(SettingsContainer({
+			'username': 'user',
+			'password': 'password',
+			'session': os.path.join(self._folder.name, 'session.json'),
+			'links': {'members': MEMBERS_URL}
+		}), start_session=False)
+
+		self.server = ThreadingHTTPServer(('127.0.0.1', 0), SlowListingHandler)
+		self.server.first_link_seen = threading.Event()
+		self.server.released = None
+		threading.Thread(target=self.server.serve_forever, daemon=True).start()
+		self.url = f'http://127.0.0.1:{self.server.server_port}/members/videos/'
+
+	def tearDown(self):
+		self.server.shutdown()
+		self.server.server_close()
+		self.session.close()
+		self._folder.cleanup()
+
+	def test_links_before_the_page_is_in(self):
+		'''The first link is handed out while the rest of the page is still to come'''
+
+		links = []
+		def on_link(link):
+			links.append(link)
+			self.server.first_link_seen.set()
+
+		response = self.session.fetch(self.url, parser=VideoLinkParser(on_link=on_link))
+
+		self.assertTrue(self.server.released)
+		self.assertEqual(response.text, SlowListingHandler.PAGE)
+
+		page = VideoListingPage(response.text, response.url)
+		self.assertEqual(links, page.all_videos())
+		self.assertEqual(len(links), 200)
+
+
+class FileHandler(BaseHTTPRequestHandler):
+	'''Serves the bytes of the server's file, honouring the "Range" header'''
+
+	protocol_version = 'HTTP/1.1'
+
+	def log_message(self, *args):
+		pass
+
+	def do_GET(self):
+		data = self.server.data
+		self.server.requests += 1
+
+		# the session can be logged out
+		if self.server.unauthorized > 0:
+			self.server.unauthorized -= 1
+			return self._send(401, b'')
+		byte_range = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+
+		if byte_range is None:
+			return self._send(200, data)
+
+		start = int(byte_range.group(1))
+		end = min(int(byte_range.group(2)) if byte_range.group(2) else len(data) - 1, len(data) - 1)
+		if start >= len(data):
+			return self._send(416, b'', {'Content-Range': f'bytes */{len(data)}'})
+
+		self._send(206, data[start:end + 1], {'Content-Range': f'bytes {start}-{end}/{len(data)}'})
+
+	def _send(self, status, body, headers=None):
+		self.send_response(status)
+		self.send_header('Content-Length', str(len(body)))
+		for name, value in (headers or {}).items():
+			self.send_header(name, value)
+		self.end_headers()
+
+		# the connection can be cut off halfway through the body
+		if self.server.drops > 0:
+			self.server.drops -= 1
+			self.wfile.write(body[:len(body) // 2])
+			self.close_connection = True
+			return
+
+		self.wfile.write(body)
+
+
+class DownloadTestCase(unittest.TestCase):
+	'''A test case for downloading, and resuming, files from a local server'''
+
+	def setUp(self):
+		self._folder = tempfile.TemporaryDirectory()
+		self.session = HelixSession(SettingsContainer({
+			'username': 'user',
+			'password': 'password',
+			'session': os.path.join(self._folder.name, 'session.json'),
+			'download_segments': 4,
+			'links': {'members': MEMBERS_URL}
+		}), start_session=False)
+
+		self.server = ThreadingHTTPServer(('127.0.0.1', 0), FileHandler)
+		self.server.daemon_threads = True
+		self.server.data = os.urandom(300 * 1024)
+		self.server.drops = 0
+		self.server.unauthorized = 0
+		self.server.requests = 0
+		threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+		self.url = f'http://127.0.0.1:{self.server.server_port}/files/video.mp4'
+		self.path = os.path.join(self._folder.name, 'video.mp4')
+		self.part_path = self.path + '.part'
+
+	def tearDown(self):
+		self.server.shutdown()
+		self.server.server_close()
+		self.session.close()
+		self._folder.cleanup()
+
+	def assertDownloaded(self):
+		with open(self.path, 'rb') as f:
+			self.assertEqual(f.read(), self.server.data)
+		self.assertFalse(os.path.exists(self.part_path))
+		self.assertFalse(os.path.exists(sidecar_path(self.part_path)))
+		self.assertEqual(self.session.last_checksum,
+						 {'sha256': hashlib.sha256(self.server.data).hexdigest(), 'size': len(self.server.data)})
+
+	def test_download(self):
+		self.assertTrue(self.session.download(self.url, self.path, retries=2))
+		self.assertDownloaded()
+
+	def test_complete_but_not_moved(self):
+		'''A download that finished before it was moved into place is moved there'''
+
+		with open(self.part_path, 'wb') as f:
+			f.write(self.server.data)
+		sidecar = RangeSidecar.create(sidecar_path(self.part_path), len(self.server.data), 1)
+		sidecar.record(0, len(self.server.data))
+		sidecar.store()
+
+		self.assertTrue(self.session.download(self.url, self.path, retries=2))
+		self.assertDownloaded()
+
+	def test_full_size_part_without_sidecar(self):
+		'''A partial file as large as the file, without a sidecar, was downloaded before it was moved into place'''
+
+		with open(self.part_path, 'wb') as f:
+			f.write(self.server.data)
+
+		self.assertTrue(self.session.download(self.url, self.path, retries=1))
+		self.assertDownloaded()
+		self.assertEqual(self.server.requests, 1)
+
+	def test_part_larger_than_file(self):
+		'''A partial file larger than the file on the server is downloaded again'''
+
+		with open(self.part_path, 'wb') as f:
+			f.write(b'\0' * (len(self.server.data) + 10))
+
+		self.assertTrue(self.session.download(self.url, self.path, retries=3))
+		self.assertDownloaded()
+
+	def test_resume(self):
+		'''A partial file without a sidecar is resumed where it ends'''
+
+		with open(self.part_path, 'wb') as f:
+			f.write(self.server.data[:1000])
+
+		self.assertTrue(self.session.download(self.url, self.path, retries=2))
+		self.assertDownloaded()
+
+	def test_sidecar_without_part(self):
+		'''A download that stopped before the file was preallocated resumes from its sidecar'''
+
+		RangeSidecar.create(sidecar_path(self.part_path), len(self.server.data), 4, min_segment_size=1024)
+
+		self.assertTrue(self.session.download(self.url, self.path, retries=2))
+		self.assertDownloaded()
+
+	def test_retried_segment_counted_once(self):
+		'''The bytes of a segment that failed halfway don't count towards the progress'''
+
+		self.server.drops = 1
+		with self.session.bandwidth.transfer('video.mp4') as transfer, \
+				self.session.progress.transfer('video.mp4') as progress:
+			data = self.session._get_segment(self.url, transfer, progress, retries=2)
+
+		self.assertEqual(data, self.server.data)
+		self.assertEqual(progress.done, len(self.server.data))
+
+	def test_logged_out_range_closed(self):
+		'''The response of a byte range that's logged out is closed, so its connection goes back to the pool'''
+
+		resp = FakeResponse(self.url, 401)
+		with self.assertRaises(LoggedOut):
+			self.session._write_range(resp, self.part_path, None, 0, 0, 1023, None, None, None, None, None)
+		self.assertTrue(resp.closed)
+
+	def count_logins(self):
+		self.logins = 0
+
+		def login():
+			self.logins += 1
+		self.session.login = login
+
+	def test_logged_out_download(self):
+		'''A download that's logged out logs in again'''
+
+		self.count_logins()
+		self.server.unauthorized = 1
+
+		self.assertTrue(self.session.download(self.url, self.path, retries=2))
+		self.assertDownloaded()
+		self.assertEqual(self.logins, 1)
+
+	def test_logged_out_segment(self):
+		'''A stream segment that's logged out logs in again'''
+
+		self.count_logins()
+		self.server.unauthorized = 1
+
+		with self.session.bandwidth.transfer('video.mp4') as transfer, \
+				self.session.progress.transfer('video.mp4') as progress:
+			data = self.session._get_segment(self.url, transfer, progress, retries=2)
+
+		self.assertEqual(data, self.server.data)
+		self.assertEqual(self.logins, 1)
+
+	def test_download_waits_for_login(self):
+		'''A download doesn't start while the session is logging in'''
+
+		self.session._login_done.clear()
+		download = threading.Thread(target=self.session.download, args=(self.url, self.path), kwargs={'retries': 2})
+		download.start()
+
+		time.sleep(0.2)
+		self.assertEqual(self.server.requests, 0)
+
+		self.session._login_done.set()
+		download.join()
+		self.assertTrue(os.path.isfile(self.path))
+
+	def test_stream_complete_but_not_moved(self):
+		'''A stream whose segments are all on disk is moved into place'''
+
+		urls = [f'{self.url}?segment={i}' for i in range(3)]
+		self.session._vod_ts_files_for_playlist = lambda url: urls
+
+		with open(self.part_path, 'wb') as f:
+			f.write(self.server.data)
+		journal = SegmentJournal.create(journal_path(self.part_path), urls)
+		for i in range(3):
+			journal.record(i, (i + 1) * len(self.server.data) // 3)
+		journal.close()
+
+		self.assertTrue(self.session.download_vod(self.url, self.path))
+		self.assertDownloaded()
+		self.assertFalse(os.path.exists(journal_path(self.part_path)))
+
+	def test_stream_without_streams(self):
+		'''A playlist with no streams in it fails the download, it doesn't raise'''
+
+		self.server.data = b'#EXTM3U\n'
+		self.assertFalse(self.session.download_vod(self.url, self.path, retries=2))
+		self.assertFalse(os.path.exists(self.path))
+
+	def test_stream_playlist_failed(self):
+		'''A playlist that can't be downloaded fails the download, it doesn't raise'''
+
+		def error_page(url, retries=10):
+			return 500, '<html>500</html>'
+
+		def all_attempts_failed(url, retries=10):
+			raise RuntimeError('all GET request attempts failed')
+
+		for get in (error_page, all_attempts_failed):
+			self.session.get = get
+			self.assertFalse(self.session.download_vod(self.url, self.path, retries=2))
+			self.assertFalse(os.path.exists(self.path))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+'''Test the request timings and their histograms.'''
+
+import os
+import json
+import datetime
+import threading
+import tempfile
+import unittest
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+from helixstudios import SettingsContainer
+from helixstudios.connections import configure_session
+from helixstudios.timing import Histogram
+from helixstudios.timing import RequestTimings
+from helixstudios.timing import classify_url
+
+
+class Handler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+
+	def log_message(self, *args):
+		pass
+
+	def do_GET(self):
+		body = b'x' * 1000
+		self.send_response(200)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+
+class FakeResponse:
+	def __init__(self, status_code, elapsed):
+		self.status_code = status_code
+		self.elapsed = datetime.timedelta(seconds=elapsed)
+
+
+class RequestTimingsTestCase(unittest.TestCase):
+	'''A test case for timing requests by URL class'''
+
+	def setUp(self):
+		self._folder = tempfile.TemporaryDirectory()
+
+	def tearDown(self):
+		self._folder.cleanup()
+
+	def test_classify_url(self):
+		self.assertEqual(classify_url('https://www.helixstudios.com/members/videos/'), 'listing')
+		self.assertEqual(classify_url('https://www.helixstudios.com/members/videos/?p=2'), 'listing')
+		self.assertEqual(classify_url('https://www.helixstudios.com/members/videos/some-video/'), 'video_page')
+		self.assertEqual(classify_url('https://cdn.example.com/stream/index.m3u8?t=1'), 'playlist')
+		self.assertEqual(classify_url('https://cdn.example.com/stream/seg-00001.ts'), 'segment')
+		self.assertEqual(classify_url('https://www.helixstudios.com/members/download-video.php?id=1'), 'download')
+		self.assertEqual(classify_url('https://www.helixstudios.com/'), 'other')
+
+	def test_histogram(self):
+		'''Percentiles are the upper bound of their bucket, capped by the maximum'''
+
+		histogram = Histogram()
+		self.assertIsNone(histogram.percentile(50))
+
+		for seconds in [0.02] * 90 + [3.0] * 10:
+			histogram.add(seconds)
+
+		self.assertEqual(histogram.percentile(50), 0.025)
+		self.assertEqual(histogram.percentile(99), 3.0)
+		self.assertEqual(histogram.summary()['buckets'], {'0.025': 90, '5': 10})
+
+	def test_summary_and_stream(self):
+		'''Every request is counted in its class, and streamed as it finishes'''
+
+		summary_file = os.path.join(self._folder.name, 'timings.json')
+		stream_file = os.path.join(self._folder.name, 'requests.jsonl')
+		timings = RequestTimings(summary_file, stream_file)
+
+		timing = timings.start('https://www.helixstudios.com/members/videos/')
+		timing.response(FakeResponse(200, 0.1))
+		timing.finish(5000)
+
+		timing = timings.start('https://cdn.example.com/seg-1.ts', attempt=1)
+		timing.response(FakeResponse(206, 0.2))
+		timing.add(100)
+		timing.failed(requests.exceptions.ChunkedEncodingError())
+		timing.finish()   # already recorded
+
+		timings.close()
+
+		with open(summary_file) as f:
+			summary = json.load(f)
+
+		self.assertEqual(summary['listing']['requests'], 1)
+		self.assertEqual(summary['listing']['bytes'], 5000)
+		self.assertAlmostEqual(summary['listing']['ttfb']['max'], 0.1)
+		self.assertEqual(summary['segment']['status'], {'206': 1})
+		self.assertEqual(summary['segment']['errors'], {'ChunkedEncodingError': 1})
+		self.assertEqual(summary['segment']['retries'], 1)
+
+		with open(stream_file) as f:
+			records = [json.loads(line) for line in f]
+
+		self.assertEqual([r['class'] for r in records], ['listing', 'segment'])
+		self.assertEqual(records[1]['bytes'], 100)
+
+	def test_connect_time(self):
+		'''A new connection's time is taken out of the time to first byte'''
+
+		server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+		threading.Thread(target=server.serve_forever, daemon=True).start()
+		url = f'http://127.0.0.1:{server.server_port}/'
+
+		try:
+			session = requests.Session()
+			configure_session(session, SettingsContainer({}))
+			timings = RequestTimings()
+
+			for _ in range(2):
+				timing = timings.start(url)
+				resp = session.get(url)
+				timing.response(resp)
+				timing.finish(len(resp.content))
+		finally:
+			server.shutdown()
+			server.server_close()
+
+		summary = timings.summary()['other']
+		self.assertEqual(summary['requests'], 2)
+		self.assertEqual(summary['bytes'], 2000)
+		# the second request reused the connection, plain http has no handshake
+		self.assertEqual(summary['connect']['count'], 1)
+		self.assertEqual(summary['tls']['count'], 0)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -2,10 +2,14 @@
 
 '''A set of unittests for the Settings containers'''
 
+import os
+import tempfile
 import unittest
 
 from helixstudios.utils import dict_diver_set
 from helixstudios.utils import parent_url, localise_url
+from helixstudios.utils import string_to_bytes
+from helixstudios.utils import atomic_write
 
 
 class UtilsTestCase(unittest.TestCase):
@@ -41,6 +45,33 @@ class UtilsTestCase(unittest.TestCase):
 		)
 		self.assertEqual(url, 'https://www.google.com/path/to/my_video.mp4?id=1234567')
 
+	def test_string_to_bytes(self):
+		'''Make sure human readable sizes are converted to bytes'''
+
+		self.assertEqual(string_to_bytes('10MB'), 10 * 1024 * 1024)
+		self.assertEqual(string_to_bytes('1.5 GB'), int(1.5 * 1024 ** 3))
+		self.assertEqual(string_to_bytes('500k'), 500 * 1024)
+		self.assertEqual(string_to_bytes(1234), 1234)
+
+		with self.assertRaises(ValueError):
+			string_to_bytes('10 parsecs')
+
+	def test_atomic_write(self):
+		'''Text and bytes replace the file, and no ".tmp" file is left behind'''
+
+		with tempfile.TemporaryDirectory() as folder:
+			path = os.path.join(folder, 'file.json')
+
+			atomic_write(path, '{"a": 1}')
+			with open(path) as f:
+				self.assertEqual(f.read(), '{"a": 1}')
+
+			atomic_write(path, b'\x00\x01')
+			with open(path, 'rb') as f:
+				self.assertEqual(f.read(), b'\x00\x01')
+
+			self.assertEqual(os.listdir(folder), ['file.json'])
+
 
 if __name__ == '__main__':
-	unittest.main()
\ No newline at end of file
+	unittest.main()
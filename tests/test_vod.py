@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+'''Test the parallel, in-order download of streaming video segments.'''
+
+import io
+import hashlib
+import os
+import time
+import random
+import tempfile
+import threading
+import unittest
+
+from helixstudios.vod import SegmentJournal
+from helixstudios.vod import SegmentReorderBuffer
+from helixstudios.vod import download_segments
+from helixstudios.checksum import PrefixHasher
+
+
+class SegmentReorderBufferTestCase(unittest.TestCase):
+	'''A test case for the segment reorder buffer'''
+
+	def test_out_of_order(self):
+		'''Segments are only written once all earlier segments are written'''
+
+		f = io.BytesIO()
+		buffer = SegmentReorderBuffer(f)
+
+		self.assertEqual(buffer.add(2, b'c'), 0)
+		self.assertEqual(buffer.add(1, b'b'), 0)
+		self.assertEqual(f.getvalue(), b'')
+		self.assertEqual(len(buffer), 2)
+
+		self.assertEqual(buffer.add(0, b'a'), 3)
+		self.assertEqual(f.getvalue(), b'abc')
+		self.assertEqual(buffer.next_index, 3)
+		self.assertEqual(len(buffer), 0)
+
+	def test_hashed_in_order(self):
+		'''Segments are hashed in the order they're written'''
+
+		hasher = PrefixHasher('md5')
+		buffer = SegmentReorderBuffer(io.BytesIO(), hasher=hasher)
+
+		buffer.add(1, b'b')
+		buffer.add(0, b'a')
+		self.assertEqual(hasher.checksum(), {'md5': hashlib.md5(b'ab').hexdigest(), 'size': 2})
+
+
+class DownloadSegmentsTestCase(unittest.TestCase):
+	'''A test case for downloading segments with a pool of workers'''
+
+	def test_order_and_window(self):
+		'''The output is in order, and the writer is never too far behind'''
+
+		urls = [f'segment-{i}' for i in range(100)]
+		lock = threading.Lock()
+		started = []
+
+		def fetch(url):
+			with lock:
+				started.append(int(url.split('-')[1]))
+			time.sleep(random.random() * 0.005)
+			return url.encode() + b'\n'
+
+		f = io.BytesIO()
+		download_segments(fetch, urls, f, workers=4, window=8)
+
+		self.assertEqual(f.getvalue(), b''.join(u.encode() + b'\n' for u in urls))
+		self.assertEqual(sorted(started), list(range(100)))
+
+	def test_failure(self):
+		'''A segment that can't be downloaded fails the whole download'''
+
+		def fetch(url):
+			if url == 'segment-5':
+				raise RuntimeError('all segment request attempts failed')
+			return b''
+
+		with self.assertRaises(RuntimeError):
+			download_segments(fetch, [f'segment-{i}' for i in range(20)], io.BytesIO(), workers=2)
+
+
+class SegmentJournalTestCase(unittest.TestCase):
+	'''A test case for the journal of a stream download'''
+
+	def setUp(self):
+		self.path = os.path.join(tempfile.mkdtemp(), 'video.mp4.part.journal')
+		self.urls = [f'https://media.helixstudios.com/scenes/seg-{i}.ts?token=abc' for i in range(20)]
+
+	def test_resume(self):
+		'''The download resumes at the first segment missing from the journal'''
+
+		journal = SegmentJournal.create(self.path, self.urls)
+		for i in range(5):
+			journal.record(i, (i + 1) * 100)
+		journal.record(7, 800)
+		journal.close()
+
+		# the access tokens change each time the playlist is downloaded
+		urls = [u.replace('abc', 'xyz') for u in self.urls]
+		loaded = SegmentJournal.load(self.path, urls)
+
+		self.assertEqual(loaded.finished_count, 6)
+		self.assertEqual(loaded.resume_index(500), 5)
+		self.assertEqual(loaded.offset(5), 500)
+
+		# data that never made it to disk is downloaded again
+		self.assertEqual(loaded.resume_index(350), 3)
+		self.assertEqual(loaded.offset(3), 300)
+
+	def test_different_stream(self):
+		'''A journal for a different list of segments must not be used'''
+
+		SegmentJournal.create(self.path, self.urls)
+		self.assertIsNone(SegmentJournal.load(self.path, self.urls[:-1]))
+		self.assertIsNone(SegmentJournal.load(self.path, list(reversed(self.urls))))
+
+	def test_download_records_segments(self):
+		'''Every segment written during the download is recorded'''
+
+		journal = SegmentJournal.create(self.path, self.urls)
+		f = io.BytesIO()
+		download_segments(lambda url: b'0123456789', self.urls, f, workers=3, journal=journal)
+		journal.close()
+
+		loaded = SegmentJournal.load(self.path, self.urls)
+		self.assertEqual(loaded.resume_index(len(f.getvalue())), len(self.urls))
+		self.assertEqual(loaded.offset(len(self.urls)), 200)
+
+
+if __name__ == '__main__':
+	unittest.main()
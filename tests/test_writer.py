@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+'''Test the download write path: preallocation, read sizing and writing.'''
+
+import io
+import os
+import unittest
+import tempfile
+import threading
+
+from helixstudios.writer import AdaptiveChunkSize
+from helixstudios.writer import WritePolicy
+from helixstudios.writer import preallocate
+from helixstudios.writer import write_response
+
+
+MB = 1024 * 1024
+
+
+class FakeRaw:
+	'''Stands in for the urllib3 response, and remembers the read sizes'''
+
+	def __init__(self, data):
+		self._data = io.BytesIO(data)
+		self.sizes = []
+
+	def read(self, amt, decode_content=True):
+		self.sizes.append(amt)
+		return self._data.read(amt)
+
+
+class FakeResponse:
+	def __init__(self, data):
+		self.raw = FakeRaw(data)
+
+
+class ShortWriteFile(io.BytesIO):
+	'''Takes at most `most` bytes per write, like an unbuffered file may'''
+
+	name = 'short.mp4'
+
+	def __init__(self, most):
+		super().__init__()
+		self.most = most
+
+	def write(self, data):
+		return super().write(memoryview(data)[:self.most])
+
+
+class AdaptiveChunkSizeTestCase(unittest.TestCase):
+	'''A test case for sizing reads by throughput'''
+
+	def test_grows_with_throughput(self):
+		'''Fast reads should make the next reads bigger, up to the maximum'''
+
+		chunk_size = AdaptiveChunkSize(64 * 1024, 8 * MB, duration=0.1)
+		self.assertEqual(chunk_size.size, 64 * 1024)
+
+		# 20MB/s -> 2MB per 0.1s, rounded down to a power of 2
+		chunk_size.update(2 * MB, 0.1)
+		self.assertEqual(chunk_size.size, 2 * MB)
+
+		for _ in range(20):
+			chunk_size.update(100 * MB, 0.1)
+		self.assertEqual(chunk_size.size, 8 * MB)
+
+	def test_shrinks_when_slow(self):
+		'''Slow reads should never go below the minimum'''
+
+		chunk_size = AdaptiveChunkSize(64 * 1024, 8 * MB, duration=0.1)
+		for _ in range(20):
+			chunk_size.update(1024, 1.0)
+		self.assertEqual(chunk_size.size, 64 * 1024)
+
+
+class WriteResponseTestCase(unittest.TestCase):
+	'''A test case for writing responses into files'''
+
+	def setUp(self):
+		self._folder = tempfile.TemporaryDirectory()
+		self.path = os.path.join(self._folder.name, 'video.mp4')
+
+	def tearDown(self):
+		self._folder.cleanup()
+
+	def test_preallocate(self):
+		'''The file should be created at its full size'''
+
+		preallocate(self.path, 3 * MB + 5)
+		self.assertEqual(os.path.getsize(self.path), 3 * MB + 5)
+
+	def test_write_range_in_place(self):
+		'''A range should be written at its offset, and stop at its end'''
+
+		preallocate(self.path, 100)
+		written = []
+
+		with open(self.path, 'r+b', buffering=0) as f:
+			position = write_response(FakeResponse(b'x' * 50), f, WritePolicy(min_chunk=16, max_chunk=16),
+									  start=10, end=29, on_chunk=written.append)
+
+		self.assertEqual(position, 30)
+		self.assertEqual(sum(written), 20)
+
+		with open(self.path, 'rb') as f:
+			data = f.read()
+		self.assertEqual(data, b'\0' * 10 + b'x' * 20 + b'\0' * 70)
+
+	def test_write_whole_response(self):
+		'''Without an end, the whole body is written'''
+
+		body = os.urandom(MB)
+		resp = FakeResponse(body)
+
+		with open(self.path, 'wb') as f:
+			position = write_response(resp, f, WritePolicy(fsync='end'))
+
+		self.assertEqual(position, MB)
+		with open(self.path, 'rb') as f:
+			self.assertEqual(f.read(), body)
+
+	def test_abort(self):
+		'''Nothing more is written once the download is aborted'''
+
+		abort = threading.Event()
+		abort.set()
+
+		with open(self.path, 'wb') as f:
+			position = write_response(FakeResponse(b'x' * 100), f, WritePolicy(), abort=abort)
+
+		self.assertEqual(position, 0)
+		self.assertEqual(os.path.getsize(self.path), 0)
+
+	def test_short_writes(self):
+		'''Every byte of a chunk is written, even if the file takes a few at a time'''
+
+		f = ShortWriteFile(most=7)
+		position = write_response(FakeResponse(b'x' * 100), f, WritePolicy(min_chunk=64, max_chunk=64))
+
+		self.assertEqual(position, 100)
+		self.assertEqual(f.getvalue(), b'x' * 100)
+
+	def test_failed_write(self):
+		'''A write that takes nothing is an error, not a hole in the file'''
+
+		with self.assertRaises(OSError):
+			write_response(FakeResponse(b'x' * 100), ShortWriteFile(most=0), WritePolicy())
+
+	def test_invalid_fsync_policy(self):
+		with self.assertRaises(ValueError):
+			WritePolicy(fsync='sometimes')
+
+
+if __name__ == '__main__':
+	unittest.main()